@@ -1,14 +1,37 @@
 
 
-from .config import Config
-from .engine import Engine
-from .extractors import register_extractor  
-from .plugins.search_plugin import register_search_plugin, get_search_plugins
+import importlib
+
+# Public names and the submodule defining each. They are imported on first
+# access, so `import metasearch` stays cheap and e.g. asyncio is only loaded
+# by programs that use AsyncEngine.
+_EXPORTS = {
+    "Config": ".config",
+    "Engine": ".engine",
+    "AsyncEngine": ".async_engine",
+    "register_extractor": ".extractors",
+    "register_search_plugin": ".plugins.search_plugin",
+    "get_search_plugins": ".plugins.search_plugin",
+}
 
 __all__ = [
     "Config",
     "Engine",
+    "AsyncEngine",
     "register_extractor",
     "register_search_plugin",
     "get_search_plugins",
 ]
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,141 @@
+# metasearch/async_engine.py
+
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .engine import Engine
+
+_DONE = object()
+
+
+class AsyncEngine:
+    """
+    asyncio front end for Engine. SQLite queries and extraction run on a
+    thread pool so the event loop is never blocked.
+
+        async with AsyncEngine(config) as engine:
+            paths = await engine.search("invoice", timeout=5)
+            async for event in engine.index("H:\\trail"):
+                print(event["status"], event["path"])
+
+    Cancelling an awaiting task, or hitting its timeout, interrupts the
+    running SQLite statement and stops indexing at the next file.
+    """
+
+    def __init__(self, config, max_workers=None):
+        self.engine = Engine(config)
+        workers = max_workers or config.read_connections + 1
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metasearch-async")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
+
+    async def _call(self, func, *args, timeout=None, cancellable=False, **kwargs):
+        cancel = threading.Event()
+        if cancellable:
+            kwargs["cancel"] = cancel
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            cancel.set()
+            raise
+
+    async def search(self, query_str, limit=20, offset=0, timeout=None, wait=None):
+        return await self._call(self.engine.search, query_str, limit, offset, wait=wait,
+                                timeout=timeout, cancellable=True)
+
+    async def search_page(self, query_str, limit=20, cursor=None, columns=("file_path",), timeout=None):
+        return await self._call(self.engine.search_page, query_str, limit, cursor, columns,
+                                timeout=timeout, cancellable=True)
+
+    async def iter_search(self, query_str, columns=None, batch_size=500):
+        """
+        Async counterpart of Engine.iter_search; rows are fetched off-loop
+        batch_size at a time.
+        """
+        cancel = threading.Event()
+        rows = self.engine.iter_search(query_str, columns=columns, cancel=cancel)
+        try:
+            while True:
+                batch = await self._call(lambda: list(itertools.islice(rows, batch_size)))
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            cancel.set()
+            await self._call(rows.close)
+
+    async def get_metadata(self, file_path):
+        return await self._call(self.engine.get_metadata, file_path)
+
+    async def annotate(self, file_path, metadata_dict):
+        return await self._call(self.engine.annotate, file_path, metadata_dict)
+
+    async def remove_file(self, file_path):
+        return await self._call(self.engine.remove_file, file_path)
+
+    async def update_index(self, directory, timeout=None):
+        return await self._call(self.engine.update_index, directory, timeout=timeout, cancellable=True)
+
+    async def index(self, directory, queue_size=1000):
+        """
+        Re-index directory, yielding a progress event per file
+        ({"path", "status", "stats"}, see pipeline.count_file) and finally
+        {"path": directory, "status": "done", "stats": {...}}. At most
+        queue_size events are buffered; a slow consumer pauses indexing.
+        Leaving the loop early cancels the run.
+        """
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue(maxsize=queue_size)
+        cancel = threading.Event()
+
+        def emit(item):
+            if cancel.is_set():
+                # Nobody reads the queue any more; do not leave a put behind.
+                return
+            put = asyncio.run_coroutine_threadsafe(events.put(item), loop)
+            while not cancel.is_set():
+                try:
+                    put.result(timeout=0.5)
+                    return
+                except concurrent.futures.TimeoutError:
+                    continue
+            put.cancel()
+
+        def work():
+            try:
+                return self.engine.update_index(directory, progress=emit, cancel=cancel)
+            finally:
+                emit(_DONE)
+
+        future = loop.run_in_executor(self._executor, work)
+        try:
+            while True:
+                event = await events.get()
+                if event is _DONE:
+                    break
+                yield event
+            stats = await future
+            yield {"path": directory, "status": "done", "stats": stats}
+        finally:
+            if not future.done():
+                cancel.set()
+                try:
+                    await future
+                except Exception:
+                    pass
+
+    async def close(self):
+        await self._call(self.engine.shutdown)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,182 @@
+# metasearch/background.py
+
+import threading
+import time
+from pathlib import Path
+
+from .pipeline import IndexCancelled
+
+
+class SearchResult(list):
+    """
+    A list of results plus `status`, the index coverage at query time (see
+    BackgroundIndexer.status). `complete` is False while some scan roots
+    have not been indexed yet, i.e. the results may be partial.
+    """
+
+    def __init__(self, items=(), status=None):
+        super().__init__(items)
+        self.status = status or {}
+
+    @property
+    def complete(self):
+        return self.status.get("complete", True)
+
+
+class BackgroundIndexer:
+    """
+    Indexes the scan roots that have never been completely indexed on a
+    daemon thread, so queries are answered from what is indexed now instead
+    of waiting for a full directory walk. Roots are indexed one at a time
+    and marked completed in indexed_dirs when done.
+
+    A root is claimed while it is being indexed, here or by
+    Engine.iter_matches, so no root is indexed twice at once; listeners are
+    called with the metadata of every file the background run indexes.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.roots = [str(Path(directory).resolve()) for directory in engine.config.scan_paths]
+        self.current = None
+        self.files_seen = 0
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self._claimed = set()
+        self._listeners = []
+        self._thread = None
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stop = threading.Event()
+
+    def pending(self):
+        indexed = self.engine.storage.get_indexed_roots()
+        return [root for root in self.roots if root not in indexed]
+
+    def start(self):
+        """
+        Start indexing pending roots unless that is already under way.
+        Returns True while indexing is in progress.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return True
+            if self._stop.is_set() or not self.pending():
+                return False
+            self._idle.clear()
+            self._thread = threading.Thread(target=self._run, name="metasearch-lazy-index", daemon=True)
+            self._thread.start()
+            return True
+
+    def wait(self, timeout, cancel=None):
+        """
+        Wait up to timeout seconds for the background run to finish; returns
+        True if it did. Setting cancel stops waiting (not the indexing).
+        """
+        deadline = time.monotonic() + timeout
+        while not self._idle.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancel is not None and cancel.is_set()):
+                return False
+            self._idle.wait(min(remaining, 0.1))
+        return True
+
+    def claim(self, roots):
+        """
+        Claim the roots nobody is indexing yet and return them; each must be
+        handed back with release() once indexed (or given up).
+        """
+        with self._lock:
+            free = [root for root in roots if root not in self._claimed]
+            self._claimed.update(free)
+            return free
+
+    def release(self, root):
+        with self._lock:
+            self._claimed.discard(root)
+            self._released.notify_all()
+
+    def wait_released(self, roots, cancel=None):
+        """
+        Wait until none of roots is claimed any more; returns False if cancel
+        was set first.
+        """
+        with self._lock:
+            while any(root in self._claimed for root in roots):
+                if cancel is not None and cancel.is_set():
+                    return False
+                self._released.wait(0.1)
+            return True
+
+    def add_listener(self, callback):
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            self._listeners.remove(callback)
+
+    def _on_indexed(self, metadata):
+        for callback in list(self._listeners):
+            callback(metadata)
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def status(self):
+        """
+        Return {"complete", "coverage", "pending", "indexing", "files_seen",
+        "indexed_at"}: whether every scan root is indexed, the fraction that
+        is, the roots still missing, the root being indexed now (and how many
+        of its files were processed so far) and when each root was last
+        indexed.
+        """
+        indexed = self.engine.storage.get_indexed_roots()
+        pending = [root for root in self.roots if root not in indexed]
+        done = len(self.roots) - len(pending)
+        return {
+            "complete": not pending,
+            "coverage": done / len(self.roots) if self.roots else 1.0,
+            "pending": pending,
+            "indexing": self.current,
+            "files_seen": self.files_seen if self.current else 0,
+            "indexed_at": {root: indexed[root] for root in self.roots if root in indexed},
+        }
+
+    def _progress(self, event):
+        self.files_seen += 1
+
+    def _run(self):
+        failed = set()
+        try:
+            while not self._stop.is_set():
+                pending = [root for root in self.pending() if root not in failed]
+                if not pending:
+                    break
+                root = next((root for root in pending if self.claim([root])), None)
+                if root is None:
+                    # iter_matches is indexing every pending root; see whether it completes them.
+                    self.wait_released(pending, self._stop)
+                    continue
+                self.current, self.files_seen = root, 0
+                print(f"New or incomplete directory detected: {root}. Indexing in the background...")
+                try:
+                    stats = self.engine.index_directory(root, progress=self._progress, cancel=self._stop,
+                                                        on_indexed=self._on_indexed)
+                    self.engine.storage.add_indexed_directory(root, status="completed")
+                except IndexCancelled:
+                    break
+                except Exception as e:
+                    print(f"[ERROR] Background indexing of {root}: {e}")
+                    failed.add(root)
+                    continue
+                finally:
+                    self.current = None
+                    self.release(root)
+                print(f"Indexed {root}: {stats}")
+        finally:
+            self.current = None
+            self._idle.set()
@@ -0,0 +1,101 @@
+# metasearch/cache.py
+
+import os
+
+from .dedupe import copy_metadata
+from .extractors import extractor_id
+from .fingerprint import stat_fingerprint
+
+
+class ExtractionCache:
+    """
+    Per-run front end of the extractor_cache table (Config.extractor_cache_bytes).
+    Extractor output is keyed by the file fingerprint (size, mtime_ns, inode,
+    device) and "extractor@version", so a full re-index, a renamed file or
+    a rolled back extractor reuse earlier results, while files handled by an
+    extractor whose version changed miss and are extracted again. The key
+    also covers the text limits in effect (see extractors.build_text_limits),
+    so output truncated under other max_text_bytes / max_text_chars /
+    text_window settings is not reused.
+
+    New entries and hits are written every `flush_size` files; leaving the
+    context writes the rest and evicts least recently used entries beyond
+    max_bytes. With max_bytes 0 the cache is disabled and does nothing.
+
+        with ExtractionCache(storage, max_bytes) as cache:
+            metadata = cache.lookup(file_path) or extract(file_path)
+    """
+
+    def __init__(self, storage, max_bytes, text_limits=None, flush_size=500):
+        self.storage = storage
+        self.max_bytes = max_bytes
+        self.flush_size = flush_size
+        self._limits_key = _limits_key(text_limits)
+        self._entries = []
+        self._hits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish()
+        return False
+
+    def lookup(self, file_path, stat_result=None):
+        """
+        Return metadata for file_path rebuilt from a cached extraction, or None.
+        """
+        if not self.max_bytes:
+            return None
+        if stat_result is None:
+            stat_result = os.stat(file_path)
+        fingerprint = stat_fingerprint(stat_result)
+        extractor = extractor_id(file_path) + self._limits_key
+        cached = self.storage.get_cached_extraction(fingerprint, extractor)
+        if cached is None:
+            return None
+        metadata = copy_metadata(cached, file_path, stat_result)
+        # Same fingerprint, same bytes: the stored hash still applies.
+        if cached.get("content_hash"):
+            metadata["content_hash"] = cached["content_hash"]
+        self._hits.append((fingerprint, extractor))
+        self._maybe_flush()
+        return metadata
+
+    def store(self, metadata):
+        """
+        Cache freshly extracted metadata (skipped if it lacks a fingerprint).
+        """
+        fingerprint = tuple(metadata.get(key) for key in ("size_bytes", "mtime_ns", "inode", "device"))
+        extractor = metadata.get("extractor")
+        if not self.max_bytes or extractor is None or None in fingerprint:
+            return
+        extractor += self._limits_key
+        self._entries.append((fingerprint, extractor, metadata))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._entries) + len(self._hits) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        if self._entries or self._hits:
+            entries, hits = self._entries, self._hits
+            self._entries, self._hits = [], []
+            self.storage.cache_extractions(entries, hits)
+
+    def finish(self):
+        if not self.max_bytes:
+            return
+        self.flush()
+        evicted = self.storage.evict_extraction_cache(self.max_bytes)
+        if evicted:
+            print(f"[INFO] Evicted {evicted} extractor cache entries")
+
+
+def _limits_key(text_limits):
+    # "#type=max_bytes,max_chars,window;..." appended to the extractor id.
+    if not text_limits:
+        return ""
+    return "#" + ";".join(f"{file_type}={limits.max_bytes},{limits.max_chars},{limits.window}"
+                          for file_type, limits in sorted(text_limits.items()))
@@ -1,16 +1,160 @@
 # metasearch/config.py
 
+# Directories that are almost never worth indexing.
+DEFAULT_SCAN_EXCLUDE = [".git", ".hg", ".svn", "node_modules", "__pycache__"]
+
+
 class Config:
-    def __init__(self, storage_backend="sqlite", scan_paths=None, enable_watchdog=False, db_path="metasearch.db", lazy_indexing=True):
+    def __init__(self, storage_backend="sqlite", scan_paths=None, enable_watchdog=False, db_path="metasearch.db", lazy_indexing=True,
+                 lazy_index_wait=0.0,
+                 incremental_indexing=True, hash_contents=False,
+                 write_batch_size=1000, write_flush_interval=2.0,
+                 index_workers=1, index_executor="process", index_queue_size=256, extract_timeout=120,
+                 extract_memory_limit=None, extractor_limits=None, extract_isolation=False,
+                 quarantine_backoff=600, quarantine_max_backoff=7 * 86400,
+                 scan_include=None, scan_exclude=None, scan_max_depth=None, min_file_size=None, max_file_size=None,
+                 follow_symlinks=False, skip_hidden=False, same_filesystem=False,
+                 skip_unchanged_dirs=True, trust_dir_mtime=False,
+                 watch_debounce=1.0, watch_batch_size=500,
+                 sqlite_pragmas=None, read_connections=4,
+                 max_text_bytes=16 * 1024 * 1024, max_text_chars=2_000_000, text_window="head", text_limits=None,
+                 metadata_compression=None,
+                 dedupe_contents=False,
+                 extractor_cache_bytes=0,
+                 read_only=False, immutable=False,
+                 plugin_timeout=0.5, plugin_workers=4, plugin_batch_size=500, plugin_backfill=False):
         """
         storage_backend: Only "sqlite" is supported here.
         scan_paths: List of directory paths to scan (e.g., ["H:\\exam", "H:\\trail", "C:\\abc", "M:\\value"]).
         enable_watchdog: If True, enables real‐time filesystem monitoring.
         db_path: Path for the SQLite database file.
-        lazy_indexing: If True, triggers indexing for directories not yet indexed or marked as incomplete.
+        lazy_indexing: If True, searches start a background indexer for scan paths not yet indexed
+            (or left incomplete) and return what is already indexed.
+        lazy_index_wait: Seconds a search that found nothing waits for that background indexing
+            before re-running the query (0 = never wait).
+        incremental_indexing: If True, re-indexing skips files whose stored fingerprint
+            (size, mtime_ns, inode, device) is unchanged and purges rows for deleted files.
+        hash_contents: If True, also store a content hash so files that were only touched
+            (new mtime, same bytes) are not re-extracted.
+        write_batch_size: Number of writes grouped into one transaction while indexing.
+        write_flush_interval: Seconds after which a partially filled write batch is committed anyway.
+        index_workers: Number of parallel extraction workers; 1 keeps indexing serial.
+        index_executor: "process" or "thread" pool for parallel extraction. Extractors registered
+            at runtime are only visible to process workers on platforms that fork.
+        index_queue_size: Maximum number of extractions in flight (and pending writes) before
+            the scanner waits.
+        extract_timeout: Seconds a single extraction may run. Parallel or isolated extractions
+            are abandoned after it (process workers are killed); in serial, in-process indexing only
+            external tools such as ffprobe can be stopped.
+        extract_memory_limit: Address-space cap in bytes for extraction worker processes
+            (index_executor="process" or extract_isolation; needs the resource module, i.e. Unix).
+        extractor_limits: Per-extension overrides, e.g. {".pdf": {"timeout": 30, "memory": 1 << 30}}.
+        extract_isolation: If True, extraction always runs in worker processes, even with
+            index_workers=1, so timeouts and memory caps apply and a crashing extractor cannot
+            take the indexer down.
+        quarantine_backoff / quarantine_max_backoff: A file whose extraction failed, timed out or
+            crashed its worker is skipped for quarantine_backoff seconds, doubling with every further
+            failure up to quarantine_max_backoff, unless its size or mtime changes.
+        scan_include: Glob patterns (matched against the file name or the path relative to the
+            scan root); when set, only matching files are indexed.
+        scan_exclude: Glob patterns for files and directories to skip; excluded directories are
+            not descended into. Defaults to DEFAULT_SCAN_EXCLUDE.
+        scan_max_depth: Maximum directory depth below a scan root (0 = only top-level files).
+        min_file_size / max_file_size: Skip files outside this size range in bytes.
+        follow_symlinks: If False, symbolic links are skipped; if True they are followed.
+        skip_hidden: If True, skip dot-files and (on Windows) files with the hidden attribute.
+        same_filesystem: If True, do not cross into other mounted filesystems.
+        skip_unchanged_dirs: If True, incremental scans record every directory's mtime and do not
+            re-list directories whose mtime is unchanged; their known files are still stat'ed.
+            Changes to the scan options only apply to directories that are listed again;
+            directories holding files skipped for their size are listed on every pass.
+        trust_dir_mtime: If True, files in unchanged directories are assumed unchanged without
+            a stat() (suited to archives whose files are never modified in place).
+        watch_debounce: Seconds a watched file must stay quiet (no events, same size and mtime)
+            before it is re-extracted; events for the same path within the window are coalesced.
+        watch_batch_size: Maximum number of watched changes applied per transaction.
+        sqlite_pragmas: Dict of PRAGMA overrides merged over storage.DEFAULT_PRAGMAS
+            (WAL journal, synchronous=NORMAL, 64 MiB cache, 256 MiB mmap, in-memory temp store).
+        read_connections: Size of the read-only connection pool used by searches; searches from
+            more threads than this wait for a free connection.
+        max_text_bytes: Bytes read from a text file at most; larger files are read in chunks up to
+            this budget and the encoding is detected from a leading sample only.
+        max_text_chars: Characters of extracted text (full_text, snippets) kept per file.
+        text_window: "head" keeps the start of an oversized file, "head_tail" half of the budget
+            from the start and half from the end (e.g. for logs). Truncated files get
+            text_truncated=True in their metadata.
+        text_limits: Per file_type overrides, e.g. {"text": {"max_bytes": 1048576},
+            "docx": {"max_chars": 200000, "window": "head_tail"}}.
+        metadata_compression: None, "zlib" or "zstd" (needs the zstandard package) to compress the
+            stored metadata JSON. Extracted text is kept once, uncompressed, in the full_text column
+            that the full-text index reads.
+        dedupe_contents: If True, a file whose size matches an indexed file is hashed, and if the
+            contents are identical the already extracted metadata is copied instead of running
+            the extractor again. Enables Engine.find_duplicates() to report such groups.
+        extractor_cache_bytes: Size of the persistent cache of extractor output, keyed by file
+            fingerprint and extractor version (0 = disabled). Full re-indexes and renamed files
+            reuse cached results; least recently used entries beyond the size are evicted.
+            Independently of the cache, files are re-extracted when the version their extractor
+            was registered with changes (see register_extractor).
+        read_only: If True, the engine only queries an existing index: SQLite is opened with
+            mode=ro, no schema is created or migrated, no watcher or lazy indexing is started, and
+            methods that index or write raise RuntimeError.
+        immutable: With read_only, also open the database with immutable=1 (no locking or change
+            detection), for snapshots that nothing writes to while they are open, e.g. one file
+            shared by many search replicas.
+        plugin_timeout: Seconds Engine.search waits for each registered search plugin, which run in
+            parallel with the SQL query; a plugin that answers later is left out of the result (a
+            plugin's own `timeout` attribute overrides this).
+        plugin_workers: Threads that run plugin searches.
+        plugin_batch_size: Indexed or removed files handed to the search plugins at a time.
+        plugin_backfill: If True, every registered search plugin is loaded with the files already
+            in the database by a background thread when the Engine starts (also for read_only
+            engines), and searches skip it until then. If False, plugins only learn about files
+            this Engine indexes or removes; search results still come from the database as well.
         """
         self.storage_backend = storage_backend
         self.scan_paths = scan_paths or []
         self.enable_watchdog = enable_watchdog
         self.db_path = db_path
         self.lazy_indexing = lazy_indexing
+        self.lazy_index_wait = lazy_index_wait
+        self.incremental_indexing = incremental_indexing
+        self.hash_contents = hash_contents
+        self.write_batch_size = write_batch_size
+        self.write_flush_interval = write_flush_interval
+        self.index_workers = index_workers
+        self.index_executor = index_executor
+        self.index_queue_size = index_queue_size
+        self.extract_timeout = extract_timeout
+        self.extract_memory_limit = extract_memory_limit
+        self.extractor_limits = extractor_limits
+        self.extract_isolation = extract_isolation
+        self.quarantine_backoff = quarantine_backoff
+        self.quarantine_max_backoff = quarantine_max_backoff
+        self.scan_include = scan_include
+        self.scan_exclude = DEFAULT_SCAN_EXCLUDE if scan_exclude is None else scan_exclude
+        self.scan_max_depth = scan_max_depth
+        self.min_file_size = min_file_size
+        self.max_file_size = max_file_size
+        self.follow_symlinks = follow_symlinks
+        self.skip_hidden = skip_hidden
+        self.same_filesystem = same_filesystem
+        self.skip_unchanged_dirs = skip_unchanged_dirs
+        self.trust_dir_mtime = trust_dir_mtime
+        self.watch_debounce = watch_debounce
+        self.watch_batch_size = watch_batch_size
+        self.sqlite_pragmas = sqlite_pragmas
+        self.read_connections = read_connections
+        self.max_text_bytes = max_text_bytes
+        self.max_text_chars = max_text_chars
+        self.text_window = text_window
+        self.text_limits = text_limits
+        self.metadata_compression = metadata_compression
+        self.dedupe_contents = dedupe_contents
+        self.extractor_cache_bytes = extractor_cache_bytes
+        self.read_only = read_only
+        self.immutable = immutable
+        self.plugin_timeout = plugin_timeout
+        self.plugin_workers = plugin_workers
+        self.plugin_batch_size = plugin_batch_size
+        self.plugin_backfill = plugin_backfill
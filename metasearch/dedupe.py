@@ -0,0 +1,147 @@
+# metasearch/dedupe.py
+
+import os
+from collections import OrderedDict, defaultdict
+
+from .extractors import extractor_id, inherent_metadata, stat_hint
+from .fingerprint import content_hash
+
+# Metadata key listing the keys added by Engine.annotate; they belong to one
+# path and are never copied to its duplicates.
+ANNOTATIONS_KEY = "_annotations"
+
+
+def copy_metadata(source, file_path, stat_result=None):
+    """
+    Build the metadata of file_path from the extracted metadata of an
+    identical file: its own inherent (path/stat) fields, the extracted ones
+    of source, without source's annotations.
+    """
+    annotated = set(source.get(ANNOTATIONS_KEY, ()))
+    metadata = {key: value for key, value in source.items() if key not in annotated and key != ANNOTATIONS_KEY}
+    full_text = metadata.get("full_text")
+    if annotated and isinstance(full_text, str):
+        # Engine.annotate appended " key:value" for every annotation.
+        for key in annotated & source.keys():
+            pair = f"{key}:{source[key]}"
+            full_text = full_text.replace(" " + pair, "").replace(pair, "")
+        metadata["full_text"] = full_text.strip()
+    for key in ("inherent_error", "content_hash"):
+        metadata.pop(key, None)
+    with stat_hint(file_path, stat_result):
+        metadata.update(inherent_metadata(file_path))
+    return metadata
+
+
+def is_unmodified(file_path, size, mtime_ns=None):
+    """
+    True if file_path still has the size (and mtime_ns, if given) it was
+    indexed with, i.e. its stored metadata describes the bytes on disk.
+    """
+    try:
+        stat_result = os.stat(file_path)
+    except OSError:
+        return False
+    return stat_result.st_size == size and (mtime_ns is None or stat_result.st_mtime_ns == mtime_ns)
+
+
+def hash_size_collisions(storage, min_size=1):
+    """
+    Store a content hash for every unmodified indexed file that shares its
+    size with another one and has none yet. Returns the number hashed.
+    """
+    hashes = {}
+    for size, rows in storage.get_size_collisions(min_size).items():
+        for file_path, digest, mtime_ns in rows:
+            if digest is None and is_unmodified(file_path, size, mtime_ns):
+                try:
+                    hashes[file_path] = content_hash(file_path)
+                except OSError:
+                    continue
+    if hashes:
+        storage.set_content_hashes(hashes)
+    return len(hashes)
+
+
+class ContentDeduper:
+    """
+    Per-run helper for Config.dedupe_contents. A file is only hashed when
+    another indexed (or already seen in this run) file has the same size;
+    if one of those has the same content hash, its extracted metadata is
+    copied instead of running the extractor again.
+
+    Metadata extracted during the run is kept for the last `recent_size`
+    files, so copies are found before their original has been written.
+    """
+
+    def __init__(self, storage, recent_size=256):
+        self.storage = storage
+        self.recent_size = recent_size
+        self._sizes = defaultdict(list)
+        self._hashes = {}
+        self._recent = OrderedDict()
+
+    def _hash(self, file_path):
+        digest = self._hashes.get(file_path)
+        if digest is None:
+            try:
+                digest = content_hash(file_path)
+            except OSError:
+                return None
+            self._hashes[file_path] = digest
+        return digest
+
+    def digest(self, file_path):
+        """
+        Return the content hash computed for file_path in this run, if any.
+        """
+        return self._hashes.get(file_path)
+
+    def find_copy(self, file_path, stat_result=None):
+        """
+        Return (metadata, digest): metadata copied from an identical file, or
+        None if there is none (digest is then the hash of file_path if it had
+        to be computed, else None).
+        """
+        size = stat_result.st_size if stat_result is not None else os.path.getsize(file_path)
+        candidates = self.storage.get_same_size(size, file_path)
+        candidates.extend((path, self._hashes.get(path), None) for path in self._sizes.get(size, ())
+                          if path != file_path)
+        self._sizes[size].append(file_path)
+        if not candidates:
+            return None, None
+        digest = self._hash(file_path)
+        if digest is None:
+            return None, None
+        for path, other, mtime_ns in candidates:
+            if other is None and path not in self._recent:
+                # Indexed before its size collided with another file. Its stored
+                # metadata only describes the bytes on disk if it is unmodified.
+                if not is_unmodified(path, size, mtime_ns):
+                    continue
+                other = self._hash(path)
+                if other is not None:
+                    self.storage.set_content_hash(path, other)
+            elif other is None:
+                other = self._hash(path)
+            if other != digest:
+                continue
+            source = self._recent.get(path) or self.storage.get_metadata(path)
+            # Identical bytes under another extension may go to another extractor.
+            if source is not None and source.get("extractor") == extractor_id(file_path):
+                return copy_metadata(source, file_path, stat_result), digest
+        return None, digest
+
+    def add(self, metadata):
+        """
+        Record freshly extracted (or copied) metadata, filling in the content
+        hash computed by find_copy.
+        """
+        file_path = metadata.get("file_path")
+        digest = self._hashes.get(file_path)
+        if digest is not None:
+            metadata.setdefault("content_hash", digest)
+        self._recent[file_path] = metadata
+        self._recent.move_to_end(file_path)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
@@ -1,40 +1,66 @@
 # metasearch/engine.py
 
+import itertools
 import os
+import queue
+import threading
+import time
 import datetime
+from contextlib import closing
 from pathlib import Path
 from .config import Config
-from .scanner import scan_directory
-from .extractors import get_extractor_for
+from .scanner import scan_entries, DirectorySnapshot
+from .extractors import build_text_limits, extractor_id
 from .storage import Storage
 from .query_engine import QueryEngine
-
-try:
-    from .watchers import Watcher
-    WATCHDOG_AVAILABLE = True
-except ImportError:
-    WATCHDOG_AVAILABLE = False
+from .fingerprint import stat_fingerprint, content_hash
+from .quarantine import Quarantine
+from .pipeline import IndexCancelled, IndexPipeline, check_cancelled, count_file, extract_file
+from .background import BackgroundIndexer, SearchResult
+from .cache import ExtractionCache
+from .dedupe import ANNOTATIONS_KEY, ContentDeduper, hash_size_collisions
+from .plugins.search_plugin import PluginFeed, merge_ranked
+from .query_parser import split_free_text
 
 class Engine:
     def __init__(self, config: Config):
         self.config = config
-        self.storage = Storage(config.db_path)
+        self.storage = Storage(config.db_path, config.sqlite_pragmas, config.read_connections,
+                               config.metadata_compression, config.read_only, config.immutable)
+        self.text_limits = build_text_limits(config.max_text_bytes, config.max_text_chars,
+                                             config.text_window, config.text_limits)
         self.query_engine = QueryEngine(self.storage)
+        self._indexer = BackgroundIndexer(self)
+        self.plugins = PluginFeed(self.storage, config.plugin_batch_size, config.plugin_backfill)
+        self.plugins.start()
+        self._plugin_executor = None
         self._watcher = None
-        if self.config.enable_watchdog and WATCHDOG_AVAILABLE:
-            self._watcher = Watcher(self.config.scan_paths, self)
-            self._watcher.start()
+        if self.config.enable_watchdog and not self.config.read_only:
+            self._watcher = self._start_watcher()
+    
+    def _check_writable(self):
+        if self.config.read_only:
+            raise RuntimeError("This Engine was created with read_only=True and cannot index or write")
+    
+    def _start_watcher(self):
+        # watchdog is optional and only imported when watching is enabled.
+        try:
+            from .watchers import Watcher
+        except ImportError as e:
+            print(f"[WARN] enable_watchdog requires the watchdog package: {e}")
+            return None
+        watcher = Watcher(self.config.scan_paths, self)
+        watcher.start()
+        return watcher
     
     def _is_metadata_empty(self):
         try:
-            cur = self.storage.conn.execute("SELECT COUNT(*) FROM files")
-            count = cur.fetchone()[0]
-            return count == 0
+            return self.storage.count_files() == 0
         except Exception as e:
             print(f"Error checking metadata count: {e}")
             return True
     
-    def _trigger_index_for_new_dirs(self):
+    def _trigger_index_for_new_dirs(self, cancel=None):
         """
         Compares each directory in config.scan_paths (normalized) with those in the indexed_dirs table.
         Indexes any directory that is not already marked as 'completed'.
@@ -46,77 +72,380 @@ class Engine:
         for norm_dir in normalized_paths:
             if norm_dir not in indexed_dirs:
                 print(f"New or incomplete directory detected: {norm_dir}. Indexing...")
-                self.index_directory(norm_dir)
+                self.index_directory(norm_dir, cancel=cancel)
                
                 self.storage.add_indexed_directory(norm_dir, status="completed")
     
-    def index_directory(self, directory):
-        for file_path in scan_directory(directory):
-            self.process_file(file_path)
+    def index_directory(self, directory, incremental=None, progress=None, cancel=None, on_indexed=None):
+        """
+        Index every file under directory and return a dict with the number of
+        files added, changed, unchanged and deleted (plus extraction errors).
+        In incremental mode a file whose stored fingerprint (size, mtime_ns,
+        inode, device) still matches its stat() result is not re-extracted.
+        Rows for files that have disappeared from directory are purged.
+        Writes are grouped into transactions of config.write_batch_size.
+        With config.index_workers > 1 extraction runs in an IndexPipeline.
+        progress, if given, is called with an event dict for every file (see
+        pipeline.count_file); setting the cancel threading.Event stops the run
+        with IndexCancelled. on_indexed is called with the metadata of every
+        file that was (re-)extracted, once it is queued for writing; the
+        registered search plugins are fed the same metadata (see PluginFeed).
+        With config.dedupe_contents, files identical to an indexed one get a
+        copy of its metadata instead of being extracted again. A file is also
+        re-extracted when the version of its extractor changed; with
+        config.extractor_cache_bytes earlier results of the same extractor
+        version for the same fingerprint are reused.
+        Files whose extraction fails are quarantined and counted as
+        "quarantined" instead of being retried until their backoff expires
+        (or they change). With config.extract_isolation extraction always
+        runs in worker processes, even with one worker.
+        """
+        self._check_writable()
+        # The scanner yields real paths; stored paths and directory states must match them.
+        directory = os.path.realpath(directory)
+        if incremental is None:
+            incremental = self.config.incremental_indexing
+        if self.config.index_workers > 1 or self.config.extract_isolation:
+            return IndexPipeline(self, progress, cancel, on_indexed).run(directory, incremental)
+        stats = {"added": 0, "changed": 0, "unchanged": 0, "deleted": 0, "errors": 0, "quarantined": 0}
+        known = self.storage.get_fingerprints(directory)
+        seen = set()
+        deduper = self._deduper()
+        quarantine = self._quarantine(directory)
+        entries, dir_records = self._scan(directory, known, incremental, quarantine.paths())
+        with self._write_batch() as batch, self._extraction_cache() as cache:
+            for file_path, stat_result, trusted in entries:
+                check_cancelled(cancel)
+                seen.add(file_path)
+                stored = known.get(file_path)
+                if incremental and stored is not None and self._is_unchanged(
+                        file_path, stored, batch, stat_result, trusted):
+                    count_file(stats, "unchanged", file_path, progress)
+                    continue
+                if quarantine.should_skip(file_path, stat_result):
+                    count_file(stats, "quarantined", file_path, progress)
+                    continue
+                metadata = self._extract(file_path, stat_result, deduper, cache, quarantine)
+                if metadata is None:
+                    count_file(stats, "errors", file_path, progress)
+                    continue
+                quarantine.succeeded(file_path)
+                if deduper is not None:
+                    deduper.add(metadata)
+                batch.add(metadata)
+                self.plugins.add(metadata)
+                print(f"Indexed: {file_path}")
+                count_file(stats, "added" if stored is None else "changed", file_path, progress)
+                if on_indexed is not None:
+                    on_indexed(metadata)
+            for file_path in known:
+                if file_path not in seen:
+                    batch.remove(file_path)
+                    self.plugins.remove(file_path)
+                    count_file(stats, "deleted", file_path, progress)
+            quarantine.forget_missing(seen)
+        self.plugins.flush()
+        if dir_records is not None:
+            self.storage.save_directory_states(directory, dir_records)
+        return stats
+    
+    def _scan(self, directory, known, incremental, quarantined=()):
+        """
+        Return (entries, dir_records) for a pass over directory. With
+        config.skip_unchanged_dirs, directories whose mtime matches the last
+        pass are not listed again and dir_records collects the new states to
+        save once the pass completes; otherwise dir_records is None. The
+        quarantined paths are taken from the snapshot like indexed files, so
+        they are retried even when their directory is skipped.
+        """
+        if not (incremental and self.config.skip_unchanged_dirs):
+            return scan_entries(directory, self.config), None
+        file_paths = [*known, *(path for path in quarantined if path not in known)]
+        snapshot = DirectorySnapshot(self.storage.get_directory_states(directory), file_paths)
+        dir_records = {}
+        return scan_entries(directory, self.config, snapshot, dir_records), dir_records
+    
+    def _write_batch(self):
+        return self.storage.write_batch(self.config.write_batch_size, self.config.write_flush_interval)
+    
+    def _is_unchanged(self, file_path, stored, batch, stat_result=None, trusted=False):
+        """
+        True if file_path need not be re-extracted: its stored fingerprint
+        (or content hash) matches and it was extracted by the current version
+        of its extractor. trusted skips the stat comparison.
+        """
+        if stored[5] is not None and stored[5] != extractor_id(file_path):
+            return False
+        if trusted:
+            return True
+        if stat_result is None:
+            try:
+                stat_result = os.stat(file_path)
+            except OSError:
+                return False
+        fingerprint = stat_fingerprint(stat_result)
+        if fingerprint == stored[:4]:
+            return True
+        if self.config.hash_contents and stored[4] and stat_result.st_size == stored[0]:
+            try:
+                if content_hash(file_path) == stored[4]:
+                    batch.update_fingerprint(file_path, *fingerprint)
+                    return True
+            except OSError:
+                pass
+        return False
     
     def index_all_directories(self):
         for directory in self.config.scan_paths:
             norm_dir = str(Path(directory).resolve())
-            self.index_directory(norm_dir)
+            stats = self.index_directory(norm_dir)
+            print(f"Indexed {norm_dir}: {stats}")
             self.storage.add_indexed_directory(norm_dir, status="completed")
     
+    def _deduper(self):
+        return ContentDeduper(self.storage) if self.config.dedupe_contents else None
+    
+    def _extraction_cache(self):
+        return ExtractionCache(self.storage, self.config.extractor_cache_bytes, self.text_limits)
+    
+    def _quarantine(self, directory):
+        return Quarantine(self.storage, directory, self.config.quarantine_backoff,
+                          self.config.quarantine_max_backoff)
+    
+    def _extract_limits(self, file_path):
+        """
+        Return (timeout, memory_limit) for extracting file_path: the
+        config.extractor_limits entry of its extension over extract_timeout
+        and extract_memory_limit.
+        """
+        limits = (self.config.extractor_limits or {}).get(Path(file_path).suffix.lower(), {})
+        return (limits.get("timeout", self.config.extract_timeout),
+                limits.get("memory", self.config.extract_memory_limit))
+    
+    def _extract(self, file_path, stat_result=None, deduper=None, cache=None, quarantine=None):
+        """
+        Run the registered extractor for file_path (or reuse a cached result,
+        or copy the metadata of an identical file found by deduper); returns
+        None on failure, which is recorded in quarantine if given.
+        """
+        try:
+            if cache is not None:
+                metadata = cache.lookup(file_path, stat_result)
+                if metadata is not None:
+                    return metadata
+            if deduper is not None:
+                metadata, _ = deduper.find_copy(file_path, stat_result)
+                if metadata is not None:
+                    return metadata
+            timeout = self._extract_limits(file_path)[0]
+            metadata = extract_file(file_path, self.config.hash_contents, stat_result, self.text_limits, timeout)
+            if cache is not None:
+                cache.store(metadata)
+            return metadata
+        except Exception as e:
+            print(f"Error processing {file_path}: {e}")
+            if quarantine is not None:
+                quarantine.failed(file_path, e, stat_result)
+            return None
+    
     def process_file(self, file_path):
-        extractor = get_extractor_for(file_path)
+        """
+        Extract and store metadata for one file. Returns True on success.
+        """
+        self._check_writable()
+        metadata = self._extract(file_path)
+        if metadata is None:
+            return False
         try:
-            metadata = extractor(file_path)
             self.storage.save_metadata(metadata)
-            print(f"Indexed: {file_path}")
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
+            return False
+        self.plugins.add(metadata)
+        self.plugins.flush()
+        print(f"Indexed: {file_path}")
+        return True
     
-    def search(self, query_str):
+    def search(self, query_str, limit=20, offset=0, cancel=None, wait=None):
         """
-        First, check the database for results matching the query.
-        If results exist, return them immediately.
-        Otherwise, trigger indexing for new/incomplete directories and then re-run the query.
+        Return at most `limit` matching file paths (None for all), skipping
+        the first `offset`, from what is indexed right now.
+        Registered search plugins get the plain free-text terms of the query
+        and run in parallel with the SQL query, each within
+        config.plugin_timeout. Their hits are kept only if they satisfy the
+        rest of the query; the lists are merged without duplicates and
+        ranked by merge_ranked.
+        With lazy indexing, scan roots that were never indexed are indexed
+        by a background thread; a query without results waits up to `wait`
+        seconds (default config.lazy_index_wait) for it and is then re-run.
+        The result is a SearchResult list whose .status tells whether the
+        index covered every scan root.
+        Setting the optional cancel threading.Event aborts the query.
         """
-        results = self.query_engine.search(query_str)
-        if results and len(results) > 0:
-            ans  = []
-            for contain in results :
-                ans.append(contain['file_path'])
-            return ans
-        
-        self._trigger_index_for_new_dirs()
-        finally_results = []
-        for contain in  self.query_engine.search(query_str) :
-                finally_results.append(contain['file_path'])
-        return finally_results
+        results = self._search_paths(query_str, limit, offset, cancel)
+        if self.config.lazy_indexing and not self.config.read_only and self._indexer.start():
+            wait = self.config.lazy_index_wait if wait is None else wait
+            if not results and wait:
+                self._indexer.wait(wait, cancel)
+                results = self._search_paths(query_str, limit, offset, cancel)
+        return SearchResult(results, self._indexer.status())
     
-    def search_first_match(self, query_str):
+    def _search_paths(self, query_str, limit, offset, cancel=None):
+        plugins = self.plugins.plugins()
+        text = None
+        if plugins:
+            text, where, params = split_free_text(query_str, self.storage.fts_enabled)
+        if text is None:
+            # No plugins, or nothing they could match (only fields, ranges, OR / NOT, prefixes).
+            rows = self.query_engine.search(query_str, limit=limit, offset=offset, columns=("file_path",),
+                                            cancel=cancel)
+            return [row["file_path"] for row in rows]
+        # Every source returns its top offset + limit; the merged list is sliced.
+        depth = None if limit is None else offset + limit
+        started = time.monotonic()
+        searches = self.plugins.submit(self._plugin_pool(), plugins, text, depth)
+        rows = self.query_engine.search(query_str, limit=depth, columns=("file_path",), cancel=cancel)
+        plugin_lists = self.plugins.collect(searches, self.config.plugin_timeout, started)
+        if plugin_lists:
+            matching = self.storage.filter_paths({path for paths in plugin_lists for path in paths},
+                                                 where, params, cancel)
+            plugin_lists = [[path for path in paths if path in matching] for paths in plugin_lists]
+        paths = merge_ranked([[row["file_path"] for row in rows], *plugin_lists])
+        return paths[offset:] if limit is None else paths[offset:offset + limit]
+    
+    def _plugin_pool(self):
+        # Created on first use, like the other concurrent.futures executors.
+        if self._plugin_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._plugin_executor = ThreadPoolExecutor(max_workers=self.config.plugin_workers,
+                                                       thread_name_prefix="metasearch-plugin")
+        return self._plugin_executor
+    
+    def index_status(self):
         """
-        First checks the database for a matching file.
-        If none are found, it then triggers incremental indexing of directories,
-        and after each file is processed, it tests if that file matches the query.
-        As soon as a match is found, it returns that file's metadata.
+        Report index coverage and freshness, see BackgroundIndexer.status.
         """
-        results = self.query_engine.search(query_str)
-        if results and len(results) > 0:
-            return results[0]['file_path']
-        
-        
-        for directory in self.config.scan_paths:
-            norm_dir = str(Path(directory).resolve())
-            for file_path in scan_directory(norm_dir):
+        return self._indexer.status()
+    
+    def search_page(self, query_str, limit=20, cursor=None, columns=("file_path",), cancel=None):
+        """
+        Return (rows, next_cursor) for one page of results; pass next_cursor
+        back to fetch the next page. It is None after the last page.
+        """
+        return self.query_engine.search_page(query_str, limit=limit, cursor=cursor, columns=columns, cancel=cancel)
+    
+    def iter_search(self, query_str, columns=None, cancel=None):
+        """
+        Lazily yield every match: file paths by default, or dicts of the
+        requested columns.
+        """
+        if columns is None:
+            for row in self.query_engine.iter_search(query_str, columns=("file_path",), cancel=cancel):
+                yield row["file_path"]
+        else:
+            yield from self.query_engine.iter_search(query_str, columns=columns, cancel=cancel)
+    
+    def iter_matches(self, query_str, queue_size=256):
+        """
+        Yield matching file paths as they are found: first the matches that
+        are already indexed, then matches among the files of scan roots that
+        are not completely indexed yet, as they are extracted. Extraction
+        runs like index_directory (in parallel with config.index_workers,
+        batched writes) on a helper thread, and each new file is tested
+        against the query in memory. Roots the BackgroundIndexer is already
+        indexing are not indexed again: the files it extracts are tested as
+        they come, and the query runs once more when it is done with them.
+        Closing the generator early stops the indexing; the rest is picked
+        up by a later run.
+        """
+        seen = set()
+        for file_path in self.iter_search(query_str):
+            seen.add(file_path)
+            yield file_path
+        pending = [] if self.config.read_only else self._indexer.pending()
+        if not pending:
+            return
+        matches = queue.Queue(maxsize=max(1, queue_size))
+        cancel = threading.Event()
+        done = object()
+
+        def emit(item):
+            while not cancel.is_set():
                 try:
-                    metadata = get_extractor_for(file_path)(file_path)
-                    self.storage.save_metadata(metadata)
-                   
-                    test_query = f'file_name:"{os.path.basename(file_path)}" AND {query_str}'
-                    res = self.storage.search_sql(test_query)
-                    if res and len(res) > 0:
-                        print(f"Early match found: {file_path}")
-                        return res[0]['file_path']
-                except Exception as e:
-                    print(f"Error processing {file_path}: {e}")
-           
-            self.storage.add_indexed_directory(norm_dir, status="completed")
-        return None
+                    matches.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def on_indexed(metadata):
+            if self.storage.matches(query_str, metadata):
+                emit(metadata["file_path"])
+
+        def on_background_indexed(metadata):
+            # Never hold up the background indexer; the final query finds dropped matches.
+            if self.storage.matches(query_str, metadata):
+                try:
+                    matches.put_nowait(metadata["file_path"])
+                except queue.Full:
+                    pass
+
+        own = self._indexer.claim(pending)
+        followed = [root for root in pending if root not in own]
+        if followed:
+            self._indexer.add_listener(on_background_indexed)
+
+        def work():
+            try:
+                for root in own:
+                    self.index_directory(root, cancel=cancel, on_indexed=on_indexed)
+                    self.storage.add_indexed_directory(root, status="completed")
+                    self._indexer.release(root)
+                self._indexer.wait_released(followed, cancel)
+            except IndexCancelled:
+                pass
+            except Exception as e:
+                print(f"Error indexing for early matches: {e}")
+            finally:
+                for root in own:
+                    self._indexer.release(root)
+                emit(done)
+
+        worker = threading.Thread(target=work, name="metasearch-early-match", daemon=True)
+        worker.start()
+        try:
+            while True:
+                file_path = matches.get()
+                if file_path is done:
+                    break
+                if file_path not in seen:
+                    seen.add(file_path)
+                    print(f"Early match found: {file_path}")
+                    yield file_path
+        finally:
+            cancel.set()
+            worker.join()
+            if followed:
+                self._indexer.remove_listener(on_background_indexed)
+        # Matches the background indexer extracted before we listened, or dropped.
+        for file_path in self.iter_search(query_str) if followed else ():
+            if file_path not in seen:
+                seen.add(file_path)
+                yield file_path
+    
+    def search_matches(self, query_str, limit=10):
+        """
+        Return the first `limit` paths from iter_matches, stopping the
+        underlying indexing as soon as they are found.
+        """
+        with closing(self.iter_matches(query_str)) as matches:
+            return list(itertools.islice(matches, limit))
+    
+    def search_first_match(self, query_str):
+        """
+        Return the first matching file path (see iter_matches), or None.
+        """
+        found = self.search_matches(query_str, limit=1)
+        return found[0] if found else None
     
     def search_by_size(self, min_size, max_size=None):
         """
@@ -128,11 +457,7 @@ class Engine:
             query = f"size_bytes:[{min_size} TO ]"
         else:
             query = f"size_bytes:[{min_size} TO {max_size}]"
-        results = self.search(query)
-        if not results and self.config.lazy_indexing:
-            self._trigger_index_for_new_dirs()
-            results = self.search(query)
-        return results
+        return self.search(query)
 
     def search_by_time(self, field, seconds):
         """
@@ -146,20 +471,37 @@ class Engine:
         if field not in {"created", "modified"}:
             raise ValueError("Field must be either 'created' or 'modified'")
         
-        import datetime
-        now = datetime.datetime.now()
-        start = now - datetime.timedelta(seconds=seconds)
-        
+        # created/modified are stored as epoch nanoseconds, so query them directly.
+        now_ns = time.time_ns()
+        start_ns = now_ns - int(seconds * 1_000_000_000)
+        query = f"{field}:[{start_ns} TO {now_ns}]"
+        return self.search(query)
 
-        query = f"{field}:[{start.isoformat()} TO {now.isoformat()}]"
-        
-        results = self.search(query)
-        if not results and self.config.lazy_indexing:
-            self._trigger_index_for_new_dirs()
-            results = self.search(query)
-        return results
 
+    def find_duplicates(self, min_size=1):
+        """
+        Return groups of indexed files (lists of paths) with identical
+        contents, largest files first. Only files that share their size with
+        another one are hashed; hashes are stored for later runs.
+        """
+        if not self.config.read_only:
+            hash_size_collisions(self.storage, min_size)
+        return self.storage.find_duplicates(min_size)
 
+    def get_quarantined(self):
+        """
+        Return the files whose extraction failed, with their failure count,
+        last error and when they will be retried.
+        """
+        return self.storage.get_quarantined()
+    
+    def release_quarantine(self, file_path=None):
+        """
+        Let file_path (or every quarantined file) be retried on the next run.
+        """
+        self._check_writable()
+        self.storage.release_quarantine(os.path.abspath(file_path) if file_path else None)
+    
     def get_metadata(self, file_path):
         """
         Returns the metadata stored in the database for the given file_path.
@@ -173,6 +515,7 @@ class Engine:
         2. If the file does not exist, create it, generate minimal metadata, and then update.
         After updating, ensure custom annotations are appended to the "full_text" field.
         """
+        self._check_writable()
         import datetime
         from pathlib import Path
 
@@ -189,8 +532,7 @@ class Engine:
         existing_metadata = self.storage.get_metadata(file_path)
         if existing_metadata is None:
             try:
-                extractor = get_extractor_for(file_path)
-                metadata = extractor(file_path)
+                metadata = extract_file(file_path, limits=self.text_limits)
             except Exception as e:
                 print(f"Metadata extraction failed; using fallback. Reason: {e}")
                 now = datetime.datetime.now().isoformat()
@@ -221,24 +563,38 @@ class Engine:
                 else:
                     current_text = pair
         metadata["full_text"] = current_text.strip()
+        metadata[ANNOTATIONS_KEY] = sorted(set(metadata.get(ANNOTATIONS_KEY, ())) | set(metadata_dict))
 
        
         self.storage.save_metadata(metadata)
+        self.plugins.add(metadata)
+        self.plugins.flush()
         print(f"Annotated: {file_path}")
     
-    def update_index(self, directory):
+    def update_index(self, directory, progress=None, cancel=None):
+        self._check_writable()
         norm_dir = str(Path(directory).resolve())
         print(f"Updating index for directory: {norm_dir}")
-        self.index_directory(norm_dir)
+        stats = self.index_directory(norm_dir, progress=progress, cancel=cancel)
+        print(f"Index updated for {norm_dir}: {stats}")
         self.storage.add_indexed_directory(norm_dir, status="completed")
+        return stats
     
     def remove_file(self, file_path):
+        self._check_writable()
         try:
             self.storage.remove_metadata(file_path)
+            self.plugins.remove(file_path)
+            self.plugins.flush()
             print(f"File removed from index: {file_path}")
         except Exception as e:
             print(f"Error removing file {file_path} from index: {e}")
     
     def shutdown(self):
+        self._indexer.stop()
         if self._watcher:
             self._watcher.stop()
+        self.plugins.close()
+        if self._plugin_executor is not None:
+            self._plugin_executor.shutdown(wait=False)
+        self.storage.close()
@@ -1,27 +1,78 @@
 # metasearch/extractors.py
 
 import os
+import codecs
+import importlib
 import json
-import subprocess
-import tarfile
-import zipfile
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
 
+# Third-party parsers (Pillow, PyMuPDF, python-docx, ...) and the stdlib
+# modules only some extractors need are imported inside the extractors, so
+# importing this module stays cheap.
 
-try:
-    import chardet
-except ImportError:
-    chardet = None
+_EXTRACTOR_REGISTRY = {}
+# {file_extension: "module.function@version"}, recorded with every extracted file.
+_EXTRACTOR_IDS = {}
 
+# (file_path, stat_result) from the scanner for the file being extracted on
+# this thread, so inherent_metadata can skip its own stat() call.
+_stat_hint = threading.local()
 
-_EXTRACTOR_REGISTRY = {}
+# Caps on the text an extractor keeps: bytes read from the file, characters
+# kept in full_text, and which part of an oversized file to keep ("head", or
+# "head_tail" for the first and last halves of the budget).
+TextLimits = namedtuple("TextLimits", "max_bytes max_chars window")
+DEFAULT_TEXT_LIMITS = TextLimits(16 * 1024 * 1024, 2_000_000, "head")
+
+# {file_type: TextLimits} in effect on this thread; "default" applies to other types.
+_text_limits = threading.local()
+
+# time.monotonic() deadline of the extraction running on this thread, if any.
+_deadline = threading.local()
 
-def register_extractor(file_extension, extractor_function):
+_READ_CHUNK = 1024 * 1024
+# Encoding detection only looks at this many leading bytes.
+_ENCODING_SAMPLE_BYTES = 64 * 1024
+_TRUNCATION_MARK = "\n[...]\n"
+
+def register_extractor(file_extension, extractor_function, version=None):
     """
     Register a custom extractor for a specific file extension.
+    extractor_function may be a dotted path ("package.module:function" or
+    "package.module.function"); its module is then only imported when the
+    first file with that extension is extracted. Bump version (default: the
+    function's `extractor_version` attribute, else "1") when its output
+    changes; incremental indexing then re-extracts the files it handles and
+    only those.
     """
+    if version is None:
+        version = "1" if isinstance(extractor_function, str) else getattr(extractor_function, "extractor_version", "1")
     _EXTRACTOR_REGISTRY[file_extension.lower()] = extractor_function
+    _EXTRACTOR_IDS[file_extension.lower()] = f"{_extractor_name(extractor_function)}@{version}"
+
+def _extractor_name(extractor_function):
+    if isinstance(extractor_function, str):
+        return extractor_function.replace(":", ".")
+    return f"{extractor_function.__module__}.{getattr(extractor_function, '__qualname__', repr(extractor_function))}"
+
+def resolve_dotted_path(path):
+    """
+    Import and return the object named by "package.module:attr" or
+    "package.module.attr".
+    """
+    module_name, sep, attr = path.partition(":")
+    if not sep:
+        module_name, _, attr = path.rpartition(".")
+    obj = importlib.import_module(module_name)
+    for part in attr.split("."):
+        obj = getattr(obj, part)
+    return obj
 
 def get_extractor_for(file_path):
     """
@@ -29,7 +80,213 @@ def get_extractor_for(file_path):
     if none is registered, use the generic extractor.
     """
     extension = Path(file_path).suffix.lower()
-    return _EXTRACTOR_REGISTRY.get(extension, extract_generic_metadata)
+    extractor = _EXTRACTOR_REGISTRY.get(extension, extract_generic_metadata)
+    if isinstance(extractor, str):
+        extractor = resolve_dotted_path(extractor)
+        _EXTRACTOR_REGISTRY[extension] = extractor
+    return extractor
+
+def extractor_id(file_path):
+    """
+    Return "module.function@version" of the extractor get_extractor_for
+    picks for file_path.
+    """
+    extension = Path(file_path).suffix.lower()
+    return _EXTRACTOR_IDS.get(extension) or f"{_extractor_name(extract_generic_metadata)}@1"
+
+@contextmanager
+def stat_hint(file_path, stat_result):
+    """
+    Make inherent_metadata reuse stat_result (and trust file_path as already
+    resolved) while extracting file_path on the current thread.
+    """
+    _stat_hint.value = (file_path, stat_result) if stat_result is not None else None
+    try:
+        yield
+    finally:
+        _stat_hint.value = None
+
+@contextmanager
+def extraction_deadline(timeout):
+    """
+    Give the extraction on the current thread timeout seconds (None for no
+    limit); see remaining_time.
+    """
+    previous = getattr(_deadline, "value", None)
+    _deadline.value = time.monotonic() + timeout if timeout else None
+    try:
+        yield
+    finally:
+        _deadline.value = previous
+
+def remaining_time():
+    """
+    Seconds left before the current extraction's deadline, or None. Extractors
+    that run external tools pass it as their timeout, so a hung tool is
+    stopped even when extraction runs in-process.
+    """
+    deadline = getattr(_deadline, "value", None)
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+def build_text_limits(max_bytes, max_chars, window="head", per_type=None):
+    """
+    Build the {file_type: TextLimits} table used by text_limits() from the
+    Config options; per_type maps a file_type ("text", "docx", ...) to a dict
+    overriding any of max_bytes / max_chars / window.
+    """
+    default = TextLimits(max_bytes, max_chars, window)
+    table = {"default": default}
+    for file_type, overrides in (per_type or {}).items():
+        table[file_type] = default._replace(**overrides)
+    return table
+
+@contextmanager
+def text_limits(table):
+    """
+    Apply a build_text_limits table to extractors run on the current thread.
+    """
+    _text_limits.value = table
+    try:
+        yield
+    finally:
+        _text_limits.value = None
+
+def limits_for(file_type):
+    table = getattr(_text_limits, "value", None) or {}
+    return table.get(file_type) or table.get("default") or DEFAULT_TEXT_LIMITS
+
+@lru_cache(maxsize=None)
+def _chardet():
+    try:
+        import chardet
+    except ImportError:
+        return None
+    return chardet
+
+def _detect_encoding(sample):
+    """
+    Pick an encoding from a sample of leading bytes: BOMs first, then UTF-8,
+    then chardet if it is installed.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # Not final: the sample may end in the middle of a character.
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    chardet = _chardet()
+    if chardet:
+        encoding = chardet.detect(sample).get("encoding")
+        if encoding:
+            try:
+                codecs.lookup(encoding)
+                return encoding
+            except LookupError:
+                pass
+    return "utf-8"
+
+def _read_text(f, encoding, max_bytes, max_chars):
+    """
+    Decode at most max_bytes from f, chunk by chunk, keeping at most
+    max_chars characters. Returns (text, bytes_read, stopped_early).
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pieces = []
+    chars = 0
+    bytes_read = 0
+    while bytes_read < max_bytes and chars < max_chars:
+        chunk = f.read(min(_READ_CHUNK, max_bytes - bytes_read))
+        if not chunk:
+            pieces.append(decoder.decode(b"", final=True))
+            break
+        bytes_read += len(chunk)
+        piece = decoder.decode(chunk)
+        pieces.append(piece)
+        chars += len(piece)
+    text = "".join(pieces)
+    return text[:max_chars], bytes_read, len(text) > max_chars
+
+def read_text_file(file_path, limits, size=None):
+    """
+    Read a text file within limits. Returns (text, info) where info records
+    the encoding, the bytes read and whether the text was truncated.
+    """
+    if size is None:
+        size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        encoding = _detect_encoding(f.read(_ENCODING_SAMPLE_BYTES))
+        f.seek(0)
+        if limits.window == "head_tail" and size > limits.max_bytes:
+            half_bytes, half_chars = limits.max_bytes // 2, limits.max_chars // 2
+            head, head_read, _ = _read_text(f, encoding, half_bytes, half_chars)
+            f.seek(size - half_bytes)
+            # The tail may start mid-character; the decoder replaces that fragment.
+            tail, tail_read, _ = _read_text(f, encoding.replace("-sig", ""), half_bytes, max(size, 1))
+            text = head + _TRUNCATION_MARK + tail[-half_chars:]
+            bytes_read, truncated = head_read + tail_read, True
+        elif limits.window == "head_tail":
+            # Within the byte budget, but the characters may still need cutting down to both ends.
+            text, bytes_read, _ = _read_text(f, encoding, limits.max_bytes, max(size, 1))
+            truncated = len(text) > limits.max_chars
+            if truncated:
+                half_chars = limits.max_chars // 2
+                text = text[:half_chars] + _TRUNCATION_MARK + text[len(text) - half_chars:]
+        else:
+            text, bytes_read, cut = _read_text(f, encoding, limits.max_bytes, limits.max_chars)
+            truncated = cut or bytes_read < size
+    return text, {"encoding": encoding, "bytes_read": bytes_read, "truncated": truncated}
+
+def cap_text(pieces, limits):
+    """
+    Join an iterable of text pieces with newlines within limits.max_chars,
+    keeping the head (and with window "head_tail" also the tail). With the
+    head window the iterable is not consumed past the cap.
+    Returns (text, truncated).
+    """
+    max_chars = limits.max_chars
+    if limits.window == "head_tail":
+        half = max_chars // 2
+        head, head_len, tail, tail_len, truncated = [], 0, deque(), 0, False
+        for piece in pieces:
+            if head_len < half:
+                head.append(piece)
+                head_len += len(piece) + 1
+                continue
+            tail.append(piece)
+            tail_len += len(piece) + 1
+            while tail_len - len(tail[0]) - 1 >= half:
+                tail_len -= len(tail.popleft()) + 1
+                truncated = True
+        head_text = "\n".join(head)
+        if len(head_text) > half:
+            head_text, truncated = head_text[:half], True
+        if not tail:
+            return head_text, truncated
+        tail_text = "\n".join(tail)
+        if len(tail_text) > half:
+            tail_text, truncated = tail_text[-half:], True
+        separator = _TRUNCATION_MARK if truncated else "\n"
+        return head_text + separator + tail_text, truncated
+    kept, length = [], 0
+    for piece in pieces:
+        if length >= max_chars:
+            return "\n".join(kept)[:max_chars], True
+        kept.append(piece)
+        length += len(piece) + 1
+    text = "\n".join(kept)
+    return text[:max_chars], len(text) > max_chars
+
+def _record_truncation(metadata, limits, truncated, **info):
+    metadata["text_truncated"] = truncated
+    if truncated:
+        metadata["text_window"] = limits.window
+    metadata.update(info)
 
 def inherent_metadata(file_path):
     """
@@ -40,8 +297,13 @@ def inherent_metadata(file_path):
     metadata = {"file_path": file_path}
     try:
         p = Path(file_path)
-        stat_info = p.stat()
-        metadata["file_path"] = str(p.resolve())
+        hint = getattr(_stat_hint, "value", None)
+        if hint is not None and hint[0] == file_path:
+            stat_info = hint[1]
+            metadata["file_path"] = file_path
+        else:
+            stat_info = p.stat()
+            metadata["file_path"] = str(p.resolve())
         metadata["file_name"] = p.name
         metadata["size_bytes"] = stat_info.st_size
         metadata["created"] = datetime.fromtimestamp(stat_info.st_ctime).isoformat()
@@ -50,6 +312,9 @@ def inherent_metadata(file_path):
         metadata["owner_uid"] = stat_info.st_uid
         metadata["group_gid"] = stat_info.st_gid
         metadata["permissions"] = oct(stat_info.st_mode)
+        metadata["mtime_ns"] = stat_info.st_mtime_ns
+        metadata["inode"] = stat_info.st_ino
+        metadata["device"] = stat_info.st_dev
     except Exception as e:
         metadata["inherent_error"] = str(e)
     return metadata
@@ -95,6 +360,7 @@ def extract_audio_metadata(file_path):
     return metadata
 
 def extract_video_metadata(file_path):
+    import subprocess
     metadata = inherent_metadata(file_path)
     metadata["file_type"] = "video"
     try:
@@ -106,12 +372,16 @@ def extract_video_metadata(file_path):
             "-show_streams",
             file_path
         ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                                timeout=remaining_time())
         if result.returncode == 0:
             info = json.loads(result.stdout)
             metadata["ffprobe"] = info
         else:
             metadata["video_error"] = result.stderr
+    except subprocess.TimeoutExpired:
+        # A timeout fails the extraction (and quarantines the file).
+        raise
     except Exception as e:
         metadata["video_error"] = str(e)
     return metadata
@@ -125,7 +395,10 @@ def extract_pdf_metadata(file_path):
         metadata["page_count"] = doc.page_count
         if doc.page_count > 0:
             page = doc[0]
-            metadata["text_snippet"] = page.get_text()
+            limits = limits_for("pdf")
+            snippet, truncated = cap_text([page.get_text()], limits)
+            metadata["text_snippet"] = snippet
+            _record_truncation(metadata, limits, truncated)
         metadata.update(doc.metadata)
         doc.close()
     except Exception as e:
@@ -138,8 +411,10 @@ def extract_docx_metadata(file_path):
     try:
         import docx
         document = docx.Document(file_path)
-        full_text = [para.text for para in document.paragraphs if para.text]
-        metadata["full_text"] = "\n".join(full_text)
+        limits = limits_for("docx")
+        text, truncated = cap_text((para.text for para in document.paragraphs if para.text), limits)
+        metadata["full_text"] = text
+        _record_truncation(metadata, limits, truncated)
         cp = document.core_properties
         metadata["author"] = cp.author
         metadata["title"] = cp.title
@@ -170,12 +445,12 @@ def extract_pptx_metadata(file_path):
         from pptx import Presentation
         prs = Presentation(file_path)
         metadata["slide_count"] = len(prs.slides)
-        full_text = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text") and shape.text:
-                    full_text.append(shape.text)
-        metadata["full_text"] = "\n".join(full_text)
+        limits = limits_for("pptx")
+        texts = (shape.text for slide in prs.slides for shape in slide.shapes
+                 if hasattr(shape, "text") and shape.text)
+        text, truncated = cap_text(texts, limits)
+        metadata["full_text"] = text
+        _record_truncation(metadata, limits, truncated)
     except Exception as e:
         metadata["pptx_error"] = str(e)
     return metadata
@@ -184,18 +459,11 @@ def extract_text_metadata(file_path):
     metadata = inherent_metadata(file_path)
     metadata["file_type"] = "text"
     try:
-        with open(file_path, "rb") as f:
-            raw_data = f.read()
-        try:
-            text = raw_data.decode("utf-8")
-        except UnicodeDecodeError:
-            if chardet:
-                detected = chardet.detect(raw_data)
-                encoding = detected.get("encoding", "utf-8")
-                text = raw_data.decode(encoding, errors="replace")
-            else:
-                text = raw_data.decode("utf-8", errors="replace")
+        limits = limits_for("text")
+        text, info = read_text_file(file_path, limits, metadata.get("size_bytes"))
         metadata["full_text"] = text
+        _record_truncation(metadata, limits, info["truncated"],
+                           text_encoding=info["encoding"], text_bytes_read=info["bytes_read"])
     except Exception as e:
         metadata["text_error"] = str(e)
     return metadata
@@ -210,6 +478,7 @@ def extract_archive_metadata(file_path):
             with zipfile.ZipFile(file_path, 'r') as archive:
                 archive_list = archive.namelist()
         elif file_path.lower().endswith((".tar", ".gz", ".tgz")):
+            import tarfile
             with tarfile.open(file_path, 'r') as archive:
                 archive_list = archive.getnames()
         else:
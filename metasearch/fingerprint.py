@@ -0,0 +1,40 @@
+# metasearch/fingerprint.py
+
+import hashlib
+from functools import lru_cache
+
+
+def stat_fingerprint(stat_result):
+    """
+    Return the (size_bytes, mtime_ns, inode, device) tuple used to decide
+    whether a file changed since it was last indexed.
+    """
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_dev)
+
+
+@lru_cache(maxsize=None)
+def _xxhash():
+    # Optional, and only imported once a file is hashed.
+    try:
+        import xxhash
+    except ImportError:
+        return None
+    return xxhash
+
+
+def content_hash(file_path, chunk_size=1 << 20):
+    """
+    Hash the file contents in fixed-size chunks and return a hex digest:
+    XXH3-128 (prefixed "xxh3:") when xxhash is installed, else BLAKE2b.
+    Used by Config.hash_contents to tell a touched file from a rewritten
+    one and by Config.dedupe_contents to find identical files.
+    """
+    xxhash = _xxhash()
+    if xxhash is not None:
+        digest, prefix = xxhash.xxh3_128(), "xxh3:"
+    else:
+        digest, prefix = hashlib.blake2b(digest_size=16), ""
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return prefix + digest.hexdigest()
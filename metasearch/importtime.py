@@ -0,0 +1,85 @@
+# metasearch/importtime.py
+"""
+Import-time budget check for cold-start sensitive callers (CLIs, serverless
+search workers):
+
+    python -m metasearch.importtime
+    python -m metasearch.importtime --module metasearch --budget-ms 20 --runs 9
+
+Imports the module in fresh interpreters, reports the median import time
+and exits with status 1 if it is over budget or if one of HEAVY_MODULES got
+imported along the way.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULE = "metasearch.engine"
+DEFAULT_BUDGET_MS = 50.0
+
+# Optional or heavy dependencies that must only be imported on first use.
+HEAVY_MODULES = (
+    "asyncio", "multiprocessing", "concurrent.futures.process", "watchdog", "chardet", "zstandard", "xxhash",
+    "PIL", "exifread", "mutagen", "fitz", "docx", "openpyxl", "pptx",
+)
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, sorted(sys.modules)]))
+"""
+
+
+def measure(module=DEFAULT_MODULE):
+    """
+    Import module in a fresh interpreter; return (seconds, imported module names).
+    """
+    result = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)],
+                            capture_output=True, text=True, check=True)
+    elapsed, modules = json.loads(result.stdout.strip().splitlines()[-1])
+    return elapsed, modules
+
+
+def heavy_modules(modules):
+    """
+    Return the names in modules that are (submodules of) HEAVY_MODULES.
+    """
+    return sorted(name for name in modules
+                  if any(name == prefix or name.startswith(prefix + ".") for prefix in HEAVY_MODULES))
+
+
+def check(module=DEFAULT_MODULE, budget_ms=DEFAULT_BUDGET_MS, runs=5):
+    """
+    Return (median_ms, heavy_modules_imported, ok).
+    """
+    timings = []
+    heavy = set()
+    for _ in range(max(1, runs)):
+        elapsed, modules = measure(module)
+        timings.append(elapsed * 1000)
+        heavy.update(heavy_modules(modules))
+    median_ms = statistics.median(timings)
+    return median_ms, sorted(heavy), median_ms <= budget_ms and not heavy
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m metasearch.importtime", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--module", default=DEFAULT_MODULE)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+    median_ms, heavy, ok = check(args.module, args.budget_ms, args.runs)
+    print(f"import {args.module}: {median_ms:.1f} ms (median of {args.runs}, budget {args.budget_ms:.0f} ms)")
+    if heavy:
+        print(f"Eagerly imported heavy modules: {', '.join(heavy)}")
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
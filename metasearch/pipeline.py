@@ -0,0 +1,406 @@
+# metasearch/pipeline.py
+
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from .dedupe import copy_metadata
+from .extractors import extraction_deadline, extractor_id, get_extractor_for, stat_hint, text_limits
+from .fingerprint import content_hash
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class IndexCancelled(Exception):
+    """
+    Raised out of an indexing run whose cancel event was set. Files already
+    extracted are kept; deleted-file purging and directory states are skipped.
+    """
+
+
+def count_file(stats, status, file_path, progress=None):
+    """
+    Count file_path under stats[status] and report it to the optional
+    progress callback as {"path": ..., "status": ..., "stats": {...}}.
+    """
+    stats[status] += 1
+    if progress is not None:
+        progress({"path": file_path, "status": status, "stats": dict(stats)})
+
+
+def check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise IndexCancelled("indexing cancelled")
+
+
+@contextmanager
+def memory_cap(limit):
+    """
+    Cap the address space of the current process at limit bytes (None for
+    no cap) for the duration of the block. Only meant for extraction worker
+    processes; a no-op where the resource module is unavailable.
+    """
+    if not limit or resource is None:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    cap = limit if hard == resource.RLIM_INFINITY else min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (cap, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def extract_file(file_path, hash_contents=False, stat_result=None, limits=None, timeout=None, memory_limit=None):
+    """
+    Run the registered extractor for one file. Kept at module level so it can
+    be pickled into a process pool. stat_result, when the scanner already
+    has it, saves the extractor a stat() call; limits is a
+    extractors.build_text_limits table capping the extracted text. timeout
+    is handed to extractors running external tools (extractors.remaining_time);
+    memory_limit caps the process (see memory_cap).
+    """
+    with stat_hint(file_path, stat_result), text_limits(limits), extraction_deadline(timeout), \
+            memory_cap(memory_limit):
+        metadata = get_extractor_for(file_path)(file_path)
+    metadata["extractor"] = extractor_id(file_path)
+    if hash_contents:
+        metadata["content_hash"] = content_hash(file_path)
+    return metadata
+
+
+class WriterThread(threading.Thread):
+    """
+    The single SQLite writer of a pipeline. Producers hand it work through a
+    bounded queue using the same add / remove / update_fingerprint methods as
+    storage.WriteBatch, so a full queue blocks them (backpressure) instead of
+    growing without limit.
+
+    A failed write is kept in `error`: the writer drops the rest of the
+    queue, later add / remove / update_fingerprint calls raise it, and so
+    does leaving the context, like a WriteBatch failing in a serial run.
+    """
+
+    _STOP = object()
+
+    def __init__(self, storage, batch_size=1000, flush_interval=2.0, queue_size=256):
+        super().__init__(name="metasearch-writer", daemon=True)
+        self.storage = storage
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self.error = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._queue.put(self._STOP)
+        self.join()
+        if exc_type is None and self.error is not None:
+            raise self.error
+        return False
+
+    def add(self, file_metadata):
+        self._put("add", file_metadata)
+
+    def remove(self, file_path):
+        self._put("remove", file_path)
+
+    def update_fingerprint(self, file_path, size_bytes, mtime_ns, inode, device):
+        self._put("update_fingerprint", file_path, size_bytes, mtime_ns, inode, device)
+
+    def _put(self, method, *args):
+        if self.error is not None:
+            raise self.error
+        self._queue.put((method, args))
+
+    def run(self):
+        batch = self.storage.write_batch(self.batch_size, self.flush_interval)
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._apply(batch.flush)
+                continue
+            if item is self._STOP:
+                break
+            method, args = item
+            self._apply(getattr(batch, method), *args)
+        self._apply(batch.flush)
+
+    def _apply(self, func, *args):
+        if self.error is not None:
+            return
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"[ERROR] Writing batch: {e}")
+            self.error = e
+
+
+class IndexPipeline:
+    """
+    Parallel indexer made of three bounded stages: the calling thread scans
+    and skips unchanged files, a thread or process pool runs the extractors,
+    and a WriterThread applies the results to SQLite in batches.
+
+    At most config.index_queue_size extractions are in flight. An extraction
+    running longer than its timeout (config.extract_timeout, or the
+    extractor_limits entry of its extension) is abandoned (process workers
+    are killed); process workers also run under the configured memory cap.
+    When a worker process dies, every file that was in flight is retried at
+    the end of the run, one at a time, so only the file that actually
+    crashes the pool is counted as an error. Failed files are quarantined
+    (see quarantine.Quarantine) and skipped by later runs until their retry
+    time. A failed SQLite write ends the run with its exception, as it does
+    in a serial run.
+    """
+
+    def __init__(self, engine, progress=None, cancel=None, on_indexed=None):
+        config = engine.config
+        self.engine = engine
+        self.storage = engine.storage
+        self.config = config
+        self.workers = max(1, int(config.index_workers))
+        self.use_processes = config.index_executor == "process" or config.extract_isolation
+        self.max_in_flight = max(self.workers, int(config.index_queue_size))
+        self._executor = None
+        self._in_flight = {}
+        self._suspects = []
+        self.progress = progress
+        self.cancel = cancel
+        self.on_indexed = on_indexed
+        self.deduper = engine._deduper()
+        self.cache = engine._extraction_cache()
+        # (content hash, extractor) of a file being extracted -> identical files waiting for its metadata
+        self._waiting = {}
+        self.quarantine = None
+
+    def _count(self, stats, status, file_path):
+        count_file(stats, status, file_path, self.progress)
+
+    def run(self, directory, incremental=True):
+        directory = os.path.realpath(directory)
+        stats = {"added": 0, "changed": 0, "unchanged": 0, "deleted": 0, "errors": 0, "quarantined": 0}
+        known = self.storage.get_fingerprints(directory)
+        seen = set()
+        self.quarantine = self.engine._quarantine(directory)
+        entries, dir_records = self.engine._scan(directory, known, incremental, self.quarantine.paths())
+        writer = WriterThread(self.storage, self.config.write_batch_size,
+                              self.config.write_flush_interval, self.config.index_queue_size)
+        with writer, self.cache:
+            self._executor = self._new_executor()
+            try:
+                for file_path, stat_result, trusted in entries:
+                    check_cancelled(self.cancel)
+                    seen.add(file_path)
+                    stored = known.get(file_path)
+                    if incremental and stored is not None and self.engine._is_unchanged(
+                            file_path, stored, writer, stat_result, trusted):
+                        self._count(stats, "unchanged", file_path)
+                        continue
+                    if self.quarantine.should_skip(file_path, stat_result):
+                        self._count(stats, "quarantined", file_path)
+                        continue
+                    cached = self._lookup(file_path, stat_result)
+                    if cached is not None:
+                        self._store(writer, stats, file_path, stored is None, cached)
+                        continue
+                    if self.deduper is not None:
+                        copy, digest = self._find_copy(file_path, stat_result)
+                        if copy is not None:
+                            self._store(writer, stats, file_path, stored is None, copy)
+                            continue
+                        if digest is not None:
+                            key = (digest, extractor_id(file_path))
+                            if key in self._waiting or self._extracting(key):
+                                self._waiting.setdefault(key, []).append(
+                                    (file_path, stored is None, stat_result))
+                                continue
+                            self._waiting[key] = []
+                    while len(self._in_flight) >= self.max_in_flight:
+                        self._collect(writer, stats)
+                    self._submit(file_path, stored is None, stat_result=stat_result)
+                while self._in_flight or self._waiting:
+                    check_cancelled(self.cancel)
+                    if not self._in_flight:
+                        self._extract_waiting()
+                        continue
+                    self._collect(writer, stats)
+                self._retry_suspects(writer, stats)
+            finally:
+                self._shutdown(self._executor, wait=not self._in_flight)
+                self._in_flight = {}
+            for file_path in known:
+                if file_path not in seen:
+                    writer.remove(file_path)
+                    self.engine.plugins.remove(file_path)
+                    self._count(stats, "deleted", file_path)
+            self.quarantine.forget_missing(seen)
+        self.engine.plugins.flush()
+        if dir_records is not None:
+            self.storage.save_directory_states(directory, dir_records)
+        return stats
+
+    def _new_executor(self):
+        # concurrent.futures (and multiprocessing) are only imported by processes that index.
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        if self.use_processes:
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="metasearch-extract")
+
+    def _submit(self, file_path, is_new, suspect=False, stat_result=None):
+        from concurrent.futures import BrokenExecutor
+        timeout, memory_limit = self.engine._extract_limits(file_path)
+        args = (extract_file, file_path, self.config.hash_contents, stat_result, self.engine.text_limits,
+                timeout, memory_limit if self.use_processes else None)
+        try:
+            future = self._executor.submit(*args)
+        except BrokenExecutor:
+            # A worker died since the last _collect. The tasks of the old pool
+            # stay in flight: _collect sees them fail and retries them as suspects.
+            self._shutdown(self._executor, wait=False)
+            self._executor = self._new_executor()
+            future = self._executor.submit(*args)
+        # The start time is recorded once a worker picks the task up; the
+        # executor tells a crash of the current pool from one already replaced.
+        self._in_flight[future] = [file_path, is_new, suspect, None, timeout, self._executor, stat_result]
+
+    def _fail(self, stats, file_path, error):
+        # str(MemoryError()) is empty.
+        error = str(error) or type(error).__name__
+        print(f"Error processing {file_path}: {error}")
+        self._count(stats, "errors", file_path)
+        if self.quarantine is not None:
+            self.quarantine.failed(file_path, error)
+
+    def _collect(self, writer, stats):
+        from concurrent.futures import FIRST_COMPLETED, BrokenExecutor, wait
+        done, _ = wait(list(self._in_flight), timeout=1.0, return_when=FIRST_COMPLETED)
+        crashed = False
+        for future in done:
+            file_path, is_new, suspect, _, _, executor, stat_result = self._in_flight.pop(future)
+            try:
+                metadata = future.result()
+            except BrokenExecutor:
+                # A process worker died (BrokenProcessPool).
+                crashed = crashed or executor is self._executor
+                if suspect:
+                    self._fail(stats, file_path, "extractor worker crashed")
+                else:
+                    self._suspects.append((file_path, is_new, stat_result))
+                continue
+            except Exception as e:
+                self._fail(stats, file_path, e)
+                continue
+            self.cache.store(metadata)
+            self._store(writer, stats, file_path, is_new, metadata)
+
+        timed_out = self._expire_slow_tasks(stats)
+        if crashed or (timed_out and self.use_processes):
+            self._restart_executor()
+        elif timed_out:
+            # Stuck threads cannot be interrupted; route new work to a fresh pool.
+            self._shutdown(self._executor, wait=False)
+            self._executor = self._new_executor()
+
+    def _lookup(self, file_path, stat_result):
+        try:
+            return self.cache.lookup(file_path, stat_result)
+        except Exception as e:
+            print(f"Error reading extractor cache for {file_path}: {e}")
+            return None
+
+    def _find_copy(self, file_path, stat_result):
+        try:
+            return self.deduper.find_copy(file_path, stat_result)
+        except Exception as e:
+            print(f"Error deduplicating {file_path}: {e}")
+            return None, None
+
+    def _extracting(self, key):
+        return any((self.deduper.digest(entry[0]), extractor_id(entry[0])) == key
+                   for entry in self._in_flight.values())
+
+    def _extract_waiting(self):
+        # Files whose identical original failed to extract: extract them too.
+        for waiting in self._waiting.values():
+            for file_path, is_new, stat_result in waiting:
+                self._submit(file_path, is_new, stat_result=stat_result)
+        self._waiting = {}
+
+    def _store(self, writer, stats, file_path, is_new, metadata):
+        self.quarantine.succeeded(file_path)
+        if self.deduper is not None:
+            self.deduper.add(metadata)
+        writer.add(metadata)
+        self.engine.plugins.add(metadata)
+        print(f"Indexed: {file_path}")
+        self._count(stats, "added" if is_new else "changed", file_path)
+        if self.on_indexed is not None:
+            self.on_indexed(metadata)
+        key = (metadata.get("content_hash"), metadata.get("extractor"))
+        waiting = self._waiting.pop(key, None) if self.deduper is not None else None
+        for copy_path, copy_is_new, stat_result in waiting or ():
+            try:
+                copy = copy_metadata(metadata, copy_path, stat_result)
+            except Exception as e:
+                print(f"Error processing {copy_path}: {e}")
+                self._count(stats, "errors", copy_path)
+                continue
+            self._store(writer, stats, copy_path, copy_is_new, copy)
+
+    def _expire_slow_tasks(self, stats):
+        now = time.monotonic()
+        expired = []
+        for future, entry in self._in_flight.items():
+            if not entry[4]:
+                continue
+            if entry[3] is None:
+                if future.running():
+                    entry[3] = now
+            elif now - entry[3] > entry[4]:
+                expired.append(future)
+        for future in expired:
+            entry = self._in_flight.pop(future)
+            file_path, timeout = entry[0], entry[4]
+            future.cancel()
+            self._fail(stats, file_path, f"extraction timed out after {timeout}s")
+        return bool(expired)
+
+    def _restart_executor(self):
+        # Every task still queued on the old pool is lost with it; resubmit them.
+        pending = list(self._in_flight.values())
+        self._in_flight = {}
+        self._shutdown(self._executor, wait=False)
+        self._executor = self._new_executor()
+        for file_path, is_new, suspect, _, _, _, stat_result in pending:
+            self._submit(file_path, is_new, suspect, stat_result)
+
+    def _retry_suspects(self, writer, stats):
+        suspects, self._suspects = self._suspects, []
+        for file_path, is_new, stat_result in suspects:
+            check_cancelled(self.cancel)
+            self._submit(file_path, is_new, suspect=True, stat_result=stat_result)
+            while self._in_flight:
+                self._collect(writer, stats)
+
+    def _shutdown(self, executor, wait):
+        """
+        Shut a pool down. Without wait, process workers are killed; threads
+        cannot be, so a stuck thread is left to finish on its own.
+        """
+        if executor is None:
+            return
+        processes = [] if wait else list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=wait, cancel_futures=True)
+        for process in processes:
+            process.terminate()
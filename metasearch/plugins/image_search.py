@@ -2,22 +2,30 @@
 """
 A stub for an image search plugin.
 """
+from .inverted_index import InvertedIndex
 from .search_plugin import SearchPlugin, register_search_plugin
 
 class ImageSearchPlugin(SearchPlugin):
     def __init__(self):
-        self._index = []
+        self._index = InvertedIndex()
     def index_file(self, metadata):
-        if metadata.get("file_type") == "image":
-            self._index.append(metadata)
-    def search(self, query_str):
-        results = []
-        query_lower = query_str.lower()
-        for meta in self._index:
-            ocr_text = meta.get("ocr_text", "").lower()
-            if query_lower in ocr_text:
-                results.append(meta)
-        return results
+        self.index_files([metadata])
+    def index_files(self, metadata_list):
+        images = []
+        for metadata in metadata_list:
+            if metadata.get("file_type") == "image":
+                images.append((metadata["file_path"], metadata.get("ocr_text") or ""))
+            else:
+                self._index.add_many(images)
+                images = []
+                self._index.remove(metadata["file_path"])
+        self._index.add_many(images)
+    def remove_file(self, file_path):
+        self._index.remove(file_path)
+    def search(self, query_str, limit=None):
+        return [{"file_path": file_path, "score": score}
+                for file_path, score in self._index.search(query_str, limit)]
 
+# Engines each create their own ImageSearchPlugin; this one is a standalone index.
 image_search_plugin = ImageSearchPlugin()
-register_search_plugin(image_search_plugin)
+register_search_plugin(ImageSearchPlugin)
@@ -0,0 +1,142 @@
+# metasearch/plugins/inverted_index.py
+"""
+A compact in-memory inverted index that search plugins can build on.
+"""
+import heapq
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from ..query_parser import _text_tokens
+
+
+class InvertedIndex:
+    """
+    Maps each term to a posting list of document ids (array of unsigned
+    ints, in ascending order) with the term frequency of each, so a plugin
+    keeps ids instead of whole metadata dicts. Documents are identified by
+    their file path and tokenized like the full-text queries (case and
+    accent folded words).
+
+    Removing or re-adding a document only marks its old id dead; the
+    posting lists are compacted once dead ids outnumber live ones.
+
+        index = InvertedIndex()
+        index.add("/docs/a.txt", "quarterly report")
+        index.search("report")   # [("/docs/a.txt", 0.69...)]
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}   # term -> (array of ids, array of term frequencies)
+        self._ids = {}        # file_path -> live id
+        self._paths = []      # id -> file_path, None once removed
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, file_path):
+        return file_path in self._ids
+
+    def add(self, file_path, text):
+        """
+        Index text under file_path, replacing what was indexed for it before.
+        """
+        self.add_many([(file_path, text)])
+
+    def add_many(self, documents):
+        """
+        Index an iterable of (file_path, text) pairs under one lock acquisition.
+        """
+        documents = [(file_path, Counter(_text_tokens(text))) for file_path, text in documents]
+        with self._lock:
+            for file_path, counts in documents:
+                self._discard(file_path)
+                doc_id = len(self._paths)
+                self._paths.append(file_path)
+                self._ids[file_path] = doc_id
+                for term, count in counts.items():
+                    posting = self._postings.get(term)
+                    if posting is None:
+                        posting = self._postings[term] = (array("I"), array("I"))
+                    posting[0].append(doc_id)
+                    posting[1].append(count)
+            self._maybe_compact()
+
+    def remove(self, file_path):
+        with self._lock:
+            self._discard(file_path)
+            self._maybe_compact()
+
+    def _discard(self, file_path):
+        doc_id = self._ids.pop(file_path, None)
+        if doc_id is not None:
+            self._paths[doc_id] = None
+            self._dead += 1
+
+    def _maybe_compact(self):
+        if self._dead > 1024 and self._dead > len(self._ids):
+            self.compact()
+
+    def compact(self):
+        """
+        Drop dead ids from every posting list and renumber the live documents.
+        """
+        with self._lock:
+            new_ids = array("I", bytes(4 * len(self._paths)))
+            paths = []
+            for doc_id, file_path in enumerate(self._paths):
+                if file_path is not None:
+                    new_ids[doc_id] = len(paths)
+                    paths.append(file_path)
+            paths_by_id = self._paths
+            for term, (ids, freqs) in list(self._postings.items()):
+                live = [i for i, doc_id in enumerate(ids) if paths_by_id[doc_id] is not None]
+                if not live:
+                    del self._postings[term]
+                    continue
+                self._postings[term] = (array("I", (new_ids[ids[i]] for i in live)),
+                                        array("I", (freqs[i] for i in live)))
+            self._paths = paths
+            self._ids = {file_path: doc_id for doc_id, file_path in enumerate(paths)}
+            self._dead = 0
+
+    def search(self, query_str, limit=None):
+        """
+        Return [(file_path, score), ...] for the documents containing every
+        term of query_str, best first (at most limit). The score sums
+        idf * (1 + log tf) over the query terms.
+        """
+        terms = set(_text_tokens(query_str))
+        if not terms:
+            return []
+        with self._lock:
+            postings = [self._postings.get(term) for term in terms]
+            if any(posting is None for posting in postings):
+                return []
+            # Walk the shortest list and probe the others by binary search.
+            postings.sort(key=lambda posting: len(posting[0]))
+            total = len(self._paths)
+            idfs = [math.log(1 + total / len(posting[0])) for posting in postings]
+            paths = self._paths
+            (first_ids, first_freqs), rest = postings[0], postings[1:]
+            scored = []
+            for i, doc_id in enumerate(first_ids):
+                file_path = paths[doc_id]
+                if file_path is None:
+                    continue
+                score = idfs[0] * (1 + math.log(first_freqs[i]))
+                for posting, idf in zip(rest, idfs[1:]):
+                    ids = posting[0]
+                    j = bisect_left(ids, doc_id)
+                    if j == len(ids) or ids[j] != doc_id:
+                        break
+                    score += idf * (1 + math.log(posting[1][j]))
+                else:
+                    scored.append((file_path, score))
+        if limit is None:
+            return sorted(scored, key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(limit, scored, key=lambda item: item[1])
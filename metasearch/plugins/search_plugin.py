@@ -2,17 +2,51 @@
 """
 Abstract search plugin interface.
 """
+import threading
+import time
+
 _SEARCH_PLUGIN_REGISTRY = []
+# Registered class -> the instance get_search_plugins returns for it.
+_SHARED_INSTANCES = {}
+
+# Reciprocal rank fusion constant, see merge_ranked.
+RANK_CONSTANT = 60
 
 def register_search_plugin(plugin):
+    """
+    Register a plugin class or instance, or a dotted path
+    ("package.module:name") to either. A path is only imported the first
+    time the plugins are needed. Every Engine creates its own instance of a
+    registered class, so plugins of Engines on different databases do not
+    mix; an instance registered directly is shared by all Engines.
+    """
     _SEARCH_PLUGIN_REGISTRY.append(plugin)
 
+def _registered_plugins():
+    """
+    The registered plugin classes and instances, dotted paths imported.
+    """
+    for i, plugin in enumerate(_SEARCH_PLUGIN_REGISTRY):
+        if isinstance(plugin, str):
+            from ..extractors import resolve_dotted_path
+            _SEARCH_PLUGIN_REGISTRY[i] = resolve_dotted_path(plugin)
+    return list(_SEARCH_PLUGIN_REGISTRY)
+
 def get_search_plugins():
-    return _SEARCH_PLUGIN_REGISTRY
+    """
+    Return the registered plugins, registered classes instantiated once
+    (Engines make their own instances, see PluginFeed).
+    """
+    plugins = []
+    for plugin in _registered_plugins():
+        if isinstance(plugin, type):
+            plugin = _SHARED_INSTANCES.setdefault(plugin, plugin())
+        plugins.append(plugin)
+    return plugins
 
 def run_search_plugins(query_str):
     results = []
-    for plugin in _SEARCH_PLUGIN_REGISTRY:
+    for plugin in get_search_plugins():
         try:
             plugin_results = plugin.search(query_str)
             if plugin_results:
@@ -21,6 +55,241 @@ def run_search_plugins(query_str):
             print(f"Plugin {plugin.__class__.__name__} error: {e}")
     return results
 
+def result_path(result):
+    """
+    The file path of one plugin result: a path string or a dict with "file_path".
+    """
+    return result if isinstance(result, str) else result["file_path"]
+
+def merge_ranked(result_lists):
+    """
+    Merge ranked lists of file paths into one list without duplicates, best
+    first. A path scores 1 / (RANK_CONSTANT + rank) for every list it is in
+    (reciprocal rank fusion), so sources whose own scores are not comparable
+    can be combined and paths found by several sources rank higher. Ties
+    keep the order of the first list they appear in.
+    """
+    scores = {}
+    for paths in result_lists:
+        for rank, file_path in enumerate(paths):
+            scores[file_path] = scores.get(file_path, 0.0) + 1.0 / (RANK_CONSTANT + rank)
+    return sorted(scores, key=scores.__getitem__, reverse=True)
+
+def _indexes(plugin):
+    return hasattr(plugin, "index_files") or hasattr(plugin, "index_file")
+
+def _accepts_limit(plugin):
+    import inspect
+    try:
+        return "limit" in inspect.signature(plugin.search).parameters
+    except (TypeError, ValueError):
+        return False
+
+class PluginFeed:
+    """
+    Keeps the registered search plugins of an Engine in step with its index
+    and queries them. Registered classes are instantiated once per feed, so
+    each Engine's plugins only know its own database. Indexed and removed
+    files are handed to the plugins that index (index_files or index_file,
+    and remove_file) batch_size changes at a time, and on flush().
+
+    With backfill, a plugin seen for the first time is loaded with every
+    file already in storage by a background thread, so in-memory plugins
+    are complete after a restart although unchanged files are not
+    re-extracted; changes made meanwhile are queued for it and searches
+    skip it until it has loaded. Without it, plugins are searchable at once
+    but only know the files indexed since the Engine started.
+    """
+
+    def __init__(self, storage, batch_size=500, backfill=False):
+        self.storage = storage
+        self.batch_size = max(1, int(batch_size))
+        self.backfill = backfill
+        self._lock = threading.RLock()
+        # registered class -> this feed's instance
+        self._instances = {}
+        self._loaded = []
+        # id(plugin) -> (plugin, changes flushed while it loads)
+        self._loading = {}
+        self._pending = []
+        self._takes_limit = {}
+        self._threads = []
+        self._closing = threading.Event()
+
+    def start(self):
+        """
+        Start loading the registered plugins in the background.
+        """
+        self.plugins()
+
+    def plugins(self):
+        """
+        Return the registered plugins that can be searched: those that do
+        not index and those that have loaded. Plugins not seen before
+        start loading.
+        """
+        if not _SEARCH_PLUGIN_REGISTRY:
+            return []
+        with self._lock:
+            plugins = [self._instance(plugin) for plugin in _registered_plugins()]
+            new = [plugin for plugin in plugins if _indexes(plugin) and id(plugin) not in self._loading
+                   and not any(plugin is loaded for loaded in self._loaded)]
+            if not self.backfill:
+                self._loaded.extend(new)
+                new = []
+            for plugin in new:
+                self._loading[id(plugin)] = (plugin, [])
+            ready = [plugin for plugin in plugins
+                     if not _indexes(plugin) or any(plugin is loaded for loaded in self._loaded)]
+        if new:
+            thread = threading.Thread(target=self._load, args=(new,), name="metasearch-plugin-load", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return ready
+
+    def _instance(self, plugin):
+        if not isinstance(plugin, type):
+            return plugin
+        instance = self._instances.get(plugin)
+        if instance is None:
+            instance = self._instances[plugin] = plugin()
+        return instance
+
+    def wait(self, timeout=None):
+        """
+        Wait until the plugins that are loading have loaded; True if none is left.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in list(self._threads):
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return not self._loading
+
+    def close(self):
+        """
+        Stop loading plugins (they stay unsearchable) before storage is closed.
+        """
+        self._closing.set()
+        self.wait()
+
+    def _load(self, plugins):
+        for plugin in plugins:
+            try:
+                batch = []
+                for metadata in self.storage.iter_metadata(self.batch_size):
+                    if self._closing.is_set():
+                        return
+                    batch.append(("add", metadata))
+                    if len(batch) >= self.batch_size:
+                        self._dispatch(plugin, batch)
+                        batch = []
+                self._dispatch(plugin, batch)
+            except Exception as e:
+                print(f"Plugin {plugin.__class__.__name__} error: loading the index: {e}")
+            with self._lock:
+                _, backlog = self._loading.pop(id(plugin))
+                self._dispatch(plugin, backlog)
+                self._loaded.append(plugin)
+
+    def add(self, metadata):
+        self._queue("add", metadata)
+
+    def remove(self, file_path):
+        self._queue("remove", file_path)
+
+    def _queue(self, kind, item):
+        self.plugins()
+        if not (self._loaded or self._loading):
+            return
+        with self._lock:
+            self._pending.append((kind, item))
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if pending:
+                for _, backlog in self._loading.values():
+                    backlog.extend(pending)
+                for plugin in self._loaded:
+                    self._dispatch(plugin, pending)
+
+    @staticmethod
+    def _dispatch(plugin, changes):
+        index_files = getattr(plugin, "index_files", None)
+        remove_file = getattr(plugin, "remove_file", None)
+        added = []
+        try:
+            for kind, item in changes:
+                if kind == "add":
+                    added.append(item)
+                    continue
+                if remove_file is None:
+                    continue
+                if added:
+                    PluginFeed._index(plugin, index_files, added)
+                    added = []
+                remove_file(item)
+            if added:
+                PluginFeed._index(plugin, index_files, added)
+        except Exception as e:
+            print(f"Plugin {plugin.__class__.__name__} error: {e}")
+
+    @staticmethod
+    def _index(plugin, index_files, metadata_list):
+        if index_files is not None:
+            index_files(metadata_list)
+        else:
+            for metadata in metadata_list:
+                plugin.index_file(metadata)
+
+    def submit(self, executor, plugins, query_str, limit=None):
+        """
+        Start a search of each of plugins on executor; returns [(plugin, future)].
+        """
+        searches = []
+        for plugin in plugins:
+            takes_limit = self._takes_limit.get(id(plugin))
+            if takes_limit is None:
+                takes_limit = self._takes_limit[id(plugin)] = _accepts_limit(plugin)
+            args = (query_str, limit) if takes_limit else (query_str,)
+            searches.append((plugin, executor.submit(plugin.search, *args)))
+        return searches
+
+    @staticmethod
+    def collect(searches, timeout, started=None):
+        """
+        Return one list of file paths per plugin search that finished within
+        its timeout (the plugin's own `timeout` attribute, else timeout)
+        counted from started. Late or failing plugins are left out.
+        """
+        from concurrent.futures import TimeoutError as FutureTimeout
+        started = time.monotonic() if started is None else started
+        result_lists = []
+        for plugin, future in searches:
+            plugin_timeout = getattr(plugin, "timeout", None) or timeout
+            try:
+                results = future.result(timeout=max(0.0, started + plugin_timeout - time.monotonic()))
+            except FutureTimeout:
+                print(f"[WARN] Plugin {plugin.__class__.__name__} timed out after {plugin_timeout}s")
+                continue
+            except Exception as e:
+                print(f"Plugin {plugin.__class__.__name__} error: {e}")
+                continue
+            if results and any("score" in result for result in results if isinstance(result, dict)):
+                results = sorted(results, key=lambda result: result.get("score", 0)
+                                 if isinstance(result, dict) else 0, reverse=True)
+            result_lists.append([result_path(result) for result in results or ()])
+        return result_lists
+
 class SearchPlugin:
-    def search(self, query_str):
+    """
+    Base class for search plugins. search() returns matching file paths, or
+    dicts with a "file_path" (and optionally a "score"), best first; it may
+    take a limit. A plugin that defines index_file(metadata) (or
+    index_files(metadata_list)) and remove_file(file_path) is kept up to
+    date by the Engine. An optional `timeout` attribute overrides
+    Config.plugin_timeout for it.
+    """
+    def search(self, query_str, limit=None):
         raise NotImplementedError("search() must be implemented by the plugin.")
@@ -2,24 +2,25 @@
 """
 A sample text search plugin.
 """
+from .inverted_index import InvertedIndex
 from .search_plugin import SearchPlugin, register_search_plugin
 
 class TextSearchPlugin(SearchPlugin):
     def __init__(self):
-        self._index = []
+        self._index = InvertedIndex()
     def index_file(self, metadata):
-        self._index.append(metadata)
-    def search(self, query_str):
-        results = []
-        query_lower = query_str.lower()
-        for meta in self._index:
-            text = meta.get("full_text", "").lower()
-            if query_lower in text:
-                results.append(meta)
-        return results
+        self.index_files([metadata])
+    def index_files(self, metadata_list):
+        self._index.add_many((metadata["file_path"], metadata.get("full_text") or "") for metadata in metadata_list)
+    def remove_file(self, file_path):
+        self._index.remove(file_path)
+    def search(self, query_str, limit=None):
+        return [{"file_path": file_path, "score": score}
+                for file_path, score in self._index.search(query_str, limit)]
 
+# Engines each create their own TextSearchPlugin; this one is a standalone index.
 text_search_plugin = TextSearchPlugin()
-register_search_plugin(text_search_plugin)
+register_search_plugin(TextSearchPlugin)
 
 def add_file_to_text_index(metadata):
     text_search_plugin.index_file(metadata)
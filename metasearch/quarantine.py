@@ -0,0 +1,61 @@
+# metasearch/quarantine.py
+
+import os
+import time
+
+
+class Quarantine:
+    """
+    Files whose extraction failed (error, timeout, crashed worker) under one
+    scan root, loaded from the quarantine table at the start of a run. A
+    quarantined file is skipped until its retry time, which backs off
+    exponentially from `backoff` seconds up to `max_backoff` with every
+    failure, unless its size or mtime changed since. A successful
+    extraction releases it.
+    """
+
+    def __init__(self, storage, directory, backoff=600, max_backoff=7 * 86400):
+        self.storage = storage
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.entries = storage.get_quarantine(directory)
+
+    def paths(self):
+        return list(self.entries)
+
+    def should_skip(self, file_path, stat_result=None):
+        entry = self.entries.get(file_path)
+        if entry is None:
+            return False
+        size_bytes, mtime_ns, _, retry_after = entry
+        if stat_result is None:
+            try:
+                stat_result = os.stat(file_path)
+            except OSError:
+                return False
+        if (stat_result.st_size, stat_result.st_mtime_ns) != (size_bytes, mtime_ns):
+            return False
+        return time.time_ns() < retry_after
+
+    def failed(self, file_path, error, stat_result=None):
+        if stat_result is None:
+            try:
+                stat_result = os.stat(file_path)
+            except OSError:
+                return
+        message = str(error) or type(error).__name__
+        self.storage.quarantine_file(file_path, stat_result.st_size, stat_result.st_mtime_ns, message,
+                                     self.backoff, self.max_backoff)
+        self.entries.pop(file_path, None)
+
+    def forget_missing(self, seen):
+        """
+        Release the quarantined files a complete pass did not come across
+        (deleted, or excluded by the scan options since).
+        """
+        for file_path in [path for path in self.entries if path not in seen]:
+            self.succeeded(file_path)
+
+    def succeeded(self, file_path):
+        if self.entries.pop(file_path, None) is not None:
+            self.storage.release_quarantine(file_path)
@@ -6,5 +6,11 @@ class QueryEngine:
     def __init__(self, storage: Storage):
         self.storage = storage
 
-    def search(self, query_str):
-        return self.storage.search(query_str)
+    def search(self, query_str, limit=20, offset=0, columns=None, cancel=None):
+        return self.storage.search(query_str, limit=limit, offset=offset, columns=columns, cancel=cancel)
+
+    def search_page(self, query_str, limit=20, cursor=None, columns=None, cancel=None):
+        return self.storage.search_page(query_str, limit=limit, cursor=cursor, columns=columns, cancel=cancel)
+
+    def iter_search(self, query_str, columns=None, cancel=None):
+        return self.storage.iter_search(query_str, columns=columns, cancel=cancel)
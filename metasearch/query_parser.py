@@ -0,0 +1,526 @@
+# metasearch/query_parser.py
+"""
+Parser and SQL planner for the Lucene-like query DSL:
+
+    invoice                      free-text term (FTS5), inv* for a prefix
+    "quarterly report"           phrase
+    file_name:Approach           column match
+    author:"Kunal Wagh"          attribute match, author:Kun* for a prefix
+    ffprobe.format.duration:[10 TO 20]
+                                 nested fields use dotted keys
+    "exif.Image Make":Canon      keys with spaces are quoted
+    size_bytes:[0 TO 1024]       range, * or an empty bound is open-ended
+    modified:[2024-01-01 TO 2024-01-31]
+                                 time range (ISO dates, epoch seconds or ns)
+    a AND b, a OR b, NOT a, (a OR b) AND c
+                                 adjacent terms are ANDed
+
+Parsed plans are cached by query string, so repeated queries skip both
+parsing and SQL generation. compile_predicate evaluates the same AST in
+memory against a single file that has not been written yet.
+"""
+
+import re
+import unicodedata
+from collections import namedtuple
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+Term = namedtuple("Term", "text prefix")
+Field = namedtuple("Field", "key value quoted prefix")
+Range = namedtuple("Range", "key start end")
+And = namedtuple("And", "children")
+Or = namedtuple("Or", "children")
+Not = namedtuple("Not", "child")
+
+QueryPlan = namedtuple("QueryPlan", "where params fts_match")
+
+# Columns of the files table that can be queried directly.
+DIRECT_COLUMNS = {"file_name", "size_bytes", "created", "modified", "extension"}
+TIME_COLUMNS = {"created", "modified"}
+
+# Numbers below this are taken as epoch seconds, above as epoch nanoseconds.
+_EPOCH_SECONDS_LIMIT = 10 ** 11
+_DATE_ONLY_RE = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+# Upper bound for prefix ranges: sorts after any string starting with the prefix.
+_MAX_CHAR = chr(0x10FFFF)
+
+# Rough per-predicate costs used to order AND clauses: indexed lookups and
+# ranges first, substring scans and full-text last.
+_COST_ATTRIBUTE_EXACT = 1
+_COST_COLUMN_RANGE = 2
+_COST_ATTRIBUTE_PREFIX = 2
+_COST_ATTRIBUTE_RANGE = 3
+_COST_LIKE = 20
+_COST_FTS = 30
+_COST_FULL_SCAN = 100
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<range>(?P<rkey>[\w.]+|"[^"]*"):\[\s*(?P<rstart>[^\]]*?)\s+TO\b\s*(?P<rend>[^\]]*?)\s*\])
+  | (?P<field>(?P<fkey>[\w.]+|"[^"]*"):(?:"(?P<fquoted>[^"]*)"|(?P<fvalue>[^\s()"]+)))
+  | (?P<phrase>"(?P<ptext>[^"]*)")
+  | (?P<word>[^\s()"]+)
+""", re.VERBOSE)
+
+_OPERATORS = {"AND", "OR", "NOT"}
+
+# A word as the unicode61 tokenizer sees it: letters and digits only.
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+def tokenize(query_str):
+    """
+    Split a query into (kind, value) tokens. Operators must be upper case,
+    so a file name such as ANDROID.txt stays a single term.
+    """
+    tokens = []
+    pos = 0
+    while pos < len(query_str):
+        m = _TOKEN_RE.match(query_str, pos)
+        if not m:
+            raise QuerySyntaxError(f"Unexpected character {query_str[pos]!r} at position {pos}")
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "ws":
+            continue
+        if kind in ("lparen", "rparen"):
+            tokens.append((kind, None))
+        elif m.group("range"):
+            tokens.append(("range", Range(_key(m.group("rkey")), _bound(m.group("rstart")), _bound(m.group("rend")))))
+        elif m.group("field"):
+            if m.group("fquoted") is not None:
+                tokens.append(("term", Field(_key(m.group("fkey")), m.group("fquoted"), True, False)))
+            else:
+                value = m.group("fvalue")
+                prefix = value.endswith("*") and len(value) > 1
+                tokens.append(("term", Field(_key(m.group("fkey")), value.rstrip("*") if prefix else value, False, prefix)))
+        elif m.group("phrase"):
+            tokens.append(("term", Term(m.group("ptext"), False)))
+        else:
+            word = m.group("word")
+            if word in _OPERATORS:
+                tokens.append((word, None))
+            else:
+                prefix = word.endswith("*") and len(word) > 1
+                tokens.append(("term", Term(word.rstrip("*") if prefix else word, prefix)))
+    return tokens
+
+
+def _key(key):
+    # Attribute keys of nested metadata are dotted and may contain spaces
+    # ("exif.Image Make"); those are written in quotes.
+    return key[1:-1] if key.startswith('"') else key
+
+
+def _bound(value):
+    value = value.strip()
+    return None if value in ("", "*") else value
+
+
+class _Parser:
+    """
+    Recursive descent over the token list:
+
+        or_expr  := and_expr (OR and_expr)*
+        and_expr := not_expr ([AND] not_expr)*
+        not_expr := NOT not_expr | primary
+        primary  := "(" or_expr ")" | term | range
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos][0] if self.pos < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            return And(())
+        node = self.or_expr()
+        if self.pos != len(self.tokens):
+            raise QuerySyntaxError(f"Unexpected {self.peek()!r} in query")
+        return node
+
+    def or_expr(self):
+        children = [self.and_expr()]
+        while self.peek() == "OR":
+            self.take()
+            children.append(self.and_expr())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def and_expr(self):
+        children = [self.not_expr()]
+        while self.peek() in ("AND", "NOT", "lparen", "term", "range"):
+            if self.peek() == "AND":
+                self.take()
+            children.append(self.not_expr())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def not_expr(self):
+        if self.peek() == "NOT":
+            self.take()
+            return Not(self.not_expr())
+        return self.primary()
+
+    def primary(self):
+        kind = self.peek()
+        if kind == "lparen":
+            self.take()
+            node = self.or_expr()
+            if self.peek() != "rparen":
+                raise QuerySyntaxError("Missing closing parenthesis")
+            self.take()
+            return node
+        if kind in ("term", "range"):
+            return self.take()[1]
+        raise QuerySyntaxError(f"Expected a term but found {kind or 'end of query'!r}")
+
+
+@lru_cache(maxsize=512)
+def parse_query(query_str):
+    """
+    Parse a query string into an AST of Term / Field / Range / And / Or / Not
+    nodes. Raises QuerySyntaxError on malformed input.
+    """
+    return _Parser(tokenize(query_str)).parse()
+
+
+@lru_cache(maxsize=512)
+def plan_query(query_str, fts_enabled=True):
+    """
+    Compile a query string into a QueryPlan for the files table.
+    fts_match is the FTS5 expression of the free-text terms that every hit
+    must contain; callers join on it to rank with bm25. Other text terms
+    (under OR / NOT) are answered by FTS subqueries inside where.
+    """
+    node = parse_query(query_str)
+    conjuncts = list(node.children) if isinstance(node, And) else [node]
+    fts_terms = []
+    if fts_enabled:
+        for child in conjuncts:
+            if isinstance(child, Term):
+                expression = fts_term(child)
+                if expression:
+                    fts_terms.append(expression)
+        conjuncts = [child for child in conjuncts if not isinstance(child, Term)]
+    where, params, _ = _compile(And(tuple(conjuncts)), fts_enabled)
+    fts_match = " AND ".join(fts_terms) if fts_terms else None
+    return QueryPlan(where, tuple(params), fts_match)
+
+
+@lru_cache(maxsize=512)
+def split_free_text(query_str, fts_enabled=True):
+    """
+    Split a query for search plugins, which only understand plain words.
+    Returns (text, where, params): text joins the top-level free-text
+    terms every hit must contain (prefix terms excluded), or is None if
+    there are none; where/params compile the rest of the query, which
+    plugin hits must satisfy as well.
+    """
+    node = parse_query(query_str)
+    conjuncts = list(node.children) if isinstance(node, And) else [node]
+    words = [child.text for child in conjuncts if isinstance(child, Term) and not child.prefix]
+    if not words:
+        return None, None, ()
+    rest = [child for child in conjuncts if not isinstance(child, Term) or child.prefix]
+    where, params, _ = _compile(And(tuple(rest)), fts_enabled)
+    return " ".join(words), where, tuple(params)
+
+
+def _compile(node, fts_enabled):
+    """
+    Return (sql, params, cost) for one AST node.
+    """
+    if isinstance(node, And):
+        if not node.children:
+            return "1", [], 0
+        parts = sorted((_compile(child, fts_enabled) for child in node.children), key=lambda part: part[2])
+        return _join(parts, " AND "), [p for part in parts for p in part[1]], min(part[2] for part in parts)
+    if isinstance(node, Or):
+        parts = [_compile(child, fts_enabled) for child in node.children]
+        return _join(parts, " OR "), [p for part in parts for p in part[1]], sum(part[2] for part in parts)
+    if isinstance(node, Not):
+        sql, params, cost = _compile(node.child, fts_enabled)
+        return f"NOT ({sql})", params, cost + _COST_LIKE
+    if isinstance(node, Range):
+        return _compile_range(node)
+    if isinstance(node, Field):
+        return _compile_field(node)
+    return _compile_term(node, fts_enabled)
+
+
+def _join(parts, operator):
+    if len(parts) == 1:
+        return parts[0][0]
+    return operator.join(f"({part[0]})" for part in parts)
+
+
+def _compile_term(term, fts_enabled):
+    if fts_enabled:
+        expression = fts_term(term)
+        if expression is None:
+            return "1", [], 0
+        return "id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?)", [expression], _COST_FTS
+    pattern = f"%{term.text}%"
+    return "(file_name LIKE ? OR full_text LIKE ?)", [pattern, pattern], _COST_FULL_SCAN
+
+
+def _compile_field(field):
+    key, value = field.key, field.value
+    if key in DIRECT_COLUMNS:
+        if key == "size_bytes" and to_number(value) is not None:
+            return "size_bytes = ?", [to_number(value)], _COST_COLUMN_RANGE
+        if key in TIME_COLUMNS:
+            # A date matches the whole day; anything else the exact instant.
+            start, end = _time_bound(value), _time_bound(value, end=True)
+            return _range_sql(key, start, end) + (_COST_COLUMN_RANGE,)
+        if key == "extension":
+            extension = value.lower() if value.startswith(".") else "." + value.lower()
+            return "extension = ?", [extension], _COST_ATTRIBUTE_EXACT
+        pattern = f"{value}%" if field.prefix else f"%{value}%"
+        return f"{key} LIKE ?", [pattern], _COST_LIKE
+    if field.prefix:
+        return ("id IN (SELECT file_id FROM file_attributes WHERE key = ? AND value >= ? AND value < ?)",
+                [key, value, value + _MAX_CHAR], _COST_ATTRIBUTE_PREFIX)
+    return ("id IN (SELECT file_id FROM file_attributes WHERE key = ? AND value = ?)",
+            [key, value], _COST_ATTRIBUTE_EXACT)
+
+
+def _compile_range(node):
+    key, start, end = node.key, node.start, node.end
+    if key in DIRECT_COLUMNS:
+        if key == "size_bytes":
+            start, end = _numeric_bound(start), _numeric_bound(end)
+        elif key in TIME_COLUMNS:
+            start, end = _time_bound(start), _time_bound(end, end=True)
+        return _range_sql(key, start, end) + (_COST_COLUMN_RANGE,)
+    # Numeric bounds compare numeric_value; anything else compares the text values.
+    if all(bound is None or to_number(bound) is not None for bound in (start, end)):
+        column, start, end = "numeric_value", _numeric_bound(start), _numeric_bound(end)
+    else:
+        column = "value"
+    sql, params = _range_sql(column, start, end)
+    return (f"id IN (SELECT file_id FROM file_attributes WHERE key = ? AND {sql})",
+            [key] + params, _COST_ATTRIBUTE_RANGE)
+
+
+def _range_sql(column, start, end):
+    if start is not None and end is not None:
+        return f"{column} BETWEEN ? AND ?", [start, end]
+    if start is not None:
+        return f"{column} >= ?", [start]
+    if end is not None:
+        return f"{column} <= ?", [end]
+    return f"{column} IS NOT NULL", []
+
+
+def _numeric_bound(value):
+    if value is None:
+        return None
+    number = to_number(value)
+    if number is None:
+        raise QuerySyntaxError(f"Expected a number in range but found {value!r}")
+    return number
+
+
+def _time_bound(value, end=False):
+    if value is None:
+        return None
+    ns = to_epoch_ns(value)
+    if ns is None:
+        raise QuerySyntaxError(f"Expected a date, datetime or epoch time but found {value!r}")
+    if end and _DATE_ONLY_RE.match(value):
+        # An end date includes the whole day.
+        ns += int(timedelta(days=1).total_seconds() * 1e9) - 1
+    return ns
+
+
+def to_epoch_ns(value):
+    """
+    Convert a timestamp to integer epoch nanoseconds. Accepts datetimes,
+    ISO-8601 strings (naive ones are local time, as written by the
+    extractors) and numbers: below 1e11 they are epoch seconds, above it
+    epoch nanoseconds. Returns None for anything else.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1_000_000) * 1000
+    number = to_number(value)
+    if number is not None:
+        if abs(number) < _EPOCH_SECONDS_LIMIT:
+            return int(round(number * 1_000_000)) * 1000
+        try:
+            return int(value)
+        except ValueError:
+            return int(number)
+    try:
+        return to_epoch_ns(datetime.fromisoformat(str(value).strip()))
+    except ValueError:
+        return None
+
+
+def to_number(value):
+    """
+    Return value as a float, or None if it is not numeric (bools included).
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class MatchRecord:
+    """
+    The searchable view of one file for compile_predicate: `columns` holds
+    the files columns (file_name, size_bytes, created, modified, extension,
+    full_text) and `attributes` maps each attribute key to its
+    (value, numeric_value) rows, as storage would index them.
+    """
+
+    def __init__(self, columns, attributes):
+        self.columns = columns
+        self.attributes = attributes
+        self._tokens = None
+
+    def tokens(self):
+        # Token lists per FTS column, as the unicode61 tokenizer produces them.
+        if self._tokens is None:
+            self._tokens = [_text_tokens(self.columns.get("file_name")),
+                            _text_tokens(self.columns.get("full_text"))]
+        return self._tokens
+
+
+def _text_tokens(text):
+    # Like FTS5's unicode61: runs of letters and digits (so "_" separates
+    # words), lower-cased one character at a time (ß stays ß) and with the
+    # diacritics removed.
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFD", str(text).lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return _WORD_RE.findall(folded)
+
+
+@lru_cache(maxsize=512)
+def compile_predicate(query_str, fts_enabled=True):
+    """
+    Compile a query string into a function MatchRecord -> bool with the same
+    semantics as the SQL plan, for testing a freshly extracted file without
+    a round trip through SQLite.
+    """
+    return _predicate(parse_query(query_str), fts_enabled)
+
+
+def _predicate(node, fts_enabled):
+    if isinstance(node, And):
+        children = [_predicate(child, fts_enabled) for child in node.children]
+        return lambda record: all(child(record) for child in children)
+    if isinstance(node, Or):
+        children = [_predicate(child, fts_enabled) for child in node.children]
+        return lambda record: any(child(record) for child in children)
+    if isinstance(node, Not):
+        child = _predicate(node.child, fts_enabled)
+        return lambda record: not child(record)
+    if isinstance(node, Range):
+        return _range_predicate(node)
+    if isinstance(node, Field):
+        return _field_predicate(node)
+    return _term_predicate(node, fts_enabled)
+
+
+def _term_predicate(term, fts_enabled):
+    if not fts_enabled:
+        needle = term.text.lower()
+        return lambda record: any(needle in str(record.columns.get(column) or "").lower()
+                                  for column in ("file_name", "full_text"))
+    if fts_term(term) is None:
+        return lambda record: True
+    words = _text_tokens(term.text)
+    size = len(words)
+
+    def matches(record):
+        for tokens in record.tokens():
+            for i in range(len(tokens) - size + 1):
+                if tokens[i:i + size - 1] == words[:-1] and (
+                        tokens[i + size - 1].startswith(words[-1]) if term.prefix
+                        else tokens[i + size - 1] == words[-1]):
+                    return True
+        return False
+    return matches
+
+
+def _field_predicate(field):
+    key, value = field.key, field.value
+    if key in DIRECT_COLUMNS:
+        if key == "size_bytes" and to_number(value) is not None:
+            number = to_number(value)
+            return lambda record: record.columns.get("size_bytes") == number
+        if key in TIME_COLUMNS:
+            start, end = _time_bound(value), _time_bound(value, end=True)
+            return lambda record: _in_range(record.columns.get(key), start, end)
+        if key == "extension":
+            extension = value.lower() if value.startswith(".") else "." + value.lower()
+            return lambda record: record.columns.get("extension") == extension
+        # LIKE is case-insensitive: value% for a prefix, %value% otherwise.
+        needle = value.lower()
+        if field.prefix:
+            return lambda record: str(record.columns.get(key) or "").lower().startswith(needle)
+        return lambda record: needle in str(record.columns.get(key) or "").lower()
+    needle = value.lower()
+    if field.prefix:
+        return lambda record: any(text is not None and text.lower().startswith(needle)
+                                  for text, _ in record.attributes.get(key, ()))
+    return lambda record: any(text is not None and text.lower() == needle
+                              for text, _ in record.attributes.get(key, ()))
+
+
+def _range_predicate(node):
+    key, start, end = node.key, node.start, node.end
+    if key in DIRECT_COLUMNS:
+        if key == "size_bytes":
+            start, end = _numeric_bound(start), _numeric_bound(end)
+        elif key in TIME_COLUMNS:
+            start, end = _time_bound(start), _time_bound(end, end=True)
+        return lambda record: _in_range(record.columns.get(key), start, end)
+    if all(bound is None or to_number(bound) is not None for bound in (start, end)):
+        start, end = _numeric_bound(start), _numeric_bound(end)
+        return lambda record: any(_in_range(number, start, end) for _, number in record.attributes.get(key, ()))
+    start = start.lower() if start is not None else None
+    end = end.lower() if end is not None else None
+    return lambda record: any(text is not None and _in_range(text.lower(), start, end)
+                              for text, _ in record.attributes.get(key, ()))
+
+
+def _in_range(value, start, end):
+    if value is None:
+        return False
+    return (start is None or value >= start) and (end is None or value <= end)
+
+
+def fts_term(term):
+    """
+    FTS5 expression for one free-text term. The text is always quoted so
+    user input cannot inject FTS5 operators; a prefix term gets a trailing *.
+    Returns None if the term contains nothing the tokenizer would index.
+    """
+    if not _WORD_RE.search(term.text):
+        return None
+    phrase = '"' + term.text.replace('"', '""') + '"'
+    return phrase + "*" if term.prefix else phrase
@@ -1,11 +1,257 @@
 # metasearch/scanner.py
+
+import fnmatch
+import os
+import stat
+import time
+from collections import defaultdict, namedtuple
 from pathlib import Path
 
-def scan_directory(directory):
+from .config import Config
+
+# A file found by the scanner together with the stat() result it already
+# paid for, so the indexer does not stat the file again. trusted is True for
+# files reported from an unchanged directory without being stat'ed at all
+# (Config.trust_dir_mtime); stat is None for those.
+ScanEntry = namedtuple("ScanEntry", "path stat trusted", defaults=(False,))
+
+# A directory modified this recently may still change within the same mtime
+# tick, so it is not trusted on the next pass.
+_DIR_MTIME_SETTLE_NS = 2 * 1_000_000_000
+
+# Returned by _visit for a file outside min_file_size / max_file_size.
+_SIZE_SKIPPED = object()
+
+
+class DirectorySnapshot:
+    """
+    Directory mtimes and contents recorded by the previous scan of a root:
+    rows of (dir_path, parent_dir, mtime_ns, entry_count) from indexed_dirs
+    plus the indexed file paths below the root.
+    """
+
+    def __init__(self, dir_rows, file_paths):
+        self.mtimes = {}
+        self.records = {}
+        self.subdirs = defaultdict(list)
+        for dir_path, parent_dir, mtime_ns, entry_count in dir_rows:
+            self.mtimes[dir_path] = mtime_ns
+            self.records[dir_path] = (parent_dir, mtime_ns, entry_count)
+            if parent_dir is not None:
+                self.subdirs[parent_dir].append(dir_path)
+        self.files = defaultdict(list)
+        for file_path in file_paths:
+            self.files[os.path.dirname(file_path)].append(file_path)
+
+    def is_unchanged(self, dir_path, mtime_ns):
+        stored = self.mtimes.get(dir_path)
+        return stored is not None and stored == mtime_ns
+
+
+def scan_entries(directory, config=None, snapshot=None, dir_records=None):
+    """
+    Walk a directory with os.scandir and yield a ScanEntry per file.
+    Honors the scan options of config: scan_include / scan_exclude globs,
+    scan_max_depth, min_file_size / max_file_size, follow_symlinks,
+    skip_hidden and same_filesystem. Excluded directories are pruned
+    without being listed.
+
+    If dir_records is a dict, it is filled with
+    {dir_path: (parent_dir, mtime_ns, entry_count)} for every directory
+    visited. Given the DirectorySnapshot of the previous pass, a directory
+    whose mtime is unchanged is not listed again: its known files and
+    subdirectories are taken from the snapshot instead. A file can grow or
+    shrink into the size range without changing its directory's mtime, so
+    a directory holding a file skipped for its size is never recorded as
+    unchanged and is listed on every pass.
+    """
+    config = config or Config()
+    root = os.path.realpath(directory)
+    # With follow_symlinks, a linked file may also be reached directly.
+    seen_files = set() if config.follow_symlinks else None
+    try:
+        root_stat = os.stat(root)
+    except OSError as e:
+        print(f"[ERROR] Cannot scan {root}: {e}")
+        return
+    visited = {(root_stat.st_dev, root_stat.st_ino)}
+    settled_before = time.time_ns() - _DIR_MTIME_SETTLE_NS
+    stack = [(root, "", 0, None)]
+    while stack:
+        dir_path, rel_dir, depth, parent_dir = stack.pop()
+        if dir_records is not None:
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except OSError:
+                continue
+            if snapshot is not None and snapshot.is_unchanged(dir_path, mtime_ns):
+                dir_records[dir_path] = snapshot.records[dir_path]
+                yield from _known_files(snapshot.files.get(dir_path, ()), config)
+                stack.extend(
+                    (sub, f"{rel_dir}/{os.path.basename(sub)}" if rel_dir else os.path.basename(sub), depth + 1, dir_path)
+                    for sub in reversed(snapshot.subdirs.get(dir_path, ()))
+                )
+                continue
+        subdirs = []
+        entry_count = 0
+        size_skipped = False
+        try:
+            with os.scandir(dir_path) as it:
+                for entry in it:
+                    entry_count += 1
+                    found = _visit(entry, rel_dir, depth, config, root_stat, visited, subdirs)
+                    if found is None:
+                        continue
+                    if found is _SIZE_SKIPPED:
+                        size_skipped = True
+                        continue
+                    if seen_files is not None:
+                        key = (found.stat.st_dev, found.stat.st_ino)
+                        if key in seen_files:
+                            continue
+                        seen_files.add(key)
+                    yield found
+        except OSError as e:
+            print(f"[WARN] Cannot list {dir_path}: {e}")
+            continue
+        if dir_records is not None:
+            trusted_mtime = mtime_ns if mtime_ns < settled_before and not size_skipped else None
+            dir_records[dir_path] = (parent_dir, trusted_mtime, entry_count)
+        stack.extend((sub, rel, sub_depth, dir_path) for sub, rel, sub_depth in reversed(subdirs))
+
+
+def _known_files(file_paths, config):
+    for file_path in file_paths:
+        if config.trust_dir_mtime:
+            yield ScanEntry(file_path, None, True)
+            continue
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            # Gone since the last pass; the indexer purges it.
+            continue
+        # Out of the size range now: left out like a listed file, so it is purged.
+        if not _size_excluded(stat_result.st_size, config):
+            yield ScanEntry(file_path, stat_result)
+
+
+def _visit(entry, rel_dir, depth, config, root_stat, visited, subdirs):
+    """
+    Classify one directory entry: queue it on subdirs if it is a directory
+    to descend into, return a ScanEntry if it is a file to index,
+    _SIZE_SKIPPED if it is a file outside the size limits, else None.
+    """
+    name = entry.name
+    rel_path = f"{rel_dir}/{name}" if rel_dir else name
+    if config.skip_hidden and _is_hidden(entry):
+        return None
+    if _matches(name, rel_path, config.scan_exclude):
+        return None
+    follow = config.follow_symlinks
+    try:
+        is_link = entry.is_symlink()
+        if is_link and not follow:
+            return None
+        if entry.is_dir(follow_symlinks=follow):
+            if config.scan_max_depth is not None and depth >= config.scan_max_depth:
+                return None
+            dir_path = entry.path
+            if follow or config.same_filesystem:
+                dir_stat = entry.stat(follow_symlinks=True)
+                if config.same_filesystem and dir_stat.st_dev != root_stat.st_dev:
+                    return None
+            if follow:
+                # Visit every real directory once, however many links lead to it.
+                key = (dir_stat.st_dev, dir_stat.st_ino)
+                if key in visited:
+                    return None
+                visited.add(key)
+                if is_link:
+                    dir_path = os.path.realpath(dir_path)
+            subdirs.append((dir_path, rel_path, depth + 1))
+            return None
+        if not entry.is_file(follow_symlinks=follow):
+            return None
+        if config.scan_include and not _matches(name, rel_path, config.scan_include):
+            return None
+        stat_result = entry.stat(follow_symlinks=follow)
+    except OSError:
+        return None
+    if _size_excluded(stat_result.st_size, config):
+        return _SIZE_SKIPPED
+    path = os.path.realpath(entry.path) if is_link else entry.path
+    return ScanEntry(path, stat_result)
+
+
+def is_path_excluded(file_path, config, is_dir=False):
+    """
+    Apply the scan rules to a single path reported outside a scan (e.g. by
+    the watcher): excluded or hidden path components, include globs and
+    size limits. Like scan_entries, only the components below the scan root
+    containing the path are checked, and globs match root-relative paths.
+    Directories are only checked against the component rules.
+    """
+    parts = _root_relative_parts(file_path, config)
+    for index, part in enumerate(parts):
+        if config.skip_hidden and part.startswith("."):
+            return True
+        if _matches(part, "/".join(parts[:index + 1]), config.scan_exclude):
+            return True
+    if is_dir:
+        return False
+    name = parts[-1] if parts else os.path.basename(file_path)
+    if config.scan_include and not _matches(name, "/".join(parts) or name, config.scan_include):
+        return True
+    if config.min_file_size is not None or config.max_file_size is not None:
+        try:
+            return _size_excluded(os.path.getsize(file_path), config)
+        except OSError:
+            return False
+    return False
+
+
+def _size_excluded(size, config):
+    return ((config.min_file_size is not None and size < config.min_file_size)
+            or (config.max_file_size is not None and size > config.max_file_size))
+
+
+def _root_relative_parts(file_path, config):
+    """
+    The components of file_path below the deepest scan root that contains
+    it; every component but the anchor for a path outside all scan roots.
+    """
+    root = None
+    for scan_path in config.scan_paths:
+        scan_root = os.path.realpath(scan_path)
+        if file_path == scan_root or file_path.startswith(os.path.join(scan_root, "")):
+            if root is None or len(scan_root) > len(root):
+                root = scan_root
+    if root is None:
+        return Path(file_path).parts[1:]
+    return Path(os.path.relpath(file_path, root)).parts if file_path != root else ()
+
+
+def _matches(name, rel_path, patterns):
+    for pattern in patterns or ():
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel_path, pattern):
+            return True
+    return False
+
+
+def _is_hidden(entry):
+    if entry.name.startswith("."):
+        return True
+    if os.name == "nt":
+        try:
+            return bool(entry.stat(follow_symlinks=False).st_file_attributes & stat.FILE_ATTRIBUTE_HIDDEN)
+        except (OSError, AttributeError):
+            return False
+    return False
+
+
+def scan_directory(directory, config=None):
     """
     Recursively scans a directory and yields full file paths.
     """
-    directory = Path(directory)
-    for filepath in directory.rglob("*"):
-        if filepath.is_file():
-            yield str(filepath.resolve())
+    for entry in scan_entries(directory, config):
+        yield entry.path
@@ -3,162 +3,1256 @@
 import sqlite3
 import json
 import os
+import queue
+import zlib
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-import re
+import time
+from functools import lru_cache
+
+from .query_parser import MatchRecord, compile_predicate, plan_query, to_number, to_epoch_ns
+
+
+def _path_prefix_bounds(dir_path):
+    """
+    Return (low, high) such that every path strictly under dir_path sorts in
+    [low, high), so a prefix lookup can use the UNIQUE index on file_path.
+    """
+    prefix = os.path.join(dir_path, "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+_UPSERT_FILE = """
+INSERT INTO files (file_path, file_name, size_bytes, created, modified, extension, full_text, metadata,
+                   inode, device, mtime_ns, content_hash, extractor)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(file_path) DO UPDATE SET
+    file_name=excluded.file_name,
+    size_bytes=excluded.size_bytes,
+    created=excluded.created,
+    modified=excluded.modified,
+    extension=excluded.extension,
+    full_text=excluded.full_text,
+    metadata=excluded.metadata,
+    inode=excluded.inode,
+    device=excluded.device,
+    mtime_ns=excluded.mtime_ns,
+    content_hash=excluded.content_hash,
+    extractor=excluded.extractor
+"""
+
+_UPDATE_FINGERPRINT = "UPDATE files SET size_bytes = ?, mtime_ns = ?, inode = ?, device = ? WHERE file_path = ?"
+
+_DELETE_FILE = "DELETE FROM files WHERE file_path = ?"
+
+# Rewrites the old path prefix in place; ids (and so attributes and the FTS
+# rows) are kept, and only the renamed entry itself gets a new name/extension.
+# The metadata JSON needs no update: decode_metadata takes the path from the row.
+_RENAME_FILES = """
+UPDATE files SET
+    file_path = :new || substr(file_path, :old_length + 1),
+    file_name = CASE WHEN file_path = :old THEN :name ELSE file_name END,
+    extension = CASE WHEN file_path = :old THEN :extension ELSE extension END
+WHERE file_path = :old OR (file_path >= :low AND file_path < :high)
+"""
+
+_RENAME_DIRS = """
+UPDATE indexed_dirs SET
+    dir_path = :new || substr(dir_path, :old_length + 1),
+    parent_dir = CASE
+        WHEN dir_path = :old THEN CASE WHEN is_root = 1 THEN parent_dir ELSE :new_parent END
+        ELSE :new || substr(parent_dir, :old_length + 1)
+    END
+WHERE dir_path = :old OR (dir_path >= :low AND dir_path < :high)
+"""
+
+_CREATE_ATTRIBUTES = """
+CREATE TABLE IF NOT EXISTS file_attributes (
+    file_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT COLLATE NOCASE,
+    numeric_value REAL
+)
+"""
+
+_ATTRIBUTE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_attr_key_value ON file_attributes (key, value)",
+    "CREATE INDEX IF NOT EXISTS idx_attr_key_numeric ON file_attributes (key, numeric_value)",
+    "CREATE INDEX IF NOT EXISTS idx_attr_file ON file_attributes (file_id)",
+    """
+    CREATE TRIGGER IF NOT EXISTS files_attr_ad AFTER DELETE ON files BEGIN
+        DELETE FROM file_attributes WHERE file_id = old.id;
+    END
+    """,
+)
+
+_DELETE_ATTRIBUTES = "DELETE FROM file_attributes WHERE file_id = (SELECT id FROM files WHERE file_path = ?)"
+
+_INSERT_ATTRIBUTE = """
+INSERT INTO file_attributes (file_id, key, value, numeric_value)
+SELECT id, ?, ?, ? FROM files WHERE file_path = ?
+"""
+
+# Keys that have their own column or are searched through full_text instead.
+_NON_ATTRIBUTE_KEYS = {"file_path", "file_name", "size_bytes", "created", "modified", "extension",
+                       "full_text", "content", "metadata", "inode", "device", "mtime_ns", "content_hash",
+                       "extractor", "_annotations"}
+
+# Longer values (extracted text snippets, OCR, ...) are left to the FTS index.
+_ATTRIBUTE_MAX_LENGTH = 512
+_ATTRIBUTE_MAX_VALUES = 256
+
+
+def _attribute_values(key, value, out):
+    """
+    Flatten one metadata entry into (key, value, numeric_value) tuples.
+    Nested dicts use dotted keys and lists of scalars become one row each.
+    """
+    if value is None:
+        return
+    if isinstance(value, dict):
+        for sub_key, sub_value in value.items():
+            _attribute_values(f"{key}.{sub_key}", sub_value, out)
+        return
+    if isinstance(value, (list, tuple)):
+        for item in value[:_ATTRIBUTE_MAX_VALUES]:
+            if not isinstance(item, (dict, list, tuple)):
+                _attribute_values(key, item, out)
+        return
+    text = str(value)
+    if len(text) > _ATTRIBUTE_MAX_LENGTH:
+        return
+    out.append((key, text, to_number(value)))
+
+
+# String values at least this long are not repeated in the metadata JSON when
+# they can be sliced back out of the full_text column.
+_TEXT_SPAN_MIN_LENGTH = 64
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+@lru_cache(maxsize=None)
+def _zstandard():
+    # Optional, and only imported once zstd metadata is written or read.
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def encode_metadata(file_metadata, full_text, spans, compression=None):
+    """
+    Serialize file_metadata for the metadata column. Keys listed in spans
+    ({key: (start, length)} into full_text) are replaced by a "_text_spans"
+    entry when the slice really equals the value, so the text is stored once.
+    compression is None, "zlib" or "zstd"; compressed values are BLOBs.
+    """
+    stored = dict(file_metadata)
+    text_spans = {}
+    for key, (start, length) in spans.items():
+        if full_text[start:start + length] == stored.get(key):
+            del stored[key]
+            text_spans[key] = (start, length)
+    if text_spans:
+        stored["_text_spans"] = text_spans
+    data = json.dumps(stored, separators=(",", ":"))
+    if compression == "zlib":
+        return zlib.compress(data.encode("utf-8"))
+    if compression == "zstd":
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise RuntimeError("metadata_compression='zstd' requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(data.encode("utf-8"))
+    return data
+
+
+def decode_metadata(raw, full_text=None, file_path=None, file_name=None):
+    """
+    Inverse of encode_metadata: decompress if needed, parse, and put the
+    spanned values back from full_text. Path and name come from the row so
+    renamed files report their current location.
+    """
+    if isinstance(raw, bytes):
+        if raw.startswith(_ZSTD_MAGIC):
+            zstandard = _zstandard()
+            if zstandard is None:
+                raise RuntimeError("Reading zstd-compressed metadata requires the zstandard package")
+            raw = zstandard.ZstdDecompressor().decompress(raw)
+        else:
+            raw = zlib.decompress(raw)
+        raw = raw.decode("utf-8")
+    file_metadata = json.loads(raw)
+    for key, (start, length) in file_metadata.pop("_text_spans", {}).items():
+        if full_text is not None:
+            file_metadata[key] = full_text[start:start + length]
+    if file_path is not None:
+        file_metadata["file_path"] = file_path
+        if file_name is not None and "file_name" in file_metadata:
+            file_metadata["file_name"] = file_name
+    return file_metadata
+
+
+def attribute_rows(file_metadata):
+    """
+    Return the (key, value, numeric_value) rows stored in file_attributes for
+    one metadata dict.
+    """
+    rows = []
+    for key, value in file_metadata.items():
+        if key not in _NON_ATTRIBUTE_KEYS:
+            _attribute_values(key, value, rows)
+    return rows
+
+
+# External-content FTS5 index: the text lives only in files, the index holds tokens.
+_CREATE_FTS = """
+CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+    file_name, full_text,
+    content='files', content_rowid='id',
+    tokenize='unicode61', prefix='2 3'
+)
+"""
+
+_FTS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, file_name, full_text) VALUES (new.id, new.file_name, new.full_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, file_name, full_text)
+        VALUES ('delete', old.id, old.file_name, old.full_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF file_name, full_text ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, file_name, full_text)
+        VALUES ('delete', old.id, old.file_name, old.full_text);
+        INSERT INTO files_fts(rowid, file_name, full_text) VALUES (new.id, new.file_name, new.full_text);
+    END
+    """,
+)
+
+# Rank file name hits above body hits.
+_FTS_RANK = "bm25(files_fts, 10.0, 1.0)"
+
+
+# Bumped whenever existing databases need a data migration (see Storage._migrate).
+SCHEMA_VERSION = 2
+
+# Columns that can be requested in a search projection.
+SEARCH_COLUMNS = {"id", "file_path", "file_name", "size_bytes", "created", "modified", "extension",
+                  "full_text", "metadata", "inode", "device", "mtime_ns", "content_hash", "extractor"}
+
+_FILE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_files_size ON files (size_bytes)",
+    "CREATE INDEX IF NOT EXISTS idx_files_modified ON files (modified)",
+    "CREATE INDEX IF NOT EXISTS idx_files_created ON files (created)",
+    "CREATE INDEX IF NOT EXISTS idx_files_extension ON files (extension)",
+    "CREATE INDEX IF NOT EXISTS idx_files_content_hash ON files (content_hash)",
+    # NOCASE so that case-insensitive file_name LIKE 'prefix%' can seek.
+    "CREATE INDEX IF NOT EXISTS idx_files_name ON files (file_name COLLATE NOCASE)",
+)
+
+
+# Applied to every connection; journal_mode and synchronous only matter for the writer.
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,     # negative values are KiB: 64 MiB
+    "mmap_size": 268435456,   # 256 MiB
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+
+_WRITER_ONLY_PRAGMAS = {"journal_mode", "synchronous"}
+
+# SQLite VM instructions between checks of a read's cancel event.
+_CANCEL_CHECK_INTERVAL = 10000
+
 
 class Storage:
-    def __init__(self, db_path):
+    """
+    SQLite storage. All writes go through one writer connection (`conn`),
+    serialized by a lock so the indexer, the watcher and annotate() can share
+    it. Reads use a pool of up to `read_connections` read-only connections;
+    in WAL mode they see the last committed state and never wait for the
+    writer.
+
+    With read_only, every connection is opened with mode=ro (plus
+    immutable=1 with immutable, for a file nothing writes to while it is
+    open: no locks, no change detection), the schema is checked but never
+    created or migrated, and writes raise RuntimeError.
+    """
+
+    def __init__(self, db_path, pragmas=None, read_connections=4, compression=None, read_only=False,
+                 immutable=False):
         self.db_path = db_path
-        self.conn = sqlite3.connect(self.db_path)
-        self.conn.row_factory = sqlite3.Row
-        self._create_tables()
+        self.compression = compression
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.read_only = read_only
+        self.immutable = immutable
+        self.conn = self._connect(read_only)
+        self._write_lock = threading.RLock()
+        # An in-memory database is private to its connection, so reads share the writer.
+        self._shared_reads = db_path == ":memory:" or str(db_path).startswith("file::memory:")
+        self._readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._max_readers = max(1, int(read_connections))
+        self._reader_lock = threading.Lock()
+        # {root: last_indexed_at} of completed scan roots, consulted on every search.
+        self._roots_cache = None
+        if read_only:
+            self._check_schema()
+            if not self._shared_reads:
+                # The first pooled reader.
+                self._readers.put(self.conn)
+                self._reader_count = 1
+        else:
+            self._create_tables()
+    
+    def _connect(self, read_only=False):
+        if read_only:
+            uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+            if self.immutable:
+                uri += "&immutable=1"
+            try:
+                conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            except sqlite3.OperationalError as e:
+                raise RuntimeError(f"Cannot open {self.db_path} read-only: {e}; "
+                                   "build the index with a writable Engine first") from e
+        else:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            if read_only and name in _WRITER_ONLY_PRAGMAS:
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        return conn
+    
+    @contextmanager
+    def _transaction(self):
+        """
+        Hold the write lock and commit on success, roll back on error.
+        """
+        if self.read_only:
+            raise RuntimeError(f"{self.db_path} is opened read-only")
+        with self._write_lock:
+            try:
+                yield self.conn
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+    
+    @contextmanager
+    def _reading(self, cancel=None):
+        """
+        Borrow a read-only connection from the pool for the duration of the
+        block. Setting the optional `cancel` threading.Event aborts a running
+        statement with sqlite3.OperationalError ("interrupted").
+        """
+        if self._shared_reads:
+            with self._write_lock:
+                with self._cancellable(self.conn, cancel):
+                    yield self.conn
+            return
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            with self._reader_lock:
+                create = self._reader_count < self._max_readers
+                if create:
+                    self._reader_count += 1
+            if create:
+                try:
+                    conn = self._connect(read_only=True)
+                except Exception:
+                    with self._reader_lock:
+                        self._reader_count -= 1
+                    raise
+            else:
+                conn = self._readers.get()
+        try:
+            with self._cancellable(conn, cancel):
+                yield conn
+        finally:
+            self._readers.put(conn)
+    
+    @staticmethod
+    @contextmanager
+    def _cancellable(conn, cancel):
+        if cancel is None:
+            yield
+            return
+        conn.set_progress_handler(cancel.is_set, _CANCEL_CHECK_INTERVAL)
+        try:
+            yield
+        finally:
+            conn.set_progress_handler(None, 0)
+    
+    def close(self):
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            self.conn.close()
+    
+    def count_files(self):
+        with self._reading() as conn:
+            return conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+    
+    def _check_schema(self):
+        """
+        Verify that a database opened read-only was created, and migrated to
+        SCHEMA_VERSION, by a writable Storage.
+        """
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "files" not in tables:
+            raise RuntimeError(f"{self.db_path} contains no index; build it with a writable Engine first")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            raise RuntimeError(f"{self.db_path} has schema version {version}, expected {SCHEMA_VERSION}; "
+                               "open it writable once to migrate it")
+        self.fts_enabled = "files_fts" in tables
     
     def _create_tables(self):
-        # Table for files
+        is_new = not self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files'"
+        ).fetchone()
+        # Table for files; created/modified are epoch nanoseconds.
         query_files = """
         CREATE TABLE IF NOT EXISTS files (
             id INTEGER PRIMARY KEY,
             file_path TEXT UNIQUE,
             file_name TEXT,
             size_bytes INTEGER,
-            created DATETIME,
-            modified DATETIME,
+            created INTEGER,
+            modified INTEGER,
             extension TEXT,
             full_text TEXT,
-            metadata TEXT
+            metadata TEXT,
+            inode INTEGER,
+            device INTEGER,
+            mtime_ns INTEGER,
+            content_hash TEXT,
+            extractor TEXT
         )
         """
         self.conn.execute(query_files)
+        self._add_missing_columns("files", {
+            "inode": "INTEGER",
+            "device": "INTEGER",
+            "mtime_ns": "INTEGER",
+            "content_hash": "TEXT",
+            "extractor": "TEXT",
+        })
         # Table for indexed directories
         query_dirs = """
         CREATE TABLE IF NOT EXISTS indexed_dirs (
             dir_path TEXT PRIMARY KEY,
             status TEXT CHECK(status IN ('completed', 'incomplete')) NOT NULL DEFAULT 'incomplete',
-            last_indexed_at TEXT
+            last_indexed_at TEXT,
+            is_root INTEGER NOT NULL DEFAULT 1,
+            parent_dir TEXT,
+            mtime_ns INTEGER,
+            entry_count INTEGER
         )
         """
         self.conn.execute(query_dirs)
+        # Scan roots have is_root = 1; their subdirectories are tracked with
+        # is_root = 0 so unchanged ones can be skipped on the next scan.
+        self._add_missing_columns("indexed_dirs", {
+            "is_root": "INTEGER NOT NULL DEFAULT 1",
+            "parent_dir": "TEXT",
+            "mtime_ns": "INTEGER",
+            "entry_count": "INTEGER",
+        })
+        # Extractor output by (file fingerprint, "extractor@version"), see cache.ExtractionCache.
+        query_cache = """
+        CREATE TABLE IF NOT EXISTS extractor_cache (
+            size_bytes INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            device INTEGER NOT NULL,
+            extractor TEXT NOT NULL,
+            metadata BLOB,
+            stored_bytes INTEGER NOT NULL,
+            last_used INTEGER NOT NULL,
+            PRIMARY KEY (inode, device, size_bytes, mtime_ns, extractor)
+        )
+        """
+        self.conn.execute(query_cache)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_extractor_cache_used ON extractor_cache (last_used)")
+        # Files whose extraction failed, skipped until retry_after (epoch ns), see quarantine.Quarantine.
+        query_quarantine = """
+        CREATE TABLE IF NOT EXISTS quarantine (
+            file_path TEXT PRIMARY KEY,
+            size_bytes INTEGER,
+            mtime_ns INTEGER,
+            failures INTEGER NOT NULL DEFAULT 1,
+            last_error TEXT,
+            failed_at INTEGER,
+            retry_after INTEGER
+        )
+        """
+        self.conn.execute(query_quarantine)
+        self._create_attribute_table()
+        self.fts_enabled = self._create_fts_index()
+        if is_new:
+            # Created at the current schema: stamp it so later opens do not migrate.
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        else:
+            self._migrate(self.conn.execute("PRAGMA user_version").fetchone()[0])
+        for statement in _FILE_INDEXES:
+            self.conn.execute(statement)
         self.conn.commit()
     
+    def _migrate(self, version):
+        """
+        Bring an existing database from schema `version` up to SCHEMA_VERSION.
+        Added columns and tables are handled idempotently above; this covers
+        changes to the stored data itself.
+        """
+        if version < 1:
+            self._migrate_timestamps_to_ns()
+        if version < 2:
+            self._migrate_metadata_layout()
+        if version != SCHEMA_VERSION:
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
+    def _migrate_timestamps_to_ns(self):
+        # Version 0 stored created/modified as ISO-8601 strings.
+        rows = self.conn.execute(
+            "SELECT id, created, modified, mtime_ns FROM files WHERE typeof(created) = 'text' OR typeof(modified) = 'text'"
+        ).fetchall()
+        updates = []
+        for row in rows:
+            created = to_epoch_ns(row["created"])
+            modified = row["mtime_ns"] or to_epoch_ns(row["modified"])
+            updates.append((created, modified, row["id"]))
+        self.conn.executemany("UPDATE files SET created = ?, modified = ? WHERE id = ?", updates)
+        if updates:
+            print(f"[INFO] Migrated timestamps of {len(updates)} files to epoch nanoseconds")
+    
+    def _migrate_metadata_layout(self):
+        """
+        Re-encode metadata written before the text was stored only once in
+        full_text, so the JSON no longer carries a second copy of it.
+        """
+        rows = self.conn.execute("SELECT id, file_path, full_text, metadata FROM files").fetchall()
+        updates = []
+        for row in rows:
+            try:
+                file_metadata = decode_metadata(row["metadata"])
+            except Exception:
+                continue
+            full_text = row["full_text"] or ""
+            spans = {}
+            for key, value in file_metadata.items():
+                if isinstance(value, str) and (key == "full_text" or len(value) >= _TEXT_SPAN_MIN_LENGTH):
+                    start = full_text.find(value)
+                    if start >= 0:
+                        spans[key] = (start, len(value))
+            if spans:
+                updates.append((encode_metadata(file_metadata, full_text, spans, self.compression), row["id"]))
+        self.conn.executemany("UPDATE files SET metadata = ? WHERE id = ?", updates)
+        if updates:
+            print(f"[INFO] Removed duplicated text from the metadata of {len(updates)} files")
+    
+    def _create_attribute_table(self):
+        """
+        Create the key/value attribute table used for field queries, and
+        backfill it from the stored metadata JSON of an older database.
+        """
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_attributes'"
+        ).fetchone()
+        self.conn.execute(_CREATE_ATTRIBUTES)
+        for statement in _ATTRIBUTE_INDEXES:
+            self.conn.execute(statement)
+        if exists:
+            return
+        rows = []
+        for row in self.conn.execute("SELECT id, metadata FROM files").fetchall():
+            try:
+                file_metadata = decode_metadata(row["metadata"])
+            except Exception:
+                continue
+            rows.extend((row["id"],) + attr for attr in attribute_rows(file_metadata))
+        self.conn.executemany(
+            "INSERT INTO file_attributes (file_id, key, value, numeric_value) VALUES (?, ?, ?, ?)", rows
+        )
+    
+    def _create_fts_index(self):
+        """
+        Create the FTS5 index over files.file_name and files.full_text and the
+        triggers that keep it in sync. A database that predates the index is
+        backfilled once. Returns False if this SQLite build lacks FTS5, in
+        which case text clauses fall back to LIKE.
+        """
+        exists = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'"
+        ).fetchone()
+        try:
+            self.conn.execute(_CREATE_FTS)
+        except sqlite3.OperationalError as e:
+            print(f"[WARN] FTS5 unavailable, falling back to LIKE scans: {e}")
+            return False
+        for trigger in _FTS_TRIGGERS:
+            self.conn.execute(trigger)
+        if not exists:
+            self.conn.execute("INSERT INTO files_fts(files_fts) VALUES('rebuild')")
+        return True
+    
+    def _add_missing_columns(self, table, columns):
+        # Databases created by older versions lack the newer columns.
+        existing = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        for name, col_type in columns.items():
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+    
     def add_indexed_directory(self, dir_path, status="completed"):
         norm_dir = str(Path(dir_path).resolve())
         now = datetime.now().isoformat()
-        query = "INSERT OR REPLACE INTO indexed_dirs (dir_path, status, last_indexed_at) VALUES (?, ?, ?)"
-        self.conn.execute(query, (norm_dir, status, now))
-        self.conn.commit()
+        query = """
+        INSERT INTO indexed_dirs (dir_path, status, last_indexed_at, is_root) VALUES (?, ?, ?, 1)
+        ON CONFLICT(dir_path) DO UPDATE SET
+            status=excluded.status, last_indexed_at=excluded.last_indexed_at, is_root=1
+        """
+        with self._transaction() as conn:
+            conn.execute(query, (norm_dir, status, now))
+        self._roots_cache = None
     
     def get_indexed_directories(self):
-        query = "SELECT dir_path FROM indexed_dirs WHERE status = 'completed'"
-        cur = self.conn.execute(query)
-        rows = cur.fetchall()
+        query = "SELECT dir_path FROM indexed_dirs WHERE status = 'completed' AND is_root = 1"
+        with self._reading() as conn:
+            rows = conn.execute(query).fetchall()
         return {row["dir_path"] for row in rows}
     
-    def save_metadata(self, file_metadata):
+    def get_indexed_roots(self):
+        """
+        Return {dir_path: last_indexed_at} for the completed scan roots.
+        """
+        roots = self._roots_cache
+        if roots is None:
+            query = "SELECT dir_path, last_indexed_at FROM indexed_dirs WHERE status = 'completed' AND is_root = 1"
+            with self._reading() as conn:
+                roots = {row["dir_path"]: row["last_indexed_at"] for row in conn.execute(query)}
+            self._roots_cache = roots
+        return roots
+    
+    def get_directory_states(self, root):
+        """
+        Return (dir_path, parent_dir, mtime_ns, entry_count) rows recorded for
+        root and every directory below it.
+        """
+        low, high = _path_prefix_bounds(root)
+        query = """
+        SELECT dir_path, parent_dir, mtime_ns, entry_count FROM indexed_dirs
+        WHERE dir_path = ? OR (dir_path >= ? AND dir_path < ?)
+        """
+        with self._reading() as conn:
+            return [tuple(row) for row in conn.execute(query, (root, low, high))]
+    
+    def save_directory_states(self, root, dir_records):
+        """
+        Replace the recorded subdirectory states below root with dir_records,
+        {dir_path: (parent_dir, mtime_ns, entry_count)} from the scanner.
+        """
+        low, high = _path_prefix_bounds(root)
+        now = datetime.now().isoformat()
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM indexed_dirs WHERE is_root = 0 AND dir_path >= ? AND dir_path < ?", (low, high)
+            )
+            conn.executemany(
+                """
+                INSERT INTO indexed_dirs (dir_path, status, last_indexed_at, is_root, parent_dir, mtime_ns, entry_count)
+                VALUES (?, 'completed', ?, 0, ?, ?, ?)
+                ON CONFLICT(dir_path) DO UPDATE SET
+                    parent_dir=excluded.parent_dir, mtime_ns=excluded.mtime_ns, entry_count=excluded.entry_count
+                """,
+                ((dir_path, now, parent, mtime_ns, count) for dir_path, (parent, mtime_ns, count) in dir_records.items()),
+            )
+    
+    def _metadata_row(self, file_metadata):
         file_path = file_metadata.get("file_path")
         file_name = os.path.basename(file_path)
         size = file_metadata.get("size_bytes", 0)
-        created = file_metadata.get("created", datetime.now().isoformat())
-        modified = file_metadata.get("modified", datetime.now().isoformat())
+        now = time.time_ns()
+        created = to_epoch_ns(file_metadata.get("created")) or now
+        modified = file_metadata.get("mtime_ns") or to_epoch_ns(file_metadata.get("modified")) or now
         extension = str(Path(file_path).suffix).lower()
-        base_text = file_metadata.get("full_text", file_metadata.get("content", ""))
-        # Append any additional annotation key/value pairs.
-        direct_keys = {"file_path", "file_name", "size_bytes", "created", "modified", "extension", "full_text", "metadata"}
-        extra_text = ""
+        text_key = "full_text" if "full_text" in file_metadata else "content"
+        base_text = str(file_metadata.get(text_key) or "")
+        # Append any additional annotation key/value pairs, remembering where
+        # long string values land so the JSON can point at them.
+        direct_keys = {"file_path", "file_name", "size_bytes", "created", "modified", "extension", "full_text", "metadata",
+                       "inode", "device", "mtime_ns", "content_hash", "extractor", "_annotations", text_key}
+        parts = [base_text]
+        spans = {text_key: (0, len(base_text))}
+        position = len(base_text)
         for key, value in file_metadata.items():
             if key not in direct_keys:
-                extra_text += f" {key}:{value}"
-        full_text = (base_text + extra_text).strip()
-        meta_json = json.dumps(file_metadata)
+                part = f" {key}:{value}"
+                if isinstance(value, str) and len(value) >= _TEXT_SPAN_MIN_LENGTH:
+                    spans[key] = (position + len(key) + 2, len(value))
+                parts.append(part)
+                position += len(part)
+        full_text = "".join(parts)
+        # Stripping shifts the spans; encode_metadata drops any that no longer match.
+        leading = len(full_text) - len(full_text.lstrip())
+        full_text = full_text.strip()
+        spans = {key: (start - leading, length) for key, (start, length) in spans.items()}
+        meta_json = encode_metadata(file_metadata, full_text, spans, self.compression)
+        return (file_path, file_name, size, created, modified, extension, full_text, meta_json,
+                file_metadata.get("inode"), file_metadata.get("device"),
+                file_metadata.get("mtime_ns"), file_metadata.get("content_hash"), file_metadata.get("extractor"))
+    
+    def matches(self, query_str, file_metadata):
+        """
+        Test an extracted (possibly not yet written) file against query_str
+        in memory, as its stored row and attributes would be searched.
+        """
+        row = self._metadata_row(file_metadata)
+        columns = {"file_name": row[1], "size_bytes": row[2], "created": row[3], "modified": row[4],
+                   "extension": row[5], "full_text": row[6]}
+        attributes = {}
+        for key, value, number in attribute_rows(file_metadata):
+            attributes.setdefault(key, []).append((value, number))
+        return compile_predicate(query_str, self.fts_enabled)(MatchRecord(columns, attributes))
+    
+    def _attribute_rows(self, file_metadata):
+        file_path = file_metadata.get("file_path")
+        return [(key, value, number, file_path) for key, value, number in attribute_rows(file_metadata)]
+    
+    def _apply_writes(self, upserts=(), attributes=(), fingerprints=(), deletes=()):
+        """
+        Run one batch of writes without committing; the caller holds the
+        write lock. upserts are _metadata_row tuples; their attribute rows
+        replace whatever was stored before.
+        """
+        if upserts:
+            self.conn.executemany(_UPSERT_FILE, upserts)
+            self.conn.executemany(_DELETE_ATTRIBUTES, ((row[0],) for row in upserts))
+            self.conn.executemany(_INSERT_ATTRIBUTE, attributes)
+        if fingerprints:
+            self.conn.executemany(_UPDATE_FINGERPRINT, fingerprints)
+        if deletes:
+            self.conn.executemany(_DELETE_FILE, deletes)
+    
+    def save_metadata(self, file_metadata):
+        self.save_metadata_many([file_metadata])
+    
+    def save_metadata_many(self, metadata_list):
+        """
+        Upsert many files with executemany and a single commit.
+        """
+        upserts = [self._metadata_row(file_metadata) for file_metadata in metadata_list]
+        if not upserts:
+            return
+        attributes = [row for file_metadata in metadata_list for row in self._attribute_rows(file_metadata)]
+        with self._transaction():
+            self._apply_writes(upserts, attributes)
+    
+    def write_batch(self, batch_size=1000, flush_interval=2.0):
+        """
+        Return a WriteBatch context manager that groups upserts, deletions and
+        fingerprint refreshes into one transaction per batch.
+        """
+        return WriteBatch(self, batch_size, flush_interval)
+    
+    def get_fingerprints(self, dir_path):
+        """
+        Return {file_path: (size_bytes, mtime_ns, inode, device, content_hash,
+        extractor)} for every indexed file under dir_path.
+        """
+        low, high = _path_prefix_bounds(dir_path)
+        query = """
+        SELECT file_path, size_bytes, mtime_ns, inode, device, content_hash, extractor
+        FROM files WHERE file_path >= ? AND file_path < ?
+        """
+        with self._reading() as conn:
+            return {
+                row["file_path"]: (row["size_bytes"], row["mtime_ns"], row["inode"], row["device"],
+                                   row["content_hash"], row["extractor"])
+                for row in conn.execute(query, (low, high))
+            }
+    
+    def update_fingerprint(self, file_path, size_bytes, mtime_ns, inode, device):
+        """
+        Refresh the stored fingerprint of a file whose contents did not change.
+        """
+        with self._transaction() as conn:
+            conn.execute(_UPDATE_FINGERPRINT, (size_bytes, mtime_ns, inode, device, file_path))
+    
+    def get_cached_extraction(self, fingerprint, extractor):
+        """
+        Return the cached output of extractor ("name@version") for a file with
+        fingerprint (size_bytes, mtime_ns, inode, device), or None.
+        """
+        query = """
+        SELECT metadata FROM extractor_cache
+        WHERE inode = ? AND device = ? AND size_bytes = ? AND mtime_ns = ? AND extractor = ?
+        """
+        size_bytes, mtime_ns, inode, device = fingerprint
+        with self._reading() as conn:
+            row = conn.execute(query, (inode, device, size_bytes, mtime_ns, extractor)).fetchone()
+        return None if row is None else decode_metadata(row["metadata"])
+    
+    def cache_extractions(self, entries=(), hits=()):
+        """
+        Store extractor output, entries being (fingerprint, extractor,
+        metadata) tuples, and mark the (fingerprint, extractor) hits as just
+        used, in one transaction.
+        """
+        now = time.time_ns()
+        rows = []
+        for (size_bytes, mtime_ns, inode, device), extractor, file_metadata in entries:
+            data = encode_metadata(file_metadata, "", {}, self.compression)
+            rows.append((size_bytes, mtime_ns, inode, device, extractor, data, len(data), now))
+        with self._transaction() as conn:
+            conn.executemany("""
+            INSERT OR REPLACE INTO extractor_cache
+                (size_bytes, mtime_ns, inode, device, extractor, metadata, stored_bytes, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            conn.executemany("""
+            UPDATE extractor_cache SET last_used = ?
+            WHERE inode = ? AND device = ? AND size_bytes = ? AND mtime_ns = ? AND extractor = ?
+            """, ((now, inode, device, size_bytes, mtime_ns, extractor)
+                  for (size_bytes, mtime_ns, inode, device), extractor in hits))
+    
+    def evict_extraction_cache(self, max_bytes):
+        """
+        Delete the least recently used cache entries until the cached
+        metadata takes at most max_bytes. Returns the number deleted.
+        """
         query = """
-        INSERT INTO files (file_path, file_name, size_bytes, created, modified, extension, full_text, metadata)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        DELETE FROM extractor_cache WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, SUM(stored_bytes) OVER (ORDER BY last_used DESC, rowid DESC) AS running
+                FROM extractor_cache
+            ) WHERE running > ?
+        )
+        """
+        with self._transaction() as conn:
+            return conn.execute(query, (max_bytes,)).rowcount
+    
+    def get_quarantine(self, dir_path=None):
+        """
+        Return {file_path: (size_bytes, mtime_ns, failures, retry_after)} for
+        the quarantined files under dir_path (all of them if None).
+        """
+        query = "SELECT file_path, size_bytes, mtime_ns, failures, retry_after FROM quarantine"
+        params = ()
+        if dir_path is not None:
+            query += " WHERE file_path >= ? AND file_path < ?"
+            params = _path_prefix_bounds(dir_path)
+        with self._reading() as conn:
+            return {row["file_path"]: (row["size_bytes"], row["mtime_ns"], row["failures"], row["retry_after"])
+                    for row in conn.execute(query, params)}
+    
+    def get_quarantined(self):
+        """
+        Return a dict per quarantined file: file_path, failures, last_error,
+        failed_at and retry_after (ISO timestamps).
+        """
+        query = "SELECT file_path, failures, last_error, failed_at, retry_after FROM quarantine ORDER BY file_path"
+        with self._reading() as conn:
+            rows = conn.execute(query).fetchall()
+        return [{
+            "file_path": row["file_path"],
+            "failures": row["failures"],
+            "last_error": row["last_error"],
+            "failed_at": datetime.fromtimestamp(row["failed_at"] / 1e9).isoformat(),
+            "retry_after": datetime.fromtimestamp(row["retry_after"] / 1e9).isoformat(),
+        } for row in rows]
+    
+    def quarantine_file(self, file_path, size_bytes, mtime_ns, error, backoff, max_backoff):
+        """
+        Record a failed extraction. The file is retried after backoff
+        seconds, doubling with each consecutive failure up to max_backoff.
+        """
+        now = time.time_ns()
+        query = """
+        INSERT INTO quarantine (file_path, size_bytes, mtime_ns, failures, last_error, failed_at, retry_after)
+        VALUES (:path, :size, :mtime, 1, :error, :now, :now + :base)
         ON CONFLICT(file_path) DO UPDATE SET
-            file_name=excluded.file_name,
-            size_bytes=excluded.size_bytes,
-            created=excluded.created,
-            modified=excluded.modified,
-            extension=excluded.extension,
-            full_text=excluded.full_text,
-            metadata=excluded.metadata
-        """
-        self.conn.execute(query, (file_path, file_name, size, created, modified, extension, full_text, meta_json))
-        self.conn.commit()
+            size_bytes = excluded.size_bytes,
+            mtime_ns = excluded.mtime_ns,
+            failures = failures + 1,
+            last_error = excluded.last_error,
+            failed_at = excluded.failed_at,
+            retry_after = :now + MIN(:base * (1 << MIN(failures, 20)), :max)
+        """
+        params = {"path": file_path, "size": size_bytes, "mtime": mtime_ns, "error": error, "now": now,
+                  "base": int(backoff * 1e9), "max": int(max_backoff * 1e9)}
+        with self._transaction() as conn:
+            conn.execute(query, params)
+    
+    def release_quarantine(self, file_path=None):
+        """
+        Remove file_path (or every file, if None) from the quarantine.
+        """
+        with self._transaction() as conn:
+            if file_path is None:
+                conn.execute("DELETE FROM quarantine")
+            else:
+                conn.execute("DELETE FROM quarantine WHERE file_path = ?", (file_path,))
+    
+    def get_same_size(self, size_bytes, exclude_path=None, limit=32):
+        """
+        Return up to limit (file_path, content_hash, mtime_ns) rows of indexed
+        files of exactly size_bytes, other than exclude_path.
+        """
+        query = "SELECT file_path, content_hash, mtime_ns FROM files WHERE size_bytes = ? AND file_path != ? LIMIT ?"
+        with self._reading() as conn:
+            return [tuple(row) for row in conn.execute(query, (size_bytes, exclude_path or "", limit))]
+    
+    def get_size_collisions(self, min_size=1):
+        """
+        Return {size_bytes: [(file_path, content_hash, mtime_ns), ...]} for
+        every size shared by more than one indexed file of at least min_size
+        bytes.
+        """
+        query = """
+        SELECT size_bytes, file_path, content_hash, mtime_ns FROM files WHERE size_bytes IN (
+            SELECT size_bytes FROM files WHERE size_bytes >= ? GROUP BY size_bytes HAVING COUNT(*) > 1
+        ) ORDER BY size_bytes
+        """
+        collisions = {}
+        with self._reading() as conn:
+            for row in conn.execute(query, (min_size,)):
+                collisions.setdefault(row["size_bytes"], []).append(
+                    (row["file_path"], row["content_hash"], row["mtime_ns"]))
+        return collisions
+    
+    def set_content_hash(self, file_path, digest):
+        with self._transaction() as conn:
+            conn.execute("UPDATE files SET content_hash = ? WHERE file_path = ?", (digest, file_path))
+    
+    def set_content_hashes(self, hashes):
+        """
+        Store many {file_path: content_hash} values in one transaction.
+        """
+        with self._transaction() as conn:
+            conn.executemany("UPDATE files SET content_hash = ? WHERE file_path = ?",
+                             ((digest, file_path) for file_path, digest in hashes.items()))
+    
+    def find_duplicates(self, min_size=1):
+        """
+        Return [[file_path, ...], ...]: groups of indexed files of at least
+        min_size bytes that share a stored content hash, largest files first.
+        """
+        query = """
+        SELECT content_hash, file_path FROM files WHERE size_bytes >= ? AND content_hash IN (
+            SELECT content_hash FROM files WHERE content_hash IS NOT NULL
+            GROUP BY content_hash HAVING COUNT(*) > 1
+        ) ORDER BY size_bytes DESC, content_hash, file_path
+        """
+        groups = {}
+        with self._reading() as conn:
+            for row in conn.execute(query, (min_size,)):
+                groups.setdefault(row["content_hash"], []).append(row["file_path"])
+        return [paths for paths in groups.values() if len(paths) > 1]
+    
+    def rename_path(self, old_path, new_path):
+        """
+        Move a file, or a directory and everything indexed below it, from
+        old_path to new_path without re-extracting anything. Extracted
+        metadata and annotations are kept; rows already stored at new_path are
+        replaced. Returns the number of files moved.
+        """
+        old_low, old_high = _path_prefix_bounds(old_path)
+        new_low, new_high = _path_prefix_bounds(new_path)
+        params = {
+            "old": old_path,
+            "new": new_path,
+            "old_length": len(old_path),
+            "low": old_low,
+            "high": old_high,
+            "name": os.path.basename(new_path),
+            "extension": Path(new_path).suffix.lower(),
+            "new_parent": os.path.dirname(new_path),
+        }
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM files WHERE file_path = ? OR (file_path >= ? AND file_path < ?)",
+                (new_path, new_low, new_high),
+            )
+            moved = conn.execute(_RENAME_FILES, params).rowcount
+            conn.execute(
+                "DELETE FROM indexed_dirs WHERE dir_path = ? OR (dir_path >= ? AND dir_path < ?)",
+                (new_path, new_low, new_high),
+            )
+            conn.execute(_RENAME_DIRS, params)
+        self._roots_cache = None
+        return moved
     
     def remove_metadata(self, file_path):
         try:
-            query = "DELETE FROM files WHERE file_path = ?"
-            self.conn.execute(query, (file_path,))
-            self.conn.commit()
+            with self._transaction() as conn:
+                conn.execute(_DELETE_FILE, (file_path,))
             print(f"[INFO] Metadata removed for {file_path}")
         except Exception as e:
             print(f"[ERROR] Removing metadata for {file_path}: {e}")
     
+    def remove_metadata_many(self, file_paths):
+        """
+        Delete the rows of file_paths in one transaction; returns how many existed.
+        """
+        if not file_paths:
+            return 0
+        with self._transaction() as conn:
+            return conn.executemany(_DELETE_FILE, ((file_path,) for file_path in file_paths)).rowcount
+    
     def get_metadata(self, file_path):
-        query = "SELECT metadata FROM files WHERE file_path = ? LIMIT 1"
-        cur = self.conn.execute(query, (file_path,))
-        row = cur.fetchone()
+        query = "SELECT file_path, file_name, full_text, metadata FROM files WHERE file_path = ? LIMIT 1"
+        with self._reading() as conn:
+            row = conn.execute(query, (file_path,)).fetchone()
         if row:
             try:
-                return json.loads(row["metadata"])
+                return decode_metadata(row["metadata"], row["full_text"], row["file_path"], row["file_name"])
             except Exception as e:
                 print(f"[ERROR] Decoding metadata for {file_path}: {e}")
                 return None
         return None
 
+    def iter_metadata(self, batch_size=500):
+        """
+        Yield the decoded metadata of every indexed file, batch_size rows at a time.
+        """
+        query = "SELECT file_path, file_name, full_text, metadata FROM files ORDER BY id"
+        with self._reading() as conn:
+            cur = conn.execute(query)
+            try:
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        try:
+                            yield decode_metadata(row["metadata"], row["full_text"], row["file_path"],
+                                                  row["file_name"])
+                        except Exception as e:
+                            print(f"[ERROR] Decoding metadata for {row['file_path']}: {e}")
+            finally:
+                cur.close()
+
+    def filter_paths(self, file_paths, where="1", params=(), cancel=None):
+        """
+        Return the set of file_paths that are indexed and match the compiled
+        condition where/params (see query_parser.split_free_text).
+        """
+        file_paths = list(file_paths)
+        found = set()
+        with self._reading(cancel) as conn:
+            for start in range(0, len(file_paths), 500):
+                chunk = file_paths[start:start + 500]
+                query = f"SELECT file_path FROM files WHERE file_path IN ({', '.join('?' * len(chunk))}) AND ({where})"
+                found.update(row[0] for row in conn.execute(query, [*chunk, *params]))
+        return found
+
     def parse_query(self, query_str):
-        direct_columns = {"file_name", "size_bytes", "created", "modified", "extension"}
-        tokens = [t.strip() for t in query_str.split("AND")]
-        clauses = []
-        params = []
-        for token in tokens:
-            m_range = re.match(r'(\w+):\[(.+?)\s+TO\s*(.*?)\]', token)
-            if m_range:
-                key = m_range.group(1)
-                start = m_range.group(2).strip()
-                end = m_range.group(3).strip()
-                if key == "size_bytes":
-                    if not end:
-                        clauses.append(f"{key} >= ?")
-                        params.append(float(start))
-                    else:
-                        clauses.append(f"{key} BETWEEN ? AND ?")
-                        params.append(float(start))
-                        params.append(float(end))
-                elif key in {"created", "modified"}:
-                    clauses.append(f"{key} BETWEEN ? AND ?")
-                    params.append(start)
-                    params.append(end)
-                else:
-                    clauses.append("full_text LIKE ?")
-                    params.append(f"%{token}%")
-                continue
-            m_field = re.match(r'(\w+):"([^"]+)"', token)
-            if not m_field:
-                m_field = re.match(r'(\w+):(\S+)', token)
-            if m_field:
-                key = m_field.group(1)
-                value = m_field.group(2)
-                if key in direct_columns:
-                    clauses.append(f"{key} LIKE ?")
-                    params.append(f"%{value}%")
-                else:
-                    clauses.append("full_text LIKE ?")
-                    # Look for both the key and value in full_text.
-                    params.append(f"%{key}%{value}%")
-                continue
-            clauses.append("(file_name LIKE ? OR full_text LIKE ?)")
-            params.append(f"%{token}%")
-            params.append(f"%{token}%")
-        where_clause = " AND ".join(clauses) if clauses else "1"
+        """
+        Return (where_clause, params) for query_str, with the free-text part
+        folded into an FTS subquery.
+        """
+        plan = plan_query(query_str, self.fts_enabled)
+        where_clause, params = plan.where, list(plan.params)
+        if plan.fts_match:
+            where_clause = f"id IN (SELECT rowid FROM files_fts WHERE files_fts MATCH ?) AND ({where_clause})"
+            params = [plan.fts_match] + params
         return where_clause, params
 
-    def search_sql(self, query_str):
-        where_clause, params = self.parse_query(query_str)
-        query = f"SELECT * FROM files WHERE {where_clause} LIMIT 20"
-        cur = self.conn.execute(query, params)
-        rows = cur.fetchall()
-        return [dict(row) for row in rows]
+    def _select(self, query_str, columns=None, after=None):
+        """
+        Build the SELECT for query_str. Rows carry two extra fields used for
+        keyset pagination: _rank (bm25, text queries only) and _id.
+        Results are ordered by rank for text queries, otherwise by id.
+        """
+        plan = plan_query(query_str, self.fts_enabled)
+        where_clause, params = plan.where, list(plan.params)
+        projection = self._projection(columns)
+        if plan.fts_match:
+            query = f"""
+            SELECT {projection}, hits.rank AS _rank, files.id AS _id FROM files
+            JOIN (SELECT rowid, {_FTS_RANK} AS rank FROM files_fts WHERE files_fts MATCH ?) AS hits
+                ON files.id = hits.rowid
+            WHERE ({where_clause})
+            """
+            params = [plan.fts_match] + params
+            if after is not None:
+                query += " AND (hits.rank, files.id) > (?, ?)"
+                params.extend(after)
+            query += " ORDER BY hits.rank, files.id"
+        else:
+            query = f"SELECT {projection}, files.id AS _id FROM files WHERE ({where_clause})"
+            if after is not None:
+                query += " AND files.id > ?"
+                params.append(after[-1])
+            query += " ORDER BY files.id"
+        return query, params
+
+    def _projection(self, columns):
+        if not columns:
+            return "files.*"
+        unknown = set(columns) - SEARCH_COLUMNS
+        if unknown:
+            raise ValueError(f"Unknown columns in projection: {sorted(unknown)}")
+        return ", ".join(f"files.{column}" for column in columns)
+
+    @staticmethod
+    def _row_dict(row):
+        result = dict(row)
+        result.pop("_rank", None)
+        result.pop("_id", None)
+        if result.get("metadata") is not None:
+            # Spanned text values are only restored when full_text was selected too.
+            try:
+                result["metadata"] = decode_metadata(result["metadata"], result.get("full_text"),
+                                                     result.get("file_path"), result.get("file_name"))
+            except Exception as e:
+                print(f"[ERROR] Decoding metadata for {result.get('file_path')}: {e}")
+        return result
+
+    @staticmethod
+    def _cursor_for(row):
+        keys = row.keys()
+        return (row["_rank"], row["_id"]) if "_rank" in keys else (row["_id"],)
+
+    def search_sql(self, query_str, limit=20, offset=0, columns=None, cancel=None):
+        """
+        Return up to `limit` matching rows (None for no limit), skipping the
+        first `offset`. `columns` restricts which files columns are returned,
+        e.g. ("file_path", "size_bytes"), so large full_text / metadata values
+        are only read when asked for. A selected metadata column is returned
+        decoded, as a dict. Setting the `cancel` threading.Event interrupts
+        the query.
+        """
+        query, params = self._select(query_str, columns)
+        query += " LIMIT ? OFFSET ?"
+        params.extend([-1 if limit is None else limit, offset])
+        with self._reading(cancel) as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [self._row_dict(row) for row in rows]
+    
+    def search_page(self, query_str, limit=20, cursor=None, columns=None, cancel=None):
+        """
+        Keyset pagination: return (rows, next_cursor). Pass next_cursor back
+        to get the following page; it is None once the last page is reached.
+        Unlike offsets, each page costs the same no matter how deep it is.
+        """
+        query, params = self._select(query_str, columns, after=cursor)
+        query += " LIMIT ?"
+        params.append(limit)
+        with self._reading(cancel) as conn:
+            rows = conn.execute(query, params).fetchall()
+        next_cursor = self._cursor_for(rows[-1]) if len(rows) == limit else None
+        return [self._row_dict(row) for row in rows], next_cursor
     
-    def search(self, query_str):
-        return self.search_sql(query_str)
+    def iter_search(self, query_str, columns=None, batch_size=500, cancel=None):
+        """
+        Yield matching rows lazily, fetching batch_size rows at a time, so
+        exporting a very large result set runs in constant memory.
+        """
+        query, params = self._select(query_str, columns)
+        # The pooled connection stays checked out until the iterator is exhausted or closed.
+        with self._reading(cancel) as conn:
+            cur = conn.execute(query, params)
+            try:
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield self._row_dict(row)
+            finally:
+                cur.close()
+    
+    def search(self, query_str, limit=20, offset=0, columns=None, cancel=None):
+        return self.search_sql(query_str, limit=limit, offset=offset, columns=columns, cancel=cancel)
+
+
+class WriteBatch:
+    """
+    Buffers writes and applies them in one transaction whenever batch_size
+    operations are pending or flush_interval seconds have passed since the
+    last flush. A crash loses at most the operations of the current batch.
+
+        with storage.write_batch(batch_size=5000) as batch:
+            for metadata in ...:
+                batch.add(metadata)
+    """
+
+    def __init__(self, storage, batch_size=1000, flush_interval=2.0):
+        self.storage = storage
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self._upserts = []
+        self._attributes = []
+        self._deletes = []
+        self._fingerprints = []
+        self._pending_paths = set()
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def __len__(self):
+        return len(self._upserts) + len(self._deletes) + len(self._fingerprints)
+
+    def _touch(self, file_path):
+        # Operations within a batch are not ordered across kinds, so a second
+        # operation on the same path starts a new batch.
+        if file_path in self._pending_paths:
+            self.flush()
+        self._pending_paths.add(file_path)
+
+    def add(self, file_metadata):
+        self._touch(file_metadata.get("file_path"))
+        self._upserts.append(self.storage._metadata_row(file_metadata))
+        self._attributes.extend(self.storage._attribute_rows(file_metadata))
+        self._maybe_flush()
+
+    def remove(self, file_path):
+        self._touch(file_path)
+        self._deletes.append((file_path,))
+        self._maybe_flush()
+
+    def update_fingerprint(self, file_path, size_bytes, mtime_ns, inode, device):
+        self._touch(file_path)
+        self._fingerprints.append((size_bytes, mtime_ns, inode, device, file_path))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self) >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not len(self):
+            return
+        try:
+            with self.storage._transaction():
+                self.storage._apply_writes(self._upserts, self._attributes, self._fingerprints, self._deletes)
+        finally:
+            self._upserts = []
+            self._attributes = []
+            self._deletes = []
+            self._fingerprints = []
+            self._pending_paths = set()
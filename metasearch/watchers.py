@@ -1,38 +1,252 @@
 # metasearch/watchers.py
 
+import os
+import threading
+import time
+from pathlib import Path
+
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
-from .scanner import scan_directory
-from .engine import Engine
+from .scanner import is_path_excluded, scan_directory
+
+
+class ChangeQueue:
+    """
+    Coalesces filesystem events per path and applies them from a dedicated
+    worker thread. A path is only processed once no event has arrived for
+    `debounce` seconds and its size and mtime are unchanged across two
+    checks, so a file that is still being copied is extracted once, after
+    the copy finishes. Ready changes are written in batched transactions;
+    a batch whose write fails is queued again and retried after another
+    debounce window. Nothing is printed per file: `stats` counts the files
+    indexed, removed and moved so far, and the extractions that failed.
+    """
+
+    UPSERT = "upsert"
+    DELETE = "delete"
+
+    def __init__(self, engine, debounce=1.0, batch_size=500):
+        self.engine = engine
+        self.debounce = debounce
+        self.batch_size = batch_size
+        # path -> [kind, time of last event, (size, mtime_ns) seen at last check]
+        self._pending = {}
+        # (old_path, new_path) renames, applied before any pending change.
+        self._moves = []
+        self.stats = {"indexed": 0, "removed": 0, "moved": 0, "errors": 0}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metasearch-watch", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the worker after applying everything still pending.
+        """
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join()
+
+    def put(self, kind, path):
+        # The latest event wins: created+modified+deleted collapses to a delete.
+        with self._lock:
+            self._pending[path] = [kind, time.monotonic(), None]
+        self._wakeup.set()
+
+    def move(self, old_path, new_path):
+        """
+        Queue a rename of a file or directory. Pending changes below old_path
+        follow it to new_path; new_path=None drops old_path from the index.
+        """
+        with self._lock:
+            prefix = os.path.join(old_path, "")
+            for path in [p for p in self._pending if p == old_path or p.startswith(prefix)]:
+                entry = self._pending.pop(path)
+                if new_path is not None:
+                    self._pending[new_path + path[len(old_path):]] = entry
+            self._moves.append((old_path, new_path))
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(timeout=max(self.debounce / 2, 0.05))
+            self._wakeup.clear()
+            self._apply_moves()
+            ready = self._take_ready()
+            if ready:
+                self._apply(ready)
+        with self._lock:
+            remaining = [(kind, path, None) for path, (kind, _, _) in self._pending.items()]
+            self._pending.clear()
+        self._apply_moves()
+        if remaining:
+            self._apply(remaining)
+
+    def _take_ready(self):
+        now = time.monotonic()
+        with self._lock:
+            quiet = [(path, entry[0], entry[1], entry[2]) for path, entry in self._pending.items()
+                     if now - entry[1] >= self.debounce]
+        ready = []
+        for path, kind, last_event, last_seen in quiet:
+            stat_result = None
+            if kind == self.UPSERT:
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    kind = self.DELETE
+                except OSError:
+                    pass
+            with self._lock:
+                entry = self._pending.get(path)
+                if entry is None or entry[1] != last_event:
+                    continue  # a newer event arrived meanwhile
+                if stat_result is not None:
+                    seen = (stat_result.st_size, stat_result.st_mtime_ns)
+                    if seen != last_seen:
+                        # Still changing (or first check): look again after another window.
+                        entry[1], entry[2] = now, seen
+                        continue
+                del self._pending[path]
+            ready.append((kind, path, stat_result))
+            if len(ready) >= self.batch_size:
+                break
+        return ready
+
+    def _apply_moves(self):
+        with self._lock:
+            moves, self._moves = self._moves, []
+        storage = self.engine.storage
+        plugins = self.engine.plugins
+        counts = {"removed": 0, "moved": 0}
+        for old_path, new_path in moves:
+            try:
+                if new_path is None:
+                    removed = [old_path, *storage.get_fingerprints(old_path)]
+                    counts["removed"] += storage.remove_metadata_many(removed)
+                    for file_path in removed:
+                        plugins.remove(file_path)
+                    continue
+                old_paths = [old_path, *storage.get_fingerprints(old_path)] if plugins.plugins() else ()
+                moved = storage.rename_path(old_path, new_path)
+                counts["moved"] += moved
+                for file_path in old_paths:
+                    plugins.remove(file_path)
+                    metadata = storage.get_metadata(new_path + file_path[len(old_path):])
+                    if metadata is not None:
+                        plugins.add(metadata)
+                if not moved and os.path.isfile(new_path):
+                    # Not indexed under its old name yet; index it as new.
+                    self.put(self.UPSERT, new_path)
+            except Exception as e:
+                print(f"[ERROR] Moving {old_path} -> {new_path}: {e}")
+        plugins.flush()
+        self._count(counts)
+        return counts
+
+    def _apply(self, changes):
+        """
+        Write a batch of (kind, path, stat_result) changes and return the
+        counts of files indexed and removed and of failed extractions.
+        """
+        counts = {"indexed": 0, "removed": 0, "errors": 0}
+        try:
+            with self.engine.storage.write_batch(self.batch_size, self.debounce) as batch:
+                for kind, path, stat_result in changes:
+                    if kind == self.DELETE or not os.path.exists(path):
+                        batch.remove(path)
+                        self.engine.plugins.remove(path)
+                        counts["removed"] += 1
+                        continue
+                    metadata = self.engine._extract(path, stat_result)
+                    if metadata is None:
+                        counts["errors"] += 1
+                        continue
+                    batch.add(metadata)
+                    self.engine.plugins.add(metadata)
+                    counts["indexed"] += 1
+        except Exception as e:
+            print(f"[ERROR] Applying {len(changes)} file changes, retrying them: {e}")
+            self._requeue(changes)
+            counts = {"indexed": 0, "removed": 0, "errors": 0}
+        self.engine.plugins.flush()
+        self._count(counts)
+        return counts
+
+    def _requeue(self, changes):
+        # A newer event for a path replaces the failed change.
+        now = time.monotonic()
+        with self._lock:
+            for kind, path, _ in changes:
+                self._pending.setdefault(path, [kind, now, None])
+
+    def _count(self, counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.stats[key] += value
+
 
 class FileChangeHandler(FileSystemEventHandler):
-    def __init__(self, engine: Engine):
+    def __init__(self, engine, queue):
         self.engine = engine
+        self.queue = queue
+
+    def _wanted(self, event):
+        return not event.is_directory and not is_path_excluded(event.src_path, self.engine.config)
 
     def on_created(self, event):
-        if not event.is_directory:
-            self.engine.process_file(event.src_path)
+        if self._wanted(event):
+            self.queue.put(ChangeQueue.UPSERT, os.path.abspath(event.src_path))
 
     def on_modified(self, event):
-        if not event.is_directory:
-            self.engine.process_file(event.src_path)
+        if self._wanted(event):
+            self.queue.put(ChangeQueue.UPSERT, os.path.abspath(event.src_path))
 
     def on_deleted(self, event):
-        if not event.is_directory:
-            self.engine.remove_file(event.src_path)
+        if event.is_directory:
+            # Also reported for a folder moved out of the watched tree: drop its subtree.
+            self.queue.move(os.path.abspath(event.src_path), None)
+        else:
+            self.queue.put(ChangeQueue.DELETE, os.path.abspath(event.src_path))
+
+    def on_moved(self, event):
+        # Children of a moved directory are reported again as synthetic moves;
+        # the directory rename already covers them.
+        if getattr(event, "is_synthetic", False):
+            return
+        config = self.engine.config
+        src_path = os.path.abspath(event.src_path)
+        dest_path = os.path.abspath(event.dest_path)
+        if is_path_excluded(dest_path, config, event.is_directory):
+            self.queue.move(src_path, None)
+        elif is_path_excluded(src_path, config, event.is_directory):
+            # Moved in from an excluded location: nothing to rename.
+            if event.is_directory:
+                for file_path in scan_directory(dest_path, config):
+                    self.queue.put(ChangeQueue.UPSERT, file_path)
+            else:
+                self.queue.put(ChangeQueue.UPSERT, dest_path)
+        else:
+            self.queue.move(src_path, dest_path)
 
 class Watcher:
-    def __init__(self, paths, engine: Engine):
+    def __init__(self, paths, engine):
         self.paths = paths
         self.engine = engine
         self.observer = Observer()
+        self.queue = ChangeQueue(engine, engine.config.watch_debounce, engine.config.watch_batch_size)
 
     def start(self):
-        handler = FileChangeHandler(self.engine)
+        handler = FileChangeHandler(self.engine, self.queue)
         for path in self.paths:
-            self.observer.schedule(handler, path, recursive=True)
+            self.observer.schedule(handler, str(Path(path).resolve()), recursive=True)
+        self.queue.start()
         self.observer.start()
 
     def stop(self):
         self.observer.stop()
         self.observer.join()
+        self.queue.stop()
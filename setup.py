@@ -26,6 +26,9 @@ setup(
         "chardet>=4.0.0",
         "ffmpeg-python>=0.2.0",
     ],
+    extras_require={
+        "test": ["pytest>=7.0", "watchdog>=2.1.6"],
+    },
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Programming Language :: Python :: 3",
@@ -0,0 +1,34 @@
+import pytest
+
+from metasearch import Config, Engine, extractors
+
+
+@pytest.fixture
+def make_engine(tmp_path):
+    """
+    Return a factory for Engines on tmp_path/index.db (without lazy
+    indexing unless asked for); every Engine it made is shut down afterwards.
+    """
+    engines = []
+
+    def make(**options):
+        options.setdefault("db_path", str(tmp_path / "index.db"))
+        options.setdefault("lazy_indexing", False)
+        engine = Engine(Config(**options))
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in reversed(engines):
+        engine.shutdown()
+
+
+@pytest.fixture
+def register_extractor(monkeypatch):
+    """
+    metasearch.register_extractor, with every extractor it registers
+    removed again after the test.
+    """
+    monkeypatch.setattr(extractors, "_EXTRACTOR_REGISTRY", dict(extractors._EXTRACTOR_REGISTRY))
+    monkeypatch.setattr(extractors, "_EXTRACTOR_IDS", dict(extractors._EXTRACTOR_IDS))
+    return extractors.register_extractor
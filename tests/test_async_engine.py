@@ -0,0 +1,96 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from metasearch import Config
+from metasearch.async_engine import AsyncEngine
+from metasearch.extractors import get_extractor_for
+
+
+@pytest.fixture
+def docs(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(20):
+        (docs / f"f{i:02}.as").write_text(f"async file {i}")
+    return docs
+
+
+@pytest.fixture
+def slow_extractor(register_extractor):
+    """
+    Register an extractor for .as files that takes 20 ms per file and records them.
+    """
+    base = get_extractor_for("file.txt")
+    calls = []
+
+    def extract(file_path):
+        calls.append(file_path)
+        time.sleep(0.02)
+        return base(file_path)
+
+    register_extractor(".as", extract)
+    return calls
+
+
+def _config(tmp_path):
+    return Config(db_path=str(tmp_path / "index.db"), lazy_indexing=False)
+
+
+def test_index_streams_progress_then_searches(tmp_path, docs, slow_extractor):
+    async def main():
+        async with AsyncEngine(_config(tmp_path)) as engine:
+            events = [event async for event in engine.index(str(docs))]
+            hits = await engine.search("async", limit=None)
+            return events, hits
+
+    events, hits = asyncio.run(main())
+    assert [event["status"] for event in events] == ["added"] * 20 + ["done"]
+    assert events[-1]["stats"]["added"] == 20
+    assert sorted(hits) == sorted(str(path) for path in docs.iterdir())
+
+
+def test_timeout_stops_indexing(tmp_path, docs, slow_extractor):
+    async def main():
+        async with AsyncEngine(_config(tmp_path)) as engine:
+            with pytest.raises(asyncio.TimeoutError):
+                await engine.update_index(str(docs), timeout=0.1)
+
+    asyncio.run(main())
+    # close() waited for the worker, which stopped at the next file.
+    assert 0 < len(slow_extractor) < 20
+
+
+def test_leaving_the_progress_loop_cancels_indexing(tmp_path, docs, slow_extractor):
+    async def main():
+        async with AsyncEngine(_config(tmp_path)) as engine:
+            async for event in engine.index(str(docs)):
+                break
+
+    asyncio.run(main())
+    assert len(slow_extractor) < 20
+
+
+def test_cancelled_search_interrupts_the_query(tmp_path):
+    interrupted = threading.Event()
+
+    def search(query_str, limit, offset, wait=None, cancel=None):
+        if cancel.wait(5):
+            interrupted.set()
+        return []
+
+    async def main():
+        async with AsyncEngine(_config(tmp_path)) as engine:
+            engine.engine.search = search
+            task = asyncio.ensure_future(engine.search("anything"))
+            await asyncio.sleep(0.05)
+            # The event loop keeps running while the query is in flight.
+            assert not task.done()
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(main())
+    assert interrupted.wait(5)
@@ -0,0 +1,216 @@
+import os
+import threading
+import time
+
+import pytest
+
+from metasearch.extractors import get_extractor_for
+
+
+@pytest.fixture
+def counting_extractor(register_extractor):
+    """
+    Register a text extractor for an extension that records every file it extracts.
+    """
+    def register(extension, version="1"):
+        base = get_extractor_for("file.txt")
+        calls = []
+
+        def extract(file_path):
+            calls.append(file_path)
+            return base(file_path)
+
+        register_extractor(extension, extract, version=version)
+        return calls
+    return register
+
+
+def test_identical_files_are_extracted_once(tmp_path, make_engine, counting_extractor):
+    calls = counting_extractor(".dd")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name in ("a.dd", "b.dd", "c.dd"):
+        (docs / name).write_text("the same contents")
+    (docs / "d.dd").write_text("other contents")
+    engine = make_engine(dedupe_contents=True)
+    assert engine.index_directory(str(docs))["added"] == 4
+    assert len(calls) == 2
+    assert sorted(engine.search("same", limit=None)) == [str(docs / name) for name in ("a.dd", "b.dd", "c.dd")]
+    assert engine.find_duplicates() == [[str(docs / name) for name in ("a.dd", "b.dd", "c.dd")]]
+
+
+def test_extractor_cache_survives_full_reindex_and_version_rollback(tmp_path, make_engine, counting_extractor):
+    calls = counting_extractor(".cc", version="1")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(5):
+        (docs / f"f{i}.cc").write_text(f"cached {i}")
+    engine = make_engine(extractor_cache_bytes=10 * 1024 * 1024)
+    engine.index_directory(str(docs))
+    assert len(calls) == 5
+    # A full re-index reuses the cached output.
+    assert engine.index_directory(str(docs), incremental=False)["changed"] == 5
+    assert len(calls) == 5
+    # A new extractor version re-extracts; rolling back hits the cache again.
+    calls_v2 = counting_extractor(".cc", version="2")
+    assert engine.index_directory(str(docs))["changed"] == 5
+    assert len(calls_v2) == 5
+    calls_v1 = counting_extractor(".cc", version="1")
+    assert engine.index_directory(str(docs))["changed"] == 5
+    assert calls_v1 == []
+    assert len(engine.search("cached", limit=None)) == 5
+
+
+def test_extractor_cache_is_not_reused_under_other_text_limits(tmp_path, make_engine, counting_extractor):
+    calls = counting_extractor(".cc")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "long.cc").write_text("word " * 100)
+    options = {"extractor_cache_bytes": 10 * 1024 * 1024}
+    short = make_engine(max_text_chars=20, **options)
+    short.index_directory(str(docs))
+    short.shutdown()
+    assert len(calls) == 1
+
+    engine = make_engine(max_text_chars=1000, **options)
+    engine.index_directory(str(docs), incremental=False)
+    assert len(calls) == 2
+    assert engine.storage.get_metadata(str(docs / "long.cc"))["full_text"].count("word") == 100
+    engine.shutdown()
+    # The entry cached under the old limit is still there for that limit.
+    make_engine(max_text_chars=20, **options).index_directory(str(docs), incremental=False)
+    assert len(calls) == 2
+
+
+def test_failing_file_is_quarantined_until_released(tmp_path, make_engine, register_extractor):
+    calls = []
+
+    def broken(file_path):
+        calls.append(file_path)
+        raise ValueError("cannot parse")
+
+    register_extractor(".qq", broken)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "bad.qq").write_text("x")
+    (docs / "good.txt").write_text("fine")
+    engine = make_engine()
+    stats = engine.index_directory(str(docs))
+    assert (stats["added"], stats["errors"]) == (1, 1)
+    [entry] = engine.get_quarantined()
+    assert (entry["file_path"], entry["failures"], entry["last_error"]) == (str(docs / "bad.qq"), 1, "cannot parse")
+    assert engine.index_directory(str(docs))["quarantined"] == 1
+    assert len(calls) == 1
+    engine.release_quarantine(str(docs / "bad.qq"))
+    assert engine.index_directory(str(docs))["errors"] == 1
+    assert len(calls) == 2
+    # Released files start over at one failure.
+    assert engine.get_quarantined()[0]["failures"] == 1
+
+
+def test_read_only_engine_queries_but_never_writes(tmp_path, make_engine):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("replica contents")
+    writer = make_engine()
+    writer.index_directory(str(docs))
+    writer.shutdown()
+
+    for immutable in (False, True):
+        engine = make_engine(read_only=True, immutable=immutable, enable_watchdog=True, scan_paths=[str(docs)])
+        assert engine._watcher is None
+        assert list(engine.search("replica")) == [str(docs / "a.txt")]
+        for write in (lambda: engine.index_directory(str(docs)),
+                      lambda: engine.process_file(str(docs / "a.txt")),
+                      lambda: engine.annotate(str(docs / "a.txt"), {"team": "x"}),
+                      lambda: engine.remove_file(str(docs / "a.txt"))):
+            with pytest.raises(RuntimeError):
+                write()
+        engine.shutdown()
+
+
+def test_read_only_engine_rejects_a_missing_index(make_engine):
+    with pytest.raises(RuntimeError):
+        make_engine(read_only=True)
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_symlinked_root_is_indexed_incrementally(tmp_path, make_engine, workers):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("alpha")
+    (docs / "b.txt").write_text("beta")
+    link = tmp_path / "link"
+    link.symlink_to(docs, target_is_directory=True)
+    engine = make_engine(index_workers=workers, index_executor="thread")
+    assert engine.index_directory(str(link))["added"] == 2
+    assert engine.index_directory(str(link))["unchanged"] == 2
+    (docs / "b.txt").unlink()
+    stats = engine.index_directory(str(link))
+    assert (stats["added"], stats["unchanged"], stats["deleted"]) == (0, 1, 1)
+    assert list(engine.search("beta")) == []
+
+
+def test_early_matches_follow_the_background_indexer(tmp_path, make_engine, register_extractor):
+    base = get_extractor_for("file.txt")
+    calls = []
+    started = threading.Event()
+
+    def slow(file_path):
+        calls.append(file_path)
+        started.set()
+        time.sleep(0.01)
+        return base(file_path)
+
+    register_extractor(".sl", slow)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(40):
+        (docs / f"f{i:02}.sl").write_text("needle" if i in (5, 35) else "hay")
+    engine = make_engine(lazy_indexing=True, scan_paths=[str(docs)], index_executor="thread")
+    engine.search("nothing", wait=0)
+    assert started.wait(5)
+    assert sorted(engine.iter_matches("needle")) == [str(docs / "f05.sl"), str(docs / "f35.sl")]
+    assert engine._indexer.wait(10)
+    # Every file was extracted once, by the background indexer.
+    assert sorted(calls) == sorted(str(path) for path in docs.iterdir())
+
+
+def test_incremental_pass_counts_added_changed_unchanged_and_deleted(tmp_path, make_engine, counting_extractor):
+    calls = counting_extractor(".ii")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for name in ("a.ii", "b.ii", "c.ii"):
+        (docs / name).write_text(f"first {name}")
+    engine = make_engine()
+    assert engine.index_directory(str(docs)) == {
+        "added": 3, "changed": 0, "unchanged": 0, "deleted": 0, "errors": 0, "quarantined": 0}
+    # A pass over an unchanged tree extracts nothing.
+    assert engine.index_directory(str(docs))["unchanged"] == 3
+    assert len(calls) == 3
+
+    (docs / "a.ii").write_text("second version, longer")
+    (docs / "b.ii").unlink()
+    (docs / "d.ii").write_text("new file")
+    stats = engine.index_directory(str(docs))
+    assert (stats["added"], stats["changed"], stats["unchanged"], stats["deleted"]) == (1, 1, 1, 1)
+    assert sorted(calls[3:]) == [str(docs / "a.ii"), str(docs / "d.ii")]
+    assert list(engine.search("second")) == [str(docs / "a.ii")]
+    assert engine.get_metadata(str(docs / "b.ii")) is None
+    # A full pass re-extracts everything.
+    assert engine.index_directory(str(docs), incremental=False)["changed"] == 3
+
+
+def test_touched_file_is_not_extracted_again_with_hash_contents(tmp_path, make_engine, counting_extractor):
+    calls = counting_extractor(".hh")
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.hh").write_text("same bytes")
+    engine = make_engine(hash_contents=True)
+    engine.index_directory(str(docs))
+    stat = os.stat(docs / "a.hh")
+    os.utime(docs / "a.hh", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert engine.index_directory(str(docs))["unchanged"] == 1
+    (docs / "a.hh").write_text("diff bytes")
+    assert engine.index_directory(str(docs))["changed"] == 1
+    assert len(calls) == 2
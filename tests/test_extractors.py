@@ -0,0 +1,95 @@
+import codecs
+
+import pytest
+
+from metasearch import extractors
+from metasearch.extractors import (TextLimits, build_text_limits, cap_text, extract_text_metadata, read_text_file,
+                                   text_limits)
+
+
+def test_head_window_caps_bytes_and_characters(tmp_path):
+    path = tmp_path / "big.log"
+    path.write_text("".join(f"line {i:06}\n" for i in range(200000)))
+    text, info = read_text_file(str(path), TextLimits(max_bytes=1000, max_chars=10 ** 6, window="head"))
+    assert (len(text), info["bytes_read"], info["truncated"]) == (1000, 1000, True)
+    assert text.startswith("line 000000\n")
+    text, info = read_text_file(str(path), TextLimits(max_bytes=10 ** 9, max_chars=60, window="head"))
+    assert (text, info["truncated"]) == ("".join(f"line {i:06}\n" for i in range(5)), True)
+    # Reading stops after the chunk that filled the character budget.
+    assert info["bytes_read"] == extractors._READ_CHUNK < path.stat().st_size
+    text, info = read_text_file(str(path), TextLimits(max_bytes=10 ** 9, max_chars=10 ** 9, window="head"))
+    assert (len(text), info["truncated"]) == (path.stat().st_size, False)
+
+
+def test_head_tail_window_keeps_both_ends(tmp_path):
+    path = tmp_path / "big.log"
+    path.write_text("".join(f"line {i:05}\n" for i in range(10000)))
+    text, info = read_text_file(str(path), TextLimits(max_bytes=2200, max_chars=10 ** 6, window="head_tail"))
+    head, tail = text.split("\n[...]\n")
+    assert head.startswith("line 00000") and tail.endswith("line 09999\n")
+    assert (info["bytes_read"], info["truncated"]) == (2200, True)
+
+
+def test_head_tail_window_applies_to_the_character_cap(tmp_path):
+    path = tmp_path / "small.log"
+    path.write_text("".join(f"line {i:05}\n" for i in range(100)))
+    text, info = read_text_file(str(path), TextLimits(max_bytes=10 ** 6, max_chars=44, window="head_tail"))
+    assert text == "line 00000\nline 00001\n\n[...]\nline 00098\nline 00099\n"
+    assert (info["bytes_read"], info["truncated"]) == (1100, True)
+
+
+def test_cap_text_keeps_head_or_head_and_tail():
+    pieces = [f"slide {i}" for i in range(100)]
+    assert cap_text(pieces, TextLimits(0, 1000, "head")) == ("\n".join(pieces), False)
+    text, truncated = cap_text(iter(pieces), TextLimits(0, 20, "head"))
+    assert (text, truncated) == ("slide 0\nslide 1\nslid", True)
+    text, truncated = cap_text(pieces, TextLimits(0, 40, "head_tail"))
+    assert truncated and text.startswith("slide 0\n") and text.endswith("slide 99")
+    assert "[...]" in text
+
+
+@pytest.mark.parametrize("data, encoding", [
+    (codecs.BOM_UTF8 + "bom café".encode("utf-8"), "utf-8-sig"),
+    (codecs.BOM_UTF16_LE + "wide café".encode("utf-16-le"), "utf-16"),
+    ("plain café".encode("utf-8"), "utf-8"),
+])
+def test_encoding_is_detected_from_the_leading_bytes(tmp_path, data, encoding):
+    path = tmp_path / "sample.txt"
+    path.write_bytes(data)
+    text, info = read_text_file(str(path), extractors.DEFAULT_TEXT_LIMITS)
+    assert info["encoding"] == encoding
+    assert text.endswith("café")
+
+
+def test_encoding_sample_stops_at_the_sample_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(extractors, "_ENCODING_SAMPLE_BYTES", 16)
+    path = tmp_path / "sample.txt"
+    # Only the UTF-8 prefix is sampled; the stray Latin-1 byte later is replaced, not fatal.
+    path.write_bytes(b"ascii only prefix, then caf\xe9")
+    text, info = read_text_file(str(path), extractors.DEFAULT_TEXT_LIMITS)
+    assert info["encoding"] == "utf-8"
+    assert text == "ascii only prefix, then caf\ufffd"
+
+
+def test_truncation_is_recorded_in_the_metadata(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("word " * 1000)
+    with text_limits(build_text_limits(10 ** 6, 100, per_type={"text": {"window": "head_tail"}})):
+        metadata = extract_text_metadata(str(path))
+    assert len(metadata["full_text"]) == 100 + len("\n[...]\n")
+    assert (metadata["text_truncated"], metadata["text_window"]) == (True, "head_tail")
+    assert metadata["text_encoding"] == "utf-8"
+    metadata = extract_text_metadata(str(path))
+    assert metadata["text_truncated"] is False and "text_window" not in metadata
+
+
+def test_engine_applies_the_configured_caps(tmp_path, make_engine):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "long.txt").write_text("start " + "filler " * 1000 + "finish")
+    engine = make_engine(max_text_chars=200, text_window="head_tail")
+    engine.index_directory(str(docs))
+    assert list(engine.search("start finish")) == [str(docs / "long.txt")]
+    metadata = engine.get_metadata(str(docs / "long.txt"))
+    assert metadata["text_truncated"] is True
+    assert len(metadata["full_text"]) <= 200 + len("\n[...]\n")
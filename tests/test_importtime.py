@@ -0,0 +1,25 @@
+import os
+
+from metasearch import importtime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _use_checkout(monkeypatch):
+    # The probe interpreters must import this checkout, wherever pytest runs from.
+    monkeypatch.setenv("PYTHONPATH", REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+
+
+def test_engine_import_leaves_heavy_modules_alone(monkeypatch):
+    # Timing is left to `python -m metasearch.importtime`; wall-clock budgets are flaky under pytest.
+    _use_checkout(monkeypatch)
+    _, modules = importtime.measure("metasearch.engine")
+    heavy = importtime.heavy_modules(modules)
+    assert heavy == [], f"imported eagerly: {heavy}"
+
+
+def test_package_import_is_lazy(monkeypatch):
+    _use_checkout(monkeypatch)
+    _, modules = importtime.measure("metasearch")
+    assert "metasearch.engine" not in modules
+    assert "sqlite3" not in modules
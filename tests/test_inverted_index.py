@@ -0,0 +1,56 @@
+from metasearch.plugins.inverted_index import InvertedIndex
+from metasearch.plugins.text_search import TextSearchPlugin
+
+
+def _paths(results):
+    return [file_path for file_path, _ in results]
+
+
+def test_search_matches_every_word_case_and_accent_folded():
+    index = InvertedIndex()
+    index.add("a", "Quarterly Report report")
+    index.add("b", "report café")
+    index.add("c", "other")
+    assert _paths(index.search("report")) == ["a", "b"]
+    assert _paths(index.search("CAFE report")) == ["b"]
+    assert index.search("missing") == []
+    assert index.search("") == []
+
+
+def test_words_split_like_the_fts_index():
+    index = InvertedIndex()
+    index.add("a", "report_final draft")
+    index.add("b", "Straße")
+    assert _paths(index.search("final")) == ["a"]
+    assert _paths(index.search("report_final")) == ["a"]
+    assert _paths(index.search("STRASSE")) == []
+    assert _paths(index.search("straße")) == ["b"]
+
+
+def test_readding_and_removing_replace_documents():
+    index = InvertedIndex()
+    index.add("a", "report")
+    index.add("b", "report")
+    index.add("a", "nothing")
+    index.remove("b")
+    assert index.search("report") == []
+    assert _paths(index.search("nothing")) == ["a"]
+    assert len(index) == 1
+
+
+def test_compaction_keeps_results():
+    index = InvertedIndex()
+    for i in range(5000):
+        index.add(f"p{i % 100}", f"w{i} common")
+    assert len(index._paths) < 5000
+    assert len(index.search("common")) == 100
+    assert _paths(index.search("w4999")) == ["p99"]
+    assert len(index.search("common", limit=3)) == 3
+
+
+def test_text_plugin_returns_paths_and_scores():
+    plugin = TextSearchPlugin()
+    plugin.index_files([{"file_path": "x", "full_text": "hello world"}, {"file_path": "y", "full_text": "hello"}])
+    assert [result["file_path"] for result in plugin.search("hello world")] == ["x"]
+    plugin.remove_file("x")
+    assert plugin.search("world") == []
@@ -0,0 +1,77 @@
+import os
+import sqlite3
+
+import pytest
+
+from metasearch import extractors
+
+
+def _crash(file_path):
+    # Kills the worker process, like a segfault in a native extractor library.
+    os._exit(1)
+
+
+def _record_stat_hint(file_path):
+    # Whether the pipeline handed the scanner's stat_result to the worker.
+    metadata = extractors.get_extractor_for("file.txt")(file_path)
+    metadata["stat_hint"] = str(getattr(extractors._stat_hint, "value", None) is not None).lower()
+    return metadata
+
+
+def _make_tree(root, count):
+    docs = root / "docs"
+    docs.mkdir()
+    for i in range(count):
+        (docs / f"f{i:04d}.txt").write_text(f"document {i}")
+    return docs
+
+
+def test_worker_crash_while_submitting_does_not_abort_the_run(tmp_path, make_engine, register_extractor):
+    register_extractor(".crash", _crash)
+    docs = _make_tree(tmp_path, 2000)
+    (docs / "a.crash").write_text("boom")
+    (docs / "b.crash").write_text("boom")
+    engine = make_engine(index_workers=4, index_executor="process")
+    stats = engine.index_directory(str(docs))
+    assert stats["added"] == 2000
+    assert stats["errors"] == 2
+    assert {row["file_path"] for row in engine.get_quarantined()} == {
+        str(docs / "a.crash"), str(docs / "b.crash")}
+
+
+def test_parallel_and_serial_runs_agree(tmp_path, make_engine):
+    docs = _make_tree(tmp_path, 50)
+    serial = make_engine(db_path=str(tmp_path / "serial.db"))
+    parallel = make_engine(db_path=str(tmp_path / "parallel.db"), index_workers=4, index_executor="thread")
+    assert serial.index_directory(str(docs))["added"] == 50
+    assert parallel.index_directory(str(docs))["added"] == 50
+    assert sorted(serial.search("document", limit=None)) == sorted(parallel.search("document", limit=None))
+    (docs / "f0000.txt").unlink()
+    assert parallel.index_directory(str(docs))["deleted"] == 1
+    assert parallel.index_directory(str(docs))["unchanged"] == 49
+
+
+def test_work_resubmitted_after_a_crash_keeps_its_stat(tmp_path, make_engine, register_extractor):
+    register_extractor(".crash", _crash)
+    register_extractor(".hint", _record_stat_hint)
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    for i in range(200):
+        (docs / f"f{i:03d}.hint").write_text(f"hinted {i}")
+    (docs / "a.crash").write_text("boom")
+    engine = make_engine(index_workers=4, index_executor="process")
+    stats = engine.index_directory(str(docs))
+    assert (stats["added"], stats["errors"]) == (200, 1)
+    assert len(engine.search("stat_hint:true", limit=None)) == 200
+
+
+def test_failed_writes_abort_the_run(tmp_path, make_engine, monkeypatch):
+    docs = _make_tree(tmp_path, 20)
+    engine = make_engine(index_workers=2, index_executor="thread", write_batch_size=5)
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(engine.storage, "_apply_writes", fail)
+    with pytest.raises(sqlite3.OperationalError):
+        engine.index_directory(str(docs))
@@ -0,0 +1,79 @@
+import pytest
+
+from metasearch.query_parser import (And, Field, Not, Or, QuerySyntaxError, Range, Term, parse_query,
+                                     plan_query)
+from metasearch.storage import Storage
+
+DOCUMENTS = [
+    {"file_path": "/docs/report_final.txt", "size_bytes": 120, "full_text": "report_final draft for Q3",
+     "author": "Kunal Wagh"},
+    {"file_path": "/docs/café.md", "size_bytes": 2048, "full_text": "Crème brûlée RECIPE, naïve version",
+     "author": "Ana"},
+    {"file_path": "/docs/Straße.txt", "size_bytes": 10, "full_text": "Straße und GROSS don't stop-me"},
+    {"file_path": "/docs/notes.log", "size_bytes": 0, "full_text": "meeting notes: budget 2024"},
+]
+
+QUERIES = [
+    "report", "final", "report_final", "REPORT final", "draft*", "repo*", '"report final"', '"final draft"',
+    "cafe", "creme brulee", '"crème brûlée"', "naive", "recipe", "strasse", "straße", "gross", "don",
+    "stop me", "budget 2024", "notes", "no*", "_", "report OR meeting", "NOT report", "recipe AND NOT ana",
+    "author:ana", "author:Kun*", "author:\"kunal wagh\"", "size_bytes:[100 TO *]", "extension:.txt final",
+    "(draft OR budget) NOT extension:log", "file_name:notes",
+]
+
+
+@pytest.fixture(scope="module")
+def storage(tmp_path_factory):
+    storage = Storage(str(tmp_path_factory.mktemp("parity") / "index.db"))
+    storage.save_metadata_many(DOCUMENTS)
+    yield storage
+    storage.close()
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_in_memory_predicate_agrees_with_sql(storage, query):
+    found = {row["file_path"] for row in storage.search(query, limit=None)}
+    matched = {document["file_path"] for document in DOCUMENTS if storage.matches(query, document)}
+    assert matched == found
+
+
+def test_operators_group_and_bind_as_documented():
+    assert parse_query("a OR b c") == Or((Term("a", False), And((Term("b", False), Term("c", False)))))
+    assert parse_query("(a OR b) AND NOT c") == And((Or((Term("a", False), Term("b", False))),
+                                                     Not(Term("c", False))))
+    assert parse_query("ANDROID.txt ORDER") == And((Term("ANDROID.txt", False), Term("ORDER", False)))
+    assert parse_query('author:"Kunal Wagh" size_bytes:[1 TO *]') == And((
+        Field("author", "Kunal Wagh", True, False), Range("size_bytes", "1", None)))
+
+
+@pytest.mark.parametrize("query", ["(a OR b", "a OR", "NOT", "a)", "AND b"])
+def test_malformed_queries_are_rejected(query):
+    with pytest.raises(QuerySyntaxError):
+        parse_query(query)
+
+
+def test_planner_puts_indexed_predicates_before_text():
+    where = plan_query("NOT draft file_name:notes size_bytes:[1 TO 9] extension:txt", True).where
+    order = [where.index(fragment) for fragment in ("extension = ?", "size_bytes BETWEEN", "file_name LIKE",
+                                                    "NOT (")]
+    assert order == sorted(order)
+
+
+def test_plans_are_cached_by_query_string():
+    query = "cached plan OR (other AND NOT plan)"
+    plan_query(query, True)
+    hits = plan_query.cache_info().hits
+    assert plan_query(query, True) is plan_query(query, True)
+    assert plan_query.cache_info().hits == hits + 2
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("report OR meeting", ["/docs/notes.log", "/docs/report_final.txt"]),
+    ("NOT report", ["/docs/Straße.txt", "/docs/café.md", "/docs/notes.log"]),
+    ("(draft OR budget) NOT extension:log", ["/docs/report_final.txt"]),
+    ("recipe OR author:Kun* OR size_bytes:[0 TO 10]",
+     ["/docs/Straße.txt", "/docs/café.md", "/docs/notes.log", "/docs/report_final.txt"]),
+    ("NOT (author:ana OR extension:txt)", ["/docs/notes.log"]),
+])
+def test_boolean_queries(storage, query, expected):
+    assert sorted(row["file_path"] for row in storage.search(query, limit=None)) == expected
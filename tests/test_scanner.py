@@ -0,0 +1,177 @@
+import os
+
+import pytest
+
+from metasearch import Config, scanner
+from metasearch.scanner import DirectorySnapshot, is_path_excluded, scan_directory, scan_entries
+
+
+def _tree(tmp_path):
+    root = tmp_path / ".hid" / "build" / "w"
+    (root / "sub").mkdir(parents=True)
+    (root / ".cache").mkdir()
+    for rel in ("a.txt", "sub/b.txt", "sub/c.log", ".secret.txt", ".cache/d.txt"):
+        (root / rel).write_text("x")
+    return root
+
+
+def test_watcher_rules_agree_with_the_scanner(tmp_path):
+    root = _tree(tmp_path)
+    config = Config(scan_paths=[str(root)], skip_hidden=True, scan_exclude=["build", "sub/*.log"])
+    scanned = set(scan_directory(str(root), config))
+    assert scanned == {str(root / "a.txt"), str(root / "sub" / "b.txt")}
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            file_path = os.path.join(dirpath, name)
+            assert is_path_excluded(file_path, config) == (file_path not in scanned), file_path
+
+
+def test_components_above_the_scan_root_are_ignored(tmp_path):
+    root = _tree(tmp_path)
+    config = Config(scan_paths=[str(root)], skip_hidden=True, scan_exclude=["build"])
+    assert not is_path_excluded(str(root / "sub"), config, is_dir=True)
+    assert is_path_excluded(str(root / ".cache"), config, is_dir=True)
+    # Outside every scan root all components count, as before.
+    assert is_path_excluded(str(tmp_path / ".hid" / "other.txt"), config)
+
+
+def test_include_globs_match_root_relative_paths(tmp_path):
+    root = _tree(tmp_path)
+    config = Config(scan_paths=[str(root)], scan_include=["sub/*.txt"])
+    assert not is_path_excluded(str(root / "sub" / "b.txt"), config)
+    assert is_path_excluded(str(root / "a.txt"), config)
+    assert set(scan_directory(str(root), config)) == {str(root / "sub" / "b.txt")}
+
+
+def test_default_excludes_are_pruned_without_being_listed(tmp_path, monkeypatch):
+    for rel in ("a.txt", ".git/objects/o", "node_modules/pkg/index.js", "src/b.txt"):
+        (tmp_path / rel).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / rel).write_text("x")
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(scanner.os, "scandir", counting_scandir)
+    assert set(scan_directory(str(tmp_path))) == {str(tmp_path / "a.txt"), str(tmp_path / "src" / "b.txt")}
+    assert sorted(listed) == [str(tmp_path), str(tmp_path / "src")]
+
+
+def test_depth_and_size_limits(tmp_path):
+    (tmp_path / "one" / "two").mkdir(parents=True)
+    for rel, size in (("top.txt", 5), ("one/mid.txt", 50), ("one/two/deep.txt", 5), ("empty.txt", 0)):
+        (tmp_path / rel).write_bytes(b"x" * size)
+
+    def paths(**options):
+        return sorted(os.path.relpath(path, tmp_path) for path in scan_directory(str(tmp_path), Config(**options)))
+
+    assert paths(scan_max_depth=0) == ["empty.txt", "top.txt"]
+    assert paths(scan_max_depth=1) == ["empty.txt", "one/mid.txt", "top.txt"]
+    assert paths(min_file_size=1, max_file_size=10) == ["one/two/deep.txt", "top.txt"]
+
+
+def test_symlinks_are_skipped_unless_followed(tmp_path):
+    root = tmp_path / "root"
+    (root / "real").mkdir(parents=True)
+    (root / "real" / "a.txt").write_text("x")
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    (outside / "b.txt").write_text("x")
+    (root / "linked").symlink_to(outside, target_is_directory=True)
+    (root / "loop").symlink_to(root, target_is_directory=True)
+    (root / "alias.txt").symlink_to(root / "real" / "a.txt")
+    assert set(scan_directory(str(root))) == {str(root / "real" / "a.txt")}
+    # Followed links resolve to their targets; loops and repeated files are visited once.
+    followed = list(scan_directory(str(root), Config(follow_symlinks=True)))
+    assert sorted(followed) == [str(outside / "b.txt"), str(root / "real" / "a.txt")]
+
+
+def test_entries_carry_the_stat_of_the_listing(tmp_path):
+    (tmp_path / "a.txt").write_text("12345")
+    [entry] = scan_entries(str(tmp_path))
+    assert entry.path == str(tmp_path / "a.txt")
+    assert (entry.stat.st_size, entry.stat.st_mtime_ns) == (5, os.stat(tmp_path / "a.txt").st_mtime_ns)
+
+
+def _rescan(root, config, previous):
+    """
+    Scan root with the directory states and files of a previous pass;
+    returns (entries, dir_records, directories listed).
+    """
+    dir_records, file_paths = previous
+    snapshot = DirectorySnapshot([(path, *record) for path, record in dir_records.items()], file_paths)
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+
+    records = {}
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(os, "scandir", counting_scandir)
+        entries = list(scan_entries(str(root), config, snapshot, records))
+    return entries, records, listed
+
+
+def _first_pass(root, config):
+    records = {}
+    entries = list(scan_entries(str(root), config, None, records))
+    return records, [entry.path for entry in entries]
+
+
+@pytest.fixture
+def settled(monkeypatch):
+    # Trust directory mtimes at once instead of after the settle window.
+    monkeypatch.setattr(scanner, "_DIR_MTIME_SETTLE_NS", -10 ** 9)
+
+
+def test_unchanged_directories_are_not_listed_again(tmp_path, settled):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.txt").write_text("a")
+    (tmp_path / "sub" / "b.txt").write_text("b")
+    config = Config()
+    previous = _first_pass(tmp_path, config)
+    entries, _, listed = _rescan(tmp_path, config, previous)
+    assert listed == []
+    assert sorted(entry.path for entry in entries) == [str(tmp_path / "a.txt"), str(tmp_path / "sub" / "b.txt")]
+    assert all(entry.stat is not None and not entry.trusted for entry in entries)
+
+    (tmp_path / "sub" / "c.txt").write_text("c")
+    entries, _, listed = _rescan(tmp_path, config, previous)
+    assert listed == [str(tmp_path / "sub")]
+    assert len(entries) == 3
+
+
+def test_recently_modified_directories_are_listed_again(tmp_path):
+    (tmp_path / "a.txt").write_text("a")
+    config = Config()
+    previous = _first_pass(tmp_path, config)
+    assert previous[0][str(tmp_path)][1] is None
+    _, _, listed = _rescan(tmp_path, config, previous)
+    assert listed == [str(tmp_path)]
+
+
+def test_trusted_directory_mtimes_skip_the_stat(tmp_path, settled):
+    (tmp_path / "a.txt").write_text("a")
+    config = Config(trust_dir_mtime=True)
+    entries, _, listed = _rescan(tmp_path, config, _first_pass(tmp_path, config))
+    assert listed == []
+    assert entries == [scanner.ScanEntry(str(tmp_path / "a.txt"), None, True)]
+
+
+def test_file_growing_into_the_size_range_is_found(tmp_path, settled):
+    small = tmp_path / "small.txt"
+    small.write_text("abc")
+    (tmp_path / "big.txt").write_text("x" * 20)
+    config = Config(min_file_size=10)
+    previous = _first_pass(tmp_path, config)
+    assert previous[1] == [str(tmp_path / "big.txt")]
+    mtime_ns = os.stat(tmp_path).st_mtime_ns
+    small.write_text("y" * 20)
+    os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+    entries, _, listed = _rescan(tmp_path, config, previous)
+    assert listed == [str(tmp_path)]
+    assert sorted(entry.path for entry in entries) == [str(tmp_path / "big.txt"), str(small)]
@@ -0,0 +1,132 @@
+import time
+
+import pytest
+
+from metasearch.plugins import search_plugin
+from metasearch.plugins.search_plugin import SearchPlugin, merge_ranked
+from metasearch.plugins.text_search import TextSearchPlugin
+
+
+class RecordingPlugin(SearchPlugin):
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def search(self, query_str, limit=None):
+        self.queries.append(query_str)
+        return self.results
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    plugins = []
+    monkeypatch.setattr(search_plugin, "_SEARCH_PLUGIN_REGISTRY", plugins)
+    return plugins
+
+
+@pytest.fixture
+def docs(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "a.txt").write_text("invoice for march")
+    (docs / "b.txt").write_text("invoice for april")
+    (docs / "c.txt").write_text("meeting notes")
+    return docs
+
+
+@pytest.fixture
+def loaded_engine(make_engine):
+    def make(**options):
+        engine = make_engine(**options)
+        assert engine.plugins.wait(10)
+        return engine
+    return make
+
+
+def test_plugins_are_fed_while_indexing_and_results_merged(docs, registry, loaded_engine):
+    plugin = TextSearchPlugin()
+    registry.append(plugin)
+    engine = loaded_engine()
+    engine.index_directory(str(docs))
+    assert sorted(engine.search("invoice")) == [str(docs / "a.txt"), str(docs / "b.txt")]
+    assert [result["file_path"] for result in plugin.search("march")] == [str(docs / "a.txt")]
+    (docs / "a.txt").unlink()
+    engine.index_directory(str(docs))
+    assert plugin.search("march") == []
+
+
+def test_plugin_hits_must_match_the_rest_of_the_query(docs, registry, loaded_engine):
+    registry.append(TextSearchPlugin())
+    engine = loaded_engine()
+    engine.index_directory(str(docs))
+    assert list(engine.search("NOT invoice")) == [str(docs / "c.txt")]
+    assert list(engine.search("extension:pdf invoice")) == []
+    assert list(engine.search("file_name:a invoice")) == [str(docs / "a.txt")]
+
+
+def test_plugins_only_get_plain_words(docs, registry, loaded_engine):
+    plugin = RecordingPlugin([str(docs / "c.txt")])
+    registry.append(plugin)
+    engine = loaded_engine()
+    engine.index_directory(str(docs))
+    engine.search("NOT invoice")
+    engine.search("inv* OR meeting")
+    assert plugin.queries == []
+    # The plugin claims c.txt, which has no .pdf extension: filtered out.
+    assert list(engine.search("extension:pdf notes")) == []
+    assert plugin.queries == ["notes"]
+
+
+def test_plugins_load_in_the_background(registry, make_engine, loaded_engine):
+    storage_engine = loaded_engine()
+    storage_engine.storage.save_metadata_many([
+        {"file_path": f"/data/f{i}.txt", "file_name": f"f{i}.txt", "size_bytes": 1, "extension": ".txt",
+         "full_text": f"row{i} common"}
+        for i in range(20000)
+    ])
+    storage_engine.shutdown()
+
+    plugin = TextSearchPlugin()
+    registry.append(plugin)
+    engine = make_engine(plugin_timeout=0.05, plugin_backfill=True)
+    started = time.monotonic()
+    assert list(engine.search("row7")) == ["/data/f7.txt"]
+    assert time.monotonic() - started < 0.5
+    engine.storage.save_metadata({"file_path": "/data/new.txt", "file_name": "new.txt", "size_bytes": 1,
+                                  "extension": ".txt", "full_text": "fresh"})
+    engine.plugins.add({"file_path": "/data/new.txt", "full_text": "fresh"})
+    engine.plugins.flush()
+    assert engine.plugins.wait(30)
+    assert len(plugin._index) == 20001
+    assert [result["file_path"] for result in plugin.search("fresh")] == ["/data/new.txt"]
+
+
+def test_plugins_are_not_backfilled_unless_asked(docs, registry, make_engine):
+    make_engine().index_directory(str(docs))
+    registry.append(TextSearchPlugin)
+    for options in ({}, {"read_only": True}):
+        engine = make_engine(**options)
+        [plugin] = engine.plugins.plugins()
+        assert plugin.search("invoice") == []
+        assert sorted(engine.search("invoice")) == [str(docs / "a.txt"), str(docs / "b.txt")]
+        engine.shutdown()
+    engine = make_engine(read_only=True, plugin_backfill=True)
+    assert engine.plugins.wait(10)
+    [plugin] = engine.plugins.plugins()
+    assert len(plugin.search("invoice")) == 2
+
+
+def test_registered_classes_are_instantiated_per_engine(tmp_path, docs, registry, make_engine):
+    registry.append(TextSearchPlugin)
+    first = make_engine(db_path=str(tmp_path / "first.db"))
+    second = make_engine(db_path=str(tmp_path / "second.db"))
+    first.index_directory(str(docs))
+    [first_plugin], [second_plugin] = first.plugins.plugins(), second.plugins.plugins()
+    assert first_plugin is not second_plugin
+    assert len(first_plugin.search("invoice")) == 2
+    assert second_plugin.search("invoice") == []
+    assert list(second.search("invoice")) == []
+
+
+def test_merge_ranked_prefers_paths_found_by_several_sources():
+    assert merge_ranked([["a", "b", "c"], ["c", "d"]]) == ["c", "a", "b", "d"]
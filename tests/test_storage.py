@@ -0,0 +1,290 @@
+import json
+import sqlite3
+
+import pytest
+
+from metasearch.storage import SCHEMA_VERSION, Storage
+
+
+def _user_version(db_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def test_new_database_is_stamped_and_not_migrated_again(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "index.db")
+    Storage(db_path).close()
+    assert _user_version(db_path) == SCHEMA_VERSION
+
+    def fail(self):
+        raise AssertionError("migration re-ran on an up-to-date database")
+
+    monkeypatch.setattr(Storage, "_migrate_timestamps_to_ns", fail)
+    monkeypatch.setattr(Storage, "_migrate_metadata_layout", fail)
+    Storage(db_path).close()
+    assert _user_version(db_path) == SCHEMA_VERSION
+
+
+def test_old_database_is_migrated_once(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "index.db")
+    Storage(db_path).close()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA user_version = 0")
+    calls = []
+    monkeypatch.setattr(Storage, "_migrate_timestamps_to_ns", lambda self: calls.append("timestamps"))
+    monkeypatch.setattr(Storage, "_migrate_metadata_layout", lambda self: calls.append("layout"))
+    Storage(db_path).close()
+    Storage(db_path).close()
+    assert calls == ["timestamps", "layout"]
+    assert _user_version(db_path) == SCHEMA_VERSION
+
+
+def test_read_only_storage_rejects_writes(tmp_path):
+    db_path = str(tmp_path / "index.db")
+    Storage(db_path).close()
+    storage = Storage(db_path, read_only=True)
+    try:
+        assert storage.count_files() == 0
+        with pytest.raises(RuntimeError):
+            storage.remove_metadata_many(["/nowhere"])
+    finally:
+        storage.close()
+
+
+def test_nested_metadata_is_queried_by_dotted_and_quoted_keys(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        metadata = {
+            "file_path": str(tmp_path / "clip.mp4"),
+            "size_bytes": 10,
+            "ffprobe": {"format": {"duration": "15.2", "format_name": "mov,mp4"}},
+            "exif": {"Image Make": "Canon", "Image Model": "EOS 5D"},
+        }
+        storage.save_metadata(metadata)
+        for query in ("ffprobe.format.duration:[10 TO 20]", "ffprobe.format.format_name:mov*",
+                      '"exif.Image Make":canon', '"exif.Image Model":"EOS 5D"',
+                      '"exif.Image Make":Canon AND ffprobe.format.duration:[15 TO *]'):
+            assert [row["file_path"] for row in storage.search(query)] == [metadata["file_path"]], query
+            assert storage.matches(query, metadata), query
+        for query in ("ffprobe.format.duration:[20 TO 30]", '"exif.Image Make":Nikon'):
+            assert storage.search(query) == [], query
+            assert not storage.matches(query, metadata), query
+    finally:
+        storage.close()
+
+
+def _file(path, text="contents"):
+    return {"file_path": path, "size_bytes": len(text), "full_text": text}
+
+
+def test_write_batch_commits_every_batch_size_operations(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        with storage.write_batch(batch_size=3, flush_interval=60) as batch:
+            batch.add(_file("/data/a.txt"))
+            batch.add(_file("/data/b.txt"))
+            # Readers do not see a batch until it is committed.
+            assert storage.count_files() == 0
+            batch.add(_file("/data/c.txt"))
+            assert storage.count_files() == 3
+            batch.add(_file("/data/d.txt"))
+            assert storage.count_files() == 3
+        assert storage.count_files() == 4
+    finally:
+        storage.close()
+
+
+def test_write_batch_keeps_the_order_of_operations_on_one_path(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        storage.save_metadata_many([_file("/data/a.txt"), _file("/data/b.txt")])
+        with storage.write_batch(batch_size=100, flush_interval=60) as batch:
+            batch.remove("/data/a.txt")
+            batch.add(_file("/data/a.txt", "restored"))
+            batch.add(_file("/data/b.txt", "first"))
+            batch.remove("/data/b.txt")
+        assert storage.get_metadata("/data/a.txt")["full_text"] == "restored"
+        assert storage.get_metadata("/data/b.txt") is None
+    finally:
+        storage.close()
+
+
+def test_write_batch_flushes_after_its_interval(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        with storage.write_batch(batch_size=100, flush_interval=0) as batch:
+            batch.add(_file("/data/a.txt"))
+            assert storage.count_files() == 1
+    finally:
+        storage.close()
+
+
+def _paths(rows):
+    return [row["file_path"] for row in rows]
+
+
+def test_full_text_queries_use_the_fts_index(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        assert storage.fts_enabled
+        storage.save_metadata_many([
+            _file("/data/once.txt", "the quarterly report is late"),
+            _file("/data/often.txt", "report report report, another report"),
+            _file("/data/reporting.txt", "reporting tools"),
+            _file("/data/ANDROID.txt", "android build notes"),
+        ])
+        # Whole words, best bm25 score first.
+        assert _paths(storage.search("report")) == ["/data/often.txt", "/data/once.txt"]
+        assert sorted(_paths(storage.search("report*"))) == ["/data/often.txt", "/data/once.txt",
+                                                             "/data/reporting.txt"]
+        assert _paths(storage.search('"quarterly report"')) == ["/data/once.txt"]
+        assert _paths(storage.search('"report quarterly"')) == []
+        assert _paths(storage.search("android")) == ["/data/ANDROID.txt"]
+        where, _ = storage.parse_query("report")
+        assert "files_fts MATCH" in where and "LIKE" not in where
+    finally:
+        storage.close()
+
+
+def test_existing_database_is_backfilled_into_the_fts_index(tmp_path):
+    db_path = str(tmp_path / "index.db")
+    storage = Storage(db_path)
+    storage.save_metadata(_file("/data/a.txt", "backfilled words"))
+    storage.close()
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("DROP TABLE files_fts")
+    storage = Storage(db_path)
+    try:
+        assert _paths(storage.search("backfilled")) == ["/data/a.txt"]
+    finally:
+        storage.close()
+
+
+def test_limit_offset_and_projection(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        storage.save_metadata_many([_file(f"/data/f{i:02}.txt", f"page {i}") for i in range(30)])
+        assert len(storage.search("page")) == 20
+        assert len(storage.search("page", limit=None)) == 30
+        rows = storage.search("size_bytes:[0 TO *]", limit=5, offset=10, columns=("file_path", "size_bytes"))
+        assert rows == [{"file_path": f"/data/f{i:02}.txt", "size_bytes": len(f"page {i}")} for i in range(10, 15)]
+        with pytest.raises(ValueError):
+            storage.search("page", columns=("file_path", "password"))
+    finally:
+        storage.close()
+
+
+def test_keyset_pages_are_stable_while_files_are_added(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        storage.save_metadata_many([_file(f"/data/f{i:02}.txt") for i in range(25)])
+        pages, cursor = [], None
+        while True:
+            rows, cursor = storage.search_page("extension:txt", limit=10, cursor=cursor, columns=("file_path",))
+            pages.append(_paths(rows))
+            if cursor is None:
+                break
+            # Files indexed meanwhile come after the cursor; nothing is skipped or repeated.
+            storage.save_metadata(_file(f"/data/new{len(pages)}.txt"))
+        found = [path for page in pages for path in page]
+        assert len(found) == len(set(found)) == 27
+        assert found[:25] == [f"/data/f{i:02}.txt" for i in range(25)]
+        # Pages of a ranked text query concatenate to the unpaged result.
+        ranked, cursor = [], None
+        while True:
+            rows, cursor = storage.search_page("contents", limit=7, cursor=cursor, columns=("file_path",))
+            ranked.extend(_paths(rows))
+            if cursor is None:
+                break
+        assert ranked == _paths(storage.search("contents", limit=None, columns=("file_path",)))
+    finally:
+        storage.close()
+
+
+def test_iter_search_streams_rows_lazily(tmp_path):
+    storage = Storage(str(tmp_path / "index.db"))
+    try:
+        storage.save_metadata_many([_file(f"/data/f{i:03}.txt", "export me") for i in range(1200)])
+        rows = storage.iter_search("export", columns=("file_path",), batch_size=100)
+        first = next(rows)
+        assert set(first) == {"file_path"}
+        assert 1 + sum(1 for _ in rows) == 1200
+    finally:
+        storage.close()
+
+
+def test_reads_run_concurrently_with_an_open_write(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    storage = Storage(str(tmp_path / "index.db"), read_connections=2)
+    try:
+        assert storage.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        storage.save_metadata(_file("/data/a.txt", "committed words"))
+        with ThreadPoolExecutor(max_workers=6) as pool, storage._transaction():
+            storage._apply_writes(upserts=[storage._metadata_row(_file("/data/b.txt", "pending words"))])
+            # Readers neither wait for the writer nor see its uncommitted rows.
+            searches = [pool.submit(lambda: _paths(storage.search("words"))) for _ in range(12)]
+            assert [future.result(timeout=5) for future in searches] == [["/data/a.txt"]] * 12
+        assert storage._reader_count <= 2
+        assert sorted(_paths(storage.search("words"))) == ["/data/a.txt", "/data/b.txt"]
+    finally:
+        storage.close()
+
+
+def _raw_metadata(db_path, file_path):
+    with sqlite3.connect(db_path) as conn:
+        return conn.execute("SELECT metadata FROM files WHERE file_path = ?", (file_path,)).fetchone()[0]
+
+
+LONG_TEXT = "extracted text that is long enough to be worth storing only once " * 20
+
+
+@pytest.mark.parametrize("compression", [None, "zlib", "zstd"])
+def test_extracted_text_is_stored_once(tmp_path, compression):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    db_path = str(tmp_path / "index.db")
+    storage = Storage(db_path, compression=compression)
+    try:
+        metadata = {**_file("/data/a.txt", LONG_TEXT), "text_snippet": LONG_TEXT[:200], "author": "Ana"}
+        storage.save_metadata(metadata)
+        raw = _raw_metadata(db_path, "/data/a.txt")
+        assert isinstance(raw, bytes) == (compression is not None)
+        if compression is None:
+            assert "worth storing" not in raw and len(raw) < 400
+        assert storage.get_metadata("/data/a.txt") == metadata
+        # Projections that leave out metadata never decode it.
+        assert storage.search("author:ana", columns=("file_path",)) == [{"file_path": "/data/a.txt"}]
+    finally:
+        storage.close()
+
+
+def test_compressed_and_plain_rows_can_be_mixed(tmp_path):
+    db_path = str(tmp_path / "index.db")
+    storage = Storage(db_path)
+    storage.save_metadata(_file("/data/plain.txt", LONG_TEXT))
+    storage.close()
+    storage = Storage(db_path, compression="zlib")
+    try:
+        storage.save_metadata(_file("/data/packed.txt", LONG_TEXT))
+        assert isinstance(_raw_metadata(db_path, "/data/packed.txt"), bytes)
+        for path in ("/data/plain.txt", "/data/packed.txt"):
+            assert storage.get_metadata(path)["full_text"] == LONG_TEXT
+    finally:
+        storage.close()
+
+
+def test_old_rows_lose_their_second_copy_of_the_text(tmp_path):
+    db_path = str(tmp_path / "index.db")
+    Storage(db_path).close()
+    old = {**_file("/data/old.txt", LONG_TEXT), "text_snippet": LONG_TEXT[:100]}
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO files (file_path, file_name, size_bytes, full_text, metadata) VALUES (?, ?, ?, ?, ?)",
+                     ("/data/old.txt", "old.txt", 1, LONG_TEXT, json.dumps(old)))
+        conn.execute("PRAGMA user_version = 1")
+    storage = Storage(db_path)
+    try:
+        assert len(_raw_metadata(db_path, "/data/old.txt")) < 400
+        assert storage.get_metadata("/data/old.txt") == old
+    finally:
+        storage.close()
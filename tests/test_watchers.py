@@ -0,0 +1,83 @@
+import shutil
+import sqlite3
+
+import pytest
+
+pytest.importorskip("watchdog")
+from watchdog.events import DirDeletedEvent, DirMovedEvent, FileDeletedEvent
+
+from metasearch.watchers import ChangeQueue, FileChangeHandler
+
+
+@pytest.fixture
+def indexed(tmp_path, make_engine):
+    watched = tmp_path / "w"
+    (watched / "project2" / "sub").mkdir(parents=True)
+    (watched / "project2" / "sub" / "a.txt").write_text("alpha")
+    (watched / "keep.txt").write_text("beta")
+    engine = make_engine(scan_paths=[str(watched)])
+    engine.index_directory(str(watched))
+    queue = ChangeQueue(engine, debounce=0)
+    return engine, queue, FileChangeHandler(engine, queue), watched
+
+
+def _indexed_paths(engine):
+    return set(engine.search("file_name:txt", limit=None))
+
+
+def test_directory_moved_out_of_the_tree_is_dropped(indexed, tmp_path):
+    engine, queue, handler, watched = indexed
+    shutil.move(str(watched / "project2"), str(tmp_path / "project2"))
+    # watchdog reports a move out of the watched tree as a directory delete.
+    handler.on_deleted(DirDeletedEvent(str(watched / "project2")))
+    queue._apply_moves()
+    assert _indexed_paths(engine) == {str(watched / "keep.txt")}
+
+
+def test_deleted_file_is_dropped(indexed):
+    engine, queue, handler, watched = indexed
+    (watched / "keep.txt").unlink()
+    handler.on_deleted(FileDeletedEvent(str(watched / "keep.txt")))
+    queue._apply(queue._take_ready())
+    assert _indexed_paths(engine) == {str(watched / "project2" / "sub" / "a.txt")}
+
+
+def test_directory_rename_keeps_files_indexed(indexed):
+    engine, queue, handler, watched = indexed
+    (watched / "project2").rename(watched / "renamed")
+    handler.on_moved(DirMovedEvent(str(watched / "project2"), str(watched / "renamed")))
+    queue._apply_moves()
+    assert _indexed_paths(engine) == {str(watched / "keep.txt"), str(watched / "renamed" / "sub" / "a.txt")}
+
+
+def test_changes_are_counted_instead_of_printed(indexed, capsys):
+    engine, queue, handler, watched = indexed
+    for i in range(50):
+        (watched / f"new{i}.txt").write_text(f"new {i}")
+    (watched / "keep.txt").unlink()
+    changes = [(ChangeQueue.UPSERT, str(watched / f"new{i}.txt"), None) for i in range(50)]
+    changes.append((ChangeQueue.DELETE, str(watched / "keep.txt"), None))
+    capsys.readouterr()
+    assert queue._apply(changes) == {"indexed": 50, "removed": 1, "errors": 0}
+    (watched / "project2").rename(watched / "renamed")
+    handler.on_moved(DirMovedEvent(str(watched / "project2"), str(watched / "renamed")))
+    assert queue._apply_moves() == {"removed": 0, "moved": 1}
+    assert capsys.readouterr().out == ""
+    assert queue.stats == {"indexed": 50, "removed": 1, "moved": 1, "errors": 0}
+
+
+def test_failed_write_keeps_the_changes_queued(indexed, monkeypatch):
+    engine, queue, handler, watched = indexed
+    (watched / "new.txt").write_text("gamma")
+
+    def fail(*args, **kwargs):
+        raise sqlite3.OperationalError("database is locked")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(engine.storage, "_apply_writes", fail)
+        assert queue._apply([(ChangeQueue.UPSERT, str(watched / "new.txt"), None)])["indexed"] == 0
+    assert str(watched / "new.txt") in queue._pending
+    queue.debounce = 0
+    queue._take_ready()  # the first check records size and mtime
+    queue._apply(queue._take_ready())
+    assert str(watched / "new.txt") in _indexed_paths(engine)